@@ -0,0 +1,136 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-14 11:02:46
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-14 11:02:46
+FilePath: /mss_qianshou/app/cli.py
+Description: 命令行工具
+
+    python cli.py bench_startup             # 检查API进程的导入耗时是否超出预算
+    python cli.py backfill --markets=HK     # 并行回补历史日线
+    python cli.py loadtest --symbols=50     # 用模拟的富途和AKShare离线压测
+    python cli.py repair_gaps --dry_run     # 检查并补齐历史日线的缺口
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os, sys, json, tempfile, subprocess, fire
+from pathlib import Path
+
+from qianshou.config import ensure_dirs, IMPORT_BUDGET_S, BACKFILL_WORKERS, BACKFILL_CHUNK_YEARS
+
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# API进程启动时不应该加载的模块
+HEAVY_MODULES = ["akshare", "futu", "qlib", "talib", "yfinance"]
+
+_PROBE = """
+import sys, json, time
+t0 = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t0
+print(json.dumps({{"elapsed": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+_LOADTEST = """
+import json
+from qianshou.simulate import run_loadtest
+print(json.dumps(run_loadtest(**{kwargs!r}), ensure_ascii=False))
+"""
+
+
+def _probe(module: str) -> dict:
+    # 每次都在新进程中导入，避免模块缓存影响结果
+    out = subprocess.run([sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                         cwd=BASE_DIR, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def bench_startup(module: str = "main", runs: int = 3, budget: float = IMPORT_BUDGET_S) -> None:
+    """
+    测量冷启动导入 module 的耗时，超出预算或加载了重量级依赖时返回非0退出码
+    """
+    results = [_probe(module) for _ in range(runs)]
+    best = min(r["elapsed"] for r in results)
+    loaded = sorted({m for r in results for m in r["loaded"]})
+    report = {"module": module, "best_s": round(best, 3), "budget_s": budget, "heavy_loaded": loaded}
+    print(json.dumps(report, ensure_ascii=False))
+    if best > budget or loaded:
+        sys.exit(1)
+
+def _as_list(v) -> list | None:
+    # fire 会把 a,b 解析为元组，单个值解析为字符串或数字
+    if v is None:
+        return None
+    if isinstance(v, (list, tuple)):
+        return [str(x) for x in v]
+    return [x for x in str(v).split(",") if x]
+
+def backfill(symbols: list | None = None, markets: list | None = None,
+             start: str = "1990-01-01", end: str | None = None,
+             workers: int = BACKFILL_WORKERS, chunk_years: int = BACKFILL_CHUNK_YEARS) -> None:
+    """
+    并行回补历史日线，例如 backfill --symbols=00700,09988 --workers=8
+    """
+    from qianshou.sqlite_db import init_db
+    from qianshou.backfill import backfill as run_backfill
+    ensure_dirs()
+    init_db()
+    report = run_backfill(_as_list(symbols), _as_list(markets), str(start), end and str(end), workers, chunk_years)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+def repair_gaps(symbols: list | None = None, markets: list | None = None,
+                start: str | None = None, dry_run: bool = False) -> None:
+    """
+    检查已保存的日线与交易日历，只下载缺失的区间，例如 repair_gaps --markets=HK --dry_run
+    """
+    from qianshou.sqlite_db import init_db
+    from qianshou.gap_repair import repair_gaps as run_repair
+    ensure_dirs()
+    init_db()
+    report = run_repair(_as_list(symbols), _as_list(markets), start and str(start), dry_run)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+def rebuild_bin() -> None:
+    """
+    由原始CSV重新计算指标并全量重建Qlib BIN，例如指标定义变化或BIN损坏时
+    """
+    from qianshou.sqlite_db import init_db
+    from qianshou.bin_tools import convert_csv_to_bin
+    ensure_dirs()
+    init_db()
+    count = convert_csv_to_bin()
+    print(json.dumps({"symbols": count}, ensure_ascii=False))
+    if count == 0:
+        sys.exit(1)
+
+def loadtest(symbols: int = 20, years: int = 5, latency_ms: float = 50, jitter_ms: float = 20,
+             fail_rate: float = 0.0, quota: int = 60, window_s: float = 30, concurrency: int = 8,
+             data_dir: str | None = None, sleeps: bool = False) -> None:
+    """
+    离线压测：模拟的富途和AKShare接口 + 并发查询，输出任务耗时、各阶段耗时和接口 p50/p99
+    数据写入 data_dir（默认新建临时目录），sleeps=False 时去掉任务中避免限频的等待
+    """
+    data_dir = data_dir or tempfile.mkdtemp(prefix="qianshou_sim_")
+    env = dict(os.environ, DATA_DIR=data_dir, DB_FILE=os.path.join(data_dir, "qianshou.db"),
+               LOG_FILE=os.path.join(data_dir, "qianshou.log"), REALTIME_ENABLED="0", API_WORKERS="1")
+    if not sleeps:
+        env.update(FETCH_SLEEP_S="0", SYNC_SLEEP_S="0")
+    kwargs = dict(symbols=symbols, years=years, latency_ms=latency_ms, jitter_ms=jitter_ms,
+                  fail_rate=fail_rate, quota=quota, window_s=window_s, concurrency=concurrency)
+    # 在独立进程中运行，模拟模块必须在导入真实的futu、akshare之前安装
+    out = subprocess.run([sys.executable, "-c", _LOADTEST.format(kwargs=kwargs)],
+                         cwd=BASE_DIR, env=env, stdout=subprocess.PIPE, text=True, check=True)
+    report = json.loads(out.stdout.strip().splitlines()[-1])
+    report["data_dir"] = data_dir
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    fire.Fire({
+        "bench_startup": bench_startup,
+        "backfill": backfill,
+        "repair_gaps": repair_gaps,
+        "rebuild_bin": rebuild_bin,
+        "loadtest": loadtest,
+    })
@@ -9,22 +9,34 @@ Description:
 Copyright (c) 2025 by ${git_name_email}, All Rights Reserved. 
 '''
 
-import os, uvicorn
+import os, asyncio, uvicorn
 from loguru import logger
 from dotenv import load_dotenv
 from datetime import datetime, date
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Depends, HTTPException
+from fastapi.responses import FileResponse
 from contextlib import asynccontextmanager
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from typing import Optional
-from pydantic import BaseModel, field_validator, ValidationError
+from typing import Optional, List, Dict, Literal
+from pydantic import BaseModel, ConfigDict, field_validator, ValidationError
 
-from qianshou.models import Equity
-from qianshou.sqlite_db import init_db, get_equities
+from qianshou.sqlite_db import init_db, add_job_trigger, take_job_triggers
+from qianshou.equity_registry import EQUITY_REGISTRY
+from qianshou.config import ensure_dirs, INTRADAY_KTYPES, PROFILE_ENABLED
 from qianshou.indicator_tools import load_all_indicators
-from qianshou.hist_futu import futu_update_daily
-from qianshou.account_futu import futu_sync_group, load_equity_finance
-from qianshou.bin_tools import load_equity_quote
+from qianshou.providers import futu_update_daily, futu_update_intraday, futu_sync_group, repair_gaps
+from qianshou.providers import start_realtime, stop_realtime, load_equity_live
+from qianshou.hist_intraday import load_equity_intraday, QLIB_FREQ
+from qianshou.finance_store import load_equity_finance, finance_version, load_finance_item, migrate_finance_csv
+from qianshou.bin_tools import load_equity_quote, quote_version, quote_artifact
+from qianshou.artifacts import ARTIFACT_TYPES, normalize_lookback
+from qianshou.hot_store import HOT_STORE
+from qianshou.series_cache import evaluate_formulas
+from qianshou.screener import screen
+from qianshou.market_calendar import MARKET_GROUPS, OTHER_MARKETS, post_close_cron
+from qianshou.http_cache import make_etag, db_timestamp, conditional_response, coalesced_response, file_response
+from qianshou.leader import try_acquire_leader, is_leader, release_leader
+from qianshou.profiler import ProfileMiddleware, request_profile, profile_requests, list_profiles, profile_file
 
 # 加载环境变量
 load_dotenv()
@@ -32,12 +44,19 @@ LOG_FILE = os.getenv("LOG_FILE", "qianshou.log")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG")
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
 API_PORT = int(os.getenv("API_PORT", "23000"))
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
 CRON_HOUR = int(os.getenv("CRON_HOUR", "6"))
 CRON_MINUTE = int(os.getenv("CRON_MINUTE", "0"))
 SYNC_INTERV_M = int(os.getenv("SYNC_INTERV_M", "5"))
+MARKET_SCHEDULE = os.getenv("MARKET_SCHEDULE", "1") == "1"    # 各市场收盘后分别更新
+LEADER_RETRY_S = int(os.getenv("LEADER_RETRY_S", "10"))     # 非主进程重试选主的间隔
+TRIGGER_POLL_S = int(os.getenv("TRIGGER_POLL_S", "2"))      # 主进程检查转交任务的间隔
 
 
 class DateRangeModel(BaseModel):
+    # 未提供日期时也要经过校验器，填入默认的起止日期
+    model_config = ConfigDict(validate_default=True)
+
     start: Optional[date] = None
     end: Optional[date] = None
 
@@ -73,50 +92,259 @@ logger.add(LOG_FILE, level=LOG_LEVEL, rotation="50 MB", retention=5)
 # 定时任务
 scheduler = AsyncIOScheduler()
 
+# 可以由任意worker触发、在主进程执行的任务
+JOBS = {
+    "futu_daily": futu_update_daily,
+    "futu_intraday": futu_update_intraday,
+    "futu_sync": futu_sync_group,
+    "repair_gaps": repair_gaps,
+}
+
+def _add_scheduled_jobs():
+    if MARKET_SCHEDULE:
+        # 每个市场在收盘后单独更新
+        for cal, markets in MARKET_GROUPS.items():
+            scheduler.add_job(futu_update_daily, "cron",
+                            day_of_week="mon-fri",
+                            kwargs={"markets": markets},
+                            id=f"futu_daily_{cal}",
+                            **post_close_cron(cal))
+            if INTRADAY_KTYPES:
+                scheduler.add_job(futu_update_intraday, "cron",
+                                day_of_week="mon-fri",
+                                kwargs={"markets": markets},
+                                id=f"futu_intraday_{cal}",
+                                **post_close_cron(cal))
+        scheduler.add_job(futu_update_daily, "cron", 
+                        day_of_week="1-5", # 每周二到周六
+                        hour=CRON_HOUR, minute=CRON_MINUTE,
+                        kwargs={"markets": OTHER_MARKETS},
+                        id="futu_daily")
+    else:
+        scheduler.add_job(futu_update_daily, "cron", 
+                        day_of_week="1-5", # 每周二到周六
+                        hour=CRON_HOUR, minute=CRON_MINUTE,
+                        id="futu_daily")
+    scheduler.add_job(futu_sync_group, "interval", 
+                    minutes=SYNC_INTERV_M,
+                    id="futu_sync")
+    scheduler.add_job(_run_forwarded_jobs, "interval",
+                    seconds=TRIGGER_POLL_S,
+                    id="job_triggers")
+
+async def _run_forwarded_jobs():
+    for trigger in take_job_triggers():
+        job = JOBS.get(trigger["job"])
+        if job is None:
+            logger.warning(f"未知的转交任务: {trigger}")
+            continue
+        logger.info(f"执行转交的任务: {trigger}")
+        scheduler.add_job(job, kwargs=trigger["kwargs"], id=f"trigger_{trigger['id']}")
+
+async def _elect_leader():
+    # 只有主进程执行定时任务，其他进程定时重试，主进程退出后接替
+    if not try_acquire_leader():
+        return
+    if scheduler.get_job("leader_elect"):
+        scheduler.remove_job("leader_elect")
+    _add_scheduled_jobs()
+    # 只有主进程订阅实时推送，其他worker读取主进程写入的数据
+    await asyncio.to_thread(start_realtime)
+
+def _forward(job: str, **kwargs) -> dict | None:
+    # 非主进程把任务转交给主进程执行
+    if is_leader():
+        return None
+    add_job_trigger(job, kwargs)
+    return {"status": "forwarded"}
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting up...")
+    ensure_dirs()
     init_db()
-    scheduler.add_job(futu_update_daily, "cron", 
-                    day_of_week="1-5", # 每周二到周六
-                    hour=CRON_HOUR, minute=CRON_MINUTE,
-                    id="futu_daily")
-    scheduler.add_job(futu_sync_group, "interval", 
-                    minutes=SYNC_INTERV_M,
-                    id="futu_sync")
+    migrate_finance_csv()
+    HOT_STORE.load()
+    await _elect_leader()
+    if not is_leader():
+        logger.info(f"进程 {os.getpid()} 只提供查询，定时任务由主进程执行")
+        scheduler.add_job(_elect_leader, "interval",
+                        seconds=LEADER_RETRY_S,
+                        id="leader_elect")
     scheduler.start()
     yield
+    stop_realtime()
     scheduler.shutdown()
+    release_leader()
     logger.info("Shutting down...")
 
 app = FastAPI(lifespan=lifespan, title="Qianshou Service")
+if PROFILE_ENABLED:
+    app.add_middleware(ProfileMiddleware)
 
 @app.get("/equities")
-def list_equities_api():
-    rows = get_equities(only_valid=False)
-    return [Equity(**row) for row in rows]
+def list_equities_api(request: Request):
+    cnt, enabled, updated_at, last_date = EQUITY_REGISTRY.fingerprint()
+    etag = make_etag("equities", cnt, enabled, updated_at, last_date)
+    last_modified = max(filter(None, [db_timestamp(updated_at), db_timestamp(last_date)]), default=None)
+    return conditional_response(request, etag,
+                                lambda: EQUITY_REGISTRY.equities(only_valid=False),
+                                last_modified=last_modified)
 
 @app.get("/indicators")
 def list_indicators_api():
     return load_all_indicators()
 
+def _equity_finance(request: Request, symbol: str, range: DateRangeModel):
+    def validator():
+        cnt, updated_at = finance_version(symbol)
+        return make_etag("finance", symbol.upper(), range.start, range.end, cnt, updated_at), db_timestamp(updated_at)
+    return coalesced_response(request, ("finance", symbol.upper(), range.start, range.end), validator,
+                              lambda: load_equity_finance(symbol, range.start, range.end))  # type: ignore
+
+def _quote_artifact(request: Request, symbol: str, range: DateRangeModel, lookback: str, fmt: str):
+    # 只有全部日期范围、不合成周期、不降采样的请求可以直接使用预先生成的文件
+    if range.start != date(1990, 1, 1) or range.end != date(2200, 1, 1):
+        return None
+    if fmt == "json" and "gzip" not in request.headers.get("accept-encoding", ""):
+        return None
+    path = quote_artifact(symbol, lookback, fmt)
+    if path is None:
+        return None
+    last_date, _ = quote_version(symbol)
+    return file_response(request, path, make_etag("quote", path, last_date), ARTIFACT_TYPES[fmt][1],
+                         last_modified=db_timestamp(last_date), encoding="gzip" if fmt == "json" else None)
+
+def _equity_quote(request: Request, symbol: str, range: DateRangeModel,
+                  period: Optional[str] = None, points: Optional[int] = None,
+                  lookback: Optional[str] = None, format: str = "json"):
+    try:
+        lookback = normalize_lookback(lookback)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if period is None and points is None:
+        resp = _quote_artifact(request, symbol, range, lookback or "ALL", format)
+        if resp is not None:
+            return resp
+    if format != "json":
+        raise HTTPException(status_code=404, detail=f"{format} is only available for pre-generated ranges")
+    def validator():
+        last_date, data_version = quote_version(symbol)
+        etag = make_etag("quote", symbol.upper(), range.start, range.end, period, points, lookback, last_date, data_version)
+        return etag, db_timestamp(last_date)
+    return coalesced_response(request, ("quote", symbol.upper(), range.start, range.end, period, points, lookback), validator,
+                              lambda: load_equity_quote(symbol, range.start, range.end, period, points, lookback))  # type: ignore
+
 @app.post("/equity/finance")
-def get_equity_finance(symbol: str, range: DateRangeModel):
-    return load_equity_finance(symbol, range.start, range.end)  # type: ignore
+def get_equity_finance(symbol: str, range: DateRangeModel, request: Request):
+    return _equity_finance(request, symbol, range)
 
+@app.get("/equity/finance")
+def get_equity_finance_cacheable(symbol: str, request: Request, range: DateRangeModel = Depends()):
+    # GET版本便于反向代理缓存
+    return _equity_finance(request, symbol, range)
+
+@app.get("/finance/item")
+def get_finance_item(item: str, range: DateRangeModel = Depends()):
+    # 某个财报项目在所有标的中的数值，例如 item=TOTAL_ASSETS
+    return load_finance_item(item, range.start, range.end)  # type: ignore
+
+# period: W/M/Q 合成周/月/季线；points: 降采样后的最大点数
+# lookback: ALL/1Y/5Y 等最后一根K线之前的区间；format=arrow 时返回Arrow文件，只支持预先生成的区间
 @app.post("/equity/quote")
-def get_equity_quote(symbol: str, range: DateRangeModel):
-    return load_equity_quote(symbol, range.start, range.end)  # type: ignore
+def get_equity_quote(symbol: str, range: DateRangeModel, request: Request,
+                     period: Optional[Literal["D", "W", "M", "Q"]] = None, points: Optional[int] = None,
+                     lookback: Optional[str] = None, format: Literal["json", "arrow"] = "json"):
+    return _equity_quote(request, symbol, range, period, points, lookback, format)
+
+@app.get("/equity/quote")
+def get_equity_quote_cacheable(symbol: str, request: Request, range: DateRangeModel = Depends(),
+                               period: Optional[Literal["D", "W", "M", "Q"]] = None, points: Optional[int] = None,
+                               lookback: Optional[str] = None, format: Literal["json", "arrow"] = "json"):
+    # GET版本便于反向代理缓存
+    return _equity_quote(request, symbol, range, period, points, lookback, format)
+
+@app.get("/equity/live")
+def get_equity_live(symbol: str):
+    return load_equity_live(symbol)
+
+def _check_ktypes(ktypes: List[str]) -> None:
+    unsupported = [k for k in ktypes if k not in QLIB_FREQ]
+    if unsupported:
+        raise HTTPException(status_code=400, detail=f"unsupported ktype: {unsupported}, expected one of {list(QLIB_FREQ)}")
+
+@app.get("/equity/intraday")
+def get_equity_intraday(symbol: str, ktype: str = "K_1M", range: DateRangeModel = Depends()):
+    _check_ktypes([ktype])
+    return load_equity_intraday(symbol, ktype, range.start, range.end)  # type: ignore
+
+@app.post("/indicator/eval")
+def eval_indicator_api(symbols: List[str], formulas: Dict[str, str], range: DateRangeModel):
+    return evaluate_formulas(symbols, formulas, range.start, range.end)  # type: ignore
+
+@app.get("/screener")
+def screener_api(expr: str):
+    # 例如 expr=RSI14 < 30 AND CLOSE > MA200
+    return screen(expr)
 
 @app.post("/update/futu/daily")
 def update_futu_daily_api():
+    forwarded = _forward("futu_daily")
+    if forwarded:
+        return forwarded
     futu_update_daily()
     return {"status":"ok"}
 
+@app.post("/update/futu/intraday")
+def update_futu_intraday_api(ktypes: Optional[List[str]] = None):
+    _check_ktypes(ktypes or [])
+    forwarded = _forward("futu_intraday", ktypes=ktypes)
+    if forwarded:
+        return forwarded
+    futu_update_intraday(ktypes=ktypes)
+    return {"status":"ok"}
+
+@app.post("/repair/gaps")
+def repair_gaps_api(symbols: Optional[List[str]] = None, markets: Optional[List[str]] = None,
+                    start: Optional[str] = None, dry_run: bool = False):
+    # 检查并补齐历史日线的缺口，dry_run=true 时只返回缺口
+    # 只检查时不写数据，在本进程执行并直接返回结果
+    if not dry_run:
+        forwarded = _forward("repair_gaps", symbols=symbols, markets=markets, start=start, dry_run=dry_run)
+        if forwarded:
+            return forwarded
+    return repair_gaps(symbols, markets, start, dry_run)
+
 @app.post("/sync/futu/group")
-async def sync_futu_group_api():
-    await futu_sync_group()
+async def sync_futu_group_api(full: bool = False):
+    # full=true 时忽略上次同步的列表，重新检查全部自选股
+    forwarded = _forward("futu_sync", full=full)
+    if forwarded:
+        return forwarded
+    await futu_sync_group(full)
     return {"status":"ok"}
 
+@app.post("/profile/request")
+def request_profile_api(target: str, count: int = 1):
+    # target 为任务名（futu_daily、futu_sync等）或接口路径（/equity/quote），count=0 时取消
+    if target not in JOBS and not target.startswith("/"):
+        raise HTTPException(status_code=400, detail=f"unknown target: {target}")
+    return request_profile(target, count)
+
+@app.get("/profiles")
+def list_profiles_api():
+    return {"pending": profile_requests(), "results": list_profiles()}
+
+@app.get("/profiles/{filename}")
+def get_profile_file(filename: str):
+    path = profile_file(filename)
+    if path is None:
+        raise HTTPException(status_code=404, detail="profile not found")
+    return FileResponse(path)
+
 if __name__ == "__main__":
-    uvicorn.run(app, host=API_HOST, port=API_PORT)
+    if API_WORKERS > 1:
+        # 多个worker时需要以导入字符串启动
+        uvicorn.run("main:app", host=API_HOST, port=API_PORT, workers=API_WORKERS)
+    else:
+        uvicorn.run(app, host=API_HOST, port=API_PORT)
@@ -10,48 +10,48 @@ Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
 '''
 
 
-import os, json, asyncio, time
+import json, asyncio, time
 import pandas as pd
-from datetime import date
 from loguru import logger
-from pathlib import Path
-from dotenv import load_dotenv
-import akshare as ak
-from futu import OpenQuoteContext, RET_OK
 
 from .models import Equity
 from .sqlite_db import *
+from .finance_store import save_statement, has_statement
+from .stage_timer import stage
+from .config import FUTU_API_HOST, FUTU_API_PORT, FUTU_GROUP_NAME, SYNC_SLEEP_S
+from .providers import lazy_import
 
-# 加载环境变量
-BASE_DIR = Path(__file__).resolve().parent
-load_dotenv(dotenv_path=BASE_DIR / ".." / ".env")
-FUTU_API_HOST = os.getenv("FUTU_API_HOST", "127.0.0.1")
-FUTU_API_PORT = int(os.getenv("FUTU_API_PORT", "21111"))
-FUTU_GROUP_NAME = os.getenv("FUTU_GROUP_NAME", "量化分析")
-DATA_DIR = os.path.expanduser(os.getenv("DATA_DIR", "~/Quanter/qlib_data"))
-RPT_DIR = os.path.join(DATA_DIR, "finance")   # 年度财务报表
+# 只在同步自选股和下载财报时加载akshare和futu
+ak = lazy_import("akshare")
+futu = lazy_import("futu")
 
-# 初始化各个子路径和文件
-os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(RPT_DIR, exist_ok=True)
+# AKShare提供财报的市场
+FINANCE_MARKETS = ["HK", "SH", "SZ"]
 
 
-def _create_and_doc(symbol: str, market: str) -> None:
-    # 创建标的，并利用AKShare获取基本信息（因Futu9.4不提供此类接口）
+def _create_and_doc(symbol: str, market: str) -> bool:
+    # 创建标的，并利用AKShare获取基本信息（因Futu9.4不提供此类接口），失败时返回False
     e = Equity(symbol=symbol, market=market)
-    if market == 'HK':
-        info = ak.stock_individual_basic_info_hk_xq(symbol=symbol)
-    elif market == 'SH' or market == 'SZ':
-        info = ak.stock_individual_basic_info_xq(symbol=f"{market}{symbol}")
-    else:
-        info = None
-    if info is None or not isinstance(info, pd.DataFrame) or info.empty:
-        e.note = ""
-    else:
-        e.note = json.dumps(info.to_dict(orient="records"))
-    add_equity(e)
+    try:
+        if market == 'HK':
+            info = ak.stock_individual_basic_info_hk_xq(symbol=symbol)
+        elif market == 'SH' or market == 'SZ':
+            info = ak.stock_individual_basic_info_xq(symbol=f"{market}{symbol}")
+        else:
+            info = None
+        if info is None or not isinstance(info, pd.DataFrame) or info.empty:
+            e.note = ""
+        else:
+            e.note = json.dumps(info.to_dict(orient="records"))
+        add_equity(e)
+    except Exception as ex:
+        logger.error(f"创建标的 {e.symbol}@{e.market} 失败: {ex}")
+        return False
+    finally:
+        with stage("sync.sleep"):
+            time.sleep(SYNC_SLEEP_S)
     logger.info(f"创建标的 {e.symbol}@{e.market} 成功")
-    time.sleep(5)
+    return True
 
 def _format_report(df: pd.DataFrame, market: str) -> pd.DataFrame:
     if df.empty:
@@ -59,6 +59,9 @@ def _format_report(df: pd.DataFrame, market: str) -> pd.DataFrame:
     
     df['date'] = pd.to_datetime(df['REPORT_DATE'])
     df['date'] = df['date'].dt.date
+    # 保留公告日期，按公告日对齐到日线时才不会用到未来数据
+    if 'NOTICE_DATE' in df.columns:
+        df['notice_date'] = pd.to_datetime(df['NOTICE_DATE']).dt.date
 
     # 去掉无用的列
     df.drop(columns=['SECUCODE', 'SECURITY_CODE', 'SECURITY_NAME_ABBR', 'FISCAL_YEAR',
@@ -69,15 +72,16 @@ def _format_report(df: pd.DataFrame, market: str) -> pd.DataFrame:
     
     if market == "HK":
         # 用pivot将STD_ITEM_NAME作为列，AMOUNT作为值，按date聚合
-        df = df.pivot(index='date', columns='STD_ITEM_NAME', values='AMOUNT').reset_index()
+        index = ['date', 'notice_date'] if 'notice_date' in df.columns else 'date'
+        df = df.pivot(index=index, columns='STD_ITEM_NAME', values='AMOUNT').reset_index()
     
     return df.set_index("date").reset_index()
 
-def _request_balance(symbol: str, market: str) -> None:
-    csv_file = os.path.join(RPT_DIR, f"balance_{symbol}.csv")
-    if os.path.exists(csv_file):
-        logger.info(f"资产负债表已经存在: {symbol}@{market}=>{csv_file}")
-        return
+def _request_balance(symbol: str, market: str) -> bool | None:
+    # 已存在时返回None（没有访问接口），否则返回是否获取并保存成功
+    if has_statement(symbol, "balance"):
+        logger.info(f"资产负债表已经存在: {symbol}@{market}")
+        return None
     
     df = None
     for i in range(3):
@@ -92,17 +96,18 @@ def _request_balance(symbol: str, market: str) -> None:
             continue
     if df is None or not isinstance(df, pd.DataFrame) or df.empty:
         logger.warning(f"获取资产负债表失败: {symbol}@{market}")
-    else:
-        df = _format_report(df, market)
-        df.to_csv(csv_file, index=False)
-        logger.info(f"获取资产负债表成功: {symbol}@{market}") 
-
-
-def _request_profit(symbol: str, market: str) -> None:
-    csv_file = os.path.join(RPT_DIR, f"profit_{symbol}.csv")
-    if os.path.exists(csv_file):
-        logger.info(f"利润表已经存在: {symbol}@{market}=>{csv_file}")
-        return
+        return False
+    df = _format_report(df, market)
+    save_statement(symbol, "balance", df)
+    logger.info(f"获取资产负债表成功: {symbol}@{market}") 
+    return True
+
+
+def _request_profit(symbol: str, market: str) -> bool | None:
+    # 已存在时返回None（没有访问接口），否则返回是否获取并保存成功
+    if has_statement(symbol, "profit"):
+        logger.info(f"利润表已经存在: {symbol}@{market}")
+        return None
     
     df = None
     for i in range(3):
@@ -117,17 +122,18 @@ def _request_profit(symbol: str, market: str) -> None:
             continue
     if df is None or not isinstance(df, pd.DataFrame) or df.empty:
         logger.warning(f"获取资利润表失败: {symbol}@{market}")
-    else:
-        df = _format_report(df, market)
-        df.to_csv(csv_file, index=False)
-        logger.info(f"获取利润表表成功: {symbol}@{market}") 
-
-
-def _request_cashflow(symbol: str, market: str) -> None:
-    csv_file = os.path.join(RPT_DIR, f"cashflow_{symbol}.csv")
-    if os.path.exists(csv_file):
-        logger.info(f"现金流量表已经存在: {symbol}@{market}=>{csv_file}")
-        return
+        return False
+    df = _format_report(df, market)
+    save_statement(symbol, "profit", df)
+    logger.info(f"获取利润表表成功: {symbol}@{market}") 
+    return True
+
+
+def _request_cashflow(symbol: str, market: str) -> bool | None:
+    # 已存在时返回None（没有访问接口），否则返回是否获取并保存成功
+    if has_statement(symbol, "cashflow"):
+        logger.info(f"现金流量表已经存在: {symbol}@{market}")
+        return None
     
     df = None
     for i in range(3):
@@ -142,100 +148,86 @@ def _request_cashflow(symbol: str, market: str) -> None:
             continue
     if df is None or not isinstance(df, pd.DataFrame) or df.empty:
         logger.warning(f"获取现金流量表失败: {symbol}@{market}")
-    else:
-        df = _format_report(df, market)
-        df.to_csv(csv_file, index=False)
-        logger.info(f"获取现金流量表成功: {symbol}@{market}") 
+        return False
+    df = _format_report(df, market)
+    save_statement(symbol, "cashflow", df)
+    logger.info(f"获取现金流量表成功: {symbol}@{market}") 
+    return True
 
-def request_hist_finance(f_list: list) -> None:
-    if len(f_list) == 0:
-        return
+
+def request_hist_finance(f_list: list) -> list:
+    """下载财报，返回三张报表都已保存的 (symbol, market)，没有财报的市场直接视为完成"""
+    done = []
     for (symbol, market) in f_list:
+        if market not in FINANCE_MARKETS:
+            done.append((symbol, market))
+            continue
         logger.debug(f"开始下载财务数据{symbol}@{market}...")
-        _request_balance(symbol, market)
-        _request_profit(symbol, market)
-        _request_cashflow(symbol, market)
+        with stage("sync.finance"):
+            fetched = [_request_balance(symbol, market),
+                       _request_profit(symbol, market),
+                       _request_cashflow(symbol, market)]
         logger.debug(f"完成下载财务数据{symbol}@{market}!")
-        time.sleep(5)
-
-async def futu_sync_group():
+        if False not in fetched:
+            done.append((symbol, market))
+        # 三张报表都已存在时没有访问接口，不需要等待
+        if any(r is not None for r in fetched):
+            with stage("sync.sleep"):
+                time.sleep(SYNC_SLEEP_S)
+    return done
+
+async def futu_sync_group(full: bool = False):
+    """
+    同步自选股列表，只处理与上次同步相比新增的代码；full=True 时忽略上次的列表，全部重新检查
+    """
     logger.debug(f"开始同步富途牛牛自选股列表...")
-    quote_ctx = OpenQuoteContext(host=FUTU_API_HOST, port=FUTU_API_PORT)
+    quote_ctx = futu.OpenQuoteContext(host=FUTU_API_HOST, port=FUTU_API_PORT)
 
-    f_list = []
-    equities = []
-    ret, data = quote_ctx.get_user_security(FUTU_GROUP_NAME)
-    if ret != RET_OK or data is None or not isinstance(data, pd.DataFrame) or data.empty:
-        logger.warning(f"富途牛牛中获取自选列表{FUTU_GROUP_NAME}失败: {data}")
-    elif data.shape[0] > 0:  # 如果自选股列表不为空
-        equities = data['code'].values.tolist()
-        logger.info(f"自选列表: {equities}")   # 转为 list
+    with stage("sync.watchlist"):
+        ret, data = quote_ctx.get_user_security(FUTU_GROUP_NAME)
     # 关闭Futu
     quote_ctx.close()
+    if ret != futu.RET_OK or data is None or not isinstance(data, pd.DataFrame):
+        # 获取失败时不能当作列表为空，否则会把全部标的视为已删除
+        logger.warning(f"富途牛牛中获取自选列表{FUTU_GROUP_NAME}失败: {data}")
+        return
+
+    # 与上次同步的列表比较
+    current = set(data['code'].values.tolist()) if not data.empty else set()
+    if full:
+        clear_watchlist_snapshot()
+    with stage("sync.diff"):
+        last = get_watchlist_snapshot()
+    added, removed = sorted(current - last), sorted(last - current)
+    if not added and not removed:
+        logger.debug(f"自选列表没有变化: {len(current)} 个标的")
+        return
+    logger.info(f"自选列表变化: 新增 {added}, 移除 {removed}")
 
-    # 同步数据
-    for code in equities:
+    # 只处理新增的代码
+    f_list = []
+    for code in added:
         market, symbol = code.split(".")
-        market = market.upper()
-        symbol = symbol.upper()
-        logger.info(f"同步{symbol}@{market}")
-        f_list.append((symbol, market))
-        if if_not_exist_equity(symbol):
-            _create_and_doc(symbol, market)
+        f_list.append((symbol.upper(), market.upper()))
+    existing = get_existing_symbols([symbol for symbol, _ in f_list])
+    created = []
+    for symbol, market in f_list:
+        if symbol not in existing:
+            logger.info(f"同步{symbol}@{market}")
+            with stage("sync.create"):
+                if not _create_and_doc(symbol, market):
+                    continue
+        created.append((symbol, market))
 
     # 利用AKShare下载历史财报数据（因Futu9.4不提供此类接口）
-    if f_list:
-        await asyncio.to_thread(request_hist_finance, f_list)
-    
-    # 清理已经不在列表中
+    done = set(await asyncio.to_thread(request_hist_finance, created)) if created else set()
+
+    # 只记录创建和财报都成功的代码，失败的在下次同步时重试
+    synced = [code for code, item in zip(added, f_list) if item in done]
+    failed = sorted(set(added) - set(synced))
+    if failed:
+        logger.warning(f"同步失败，下次重试: {failed}")
+    # 清理已经不在列表中（保留标的和数据，只从快照中移除）
     # clear_others_equities(equities)
+    update_watchlist_snapshot(synced, removed)
     logger.debug(f"完成同步富途牛牛自选股列表!")
-
-def load_equity_finance(symbol: str, start_date: date, end_date: date) -> dict:
-    res = dict()
-
-    row = get_equity_by_symbol(symbol=symbol)
-    if row is None:
-        logger.error(f"找不到股票{symbol}，无法获得财务数据")
-        return res
-    
-    e = Equity(**row)
-    logger.debug(f"找到股票{e.symbol}")
-
-
-    # 资产负债表
-    csv_file = os.path.join(RPT_DIR, f"balance_{symbol}.csv")
-    if os.path.exists(csv_file):
-        df = pd.read_csv(csv_file, index_col=0, parse_dates=True)
-        df = df.reset_index()
-        df['date'] = df['date'].dt.date
-        df = df[(df['date'] >= start_date) & (df['date'] <= end_date)]
-        df = df.replace({float('nan'): None})
-        res["BalanceSheet"] = df.to_dict(orient="records")
-    else:
-        res["BalanceSheet"] = []
-
-    # 利润表
-    csv_file = os.path.join(RPT_DIR, f"profit_{symbol}.csv")
-    if os.path.exists(csv_file):
-        df = pd.read_csv(csv_file, index_col=0, parse_dates=True)
-        df = df.reset_index()
-        df['date'] = df['date'].dt.date
-        df = df[(df['date'] >= start_date) & (df['date'] <= end_date)]
-        df = df.replace({float('nan'): None})
-        res["ProfitSheet"] = df.to_dict(orient="records")
-    else:
-        res["ProfitSheet"] = []
-
-    # 现金流表
-    csv_file = os.path.join(RPT_DIR, f"cashflow_{symbol}.csv")
-    if os.path.exists(csv_file):
-        df = pd.read_csv(csv_file, index_col=0, parse_dates=True)
-        df = df.reset_index()
-        df['date'] = df['date'].dt.date
-        df = df[(df['date'] >= start_date) & (df['date'] <= end_date)]
-        df = df.replace({float('nan'): None})
-        res["CashFlow"] = df.to_dict(orient="records")
-    else:
-        res["CashFlow"] = []
-    return res
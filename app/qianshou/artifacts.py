@@ -0,0 +1,122 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-19 14:12:05
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-19 14:12:05
+FilePath: /mss_qianshou/app/qianshou/artifacts.py
+Description: 导出时预先生成的行情响应文件
+
+大部分行情查询取全部历史或固定的回看区间（1Y、5Y），这些数据每天只变化一次。
+导出BIN后，在同一个版本目录的 artifacts/<代码>/ 下为每个区间生成：
+  <区间>.json.gz  与 /equity/quote 返回内容相同的JSON，gzip压缩
+  <区间>.arrow    Arrow IPC文件（zstd压缩），需要 pyarrow，没有安装时不生成
+回看区间以标的最后一根K线为终点。文件随版本一起原子发布，未更新的标的由硬链接沿用上一版本的文件，
+查询时直接发送文件，不使用pandas和qlib。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os, re, gzip, json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from loguru import logger
+
+from .hot_store import read_instrument
+from .data_versions import current_version, replace_file
+from .config import DATA_DIR, ARTIFACTS_ENABLED, ARTIFACT_RANGES, ARTIFACT_GZIP_LEVEL
+
+ARTIFACT_TYPES = {
+    "json": (".json.gz", "application/json"),
+    "arrow": (".arrow", "application/vnd.apache.arrow.file"),
+}
+
+_LOOKBACK = re.compile(r"^(\d+)([YM])$")
+
+
+def normalize_lookback(lookback: str | None) -> str | None:
+    """ALL、1Y、6M 等，格式不对时抛出 ValueError"""
+    if lookback is None:
+        return None
+    lookback = lookback.strip().upper()
+    if lookback != "ALL" and not _LOOKBACK.match(lookback):
+        raise ValueError(f"lookback must be ALL or <n>Y/<n>M: {lookback}")
+    return lookback
+
+def slice_lookback(df: pd.DataFrame, lookback: str | None) -> pd.DataFrame:
+    """带 date 列的行情只保留最后一根K线之前 lookback 内的部分"""
+    if not lookback or lookback == "ALL" or df.empty:
+        return df
+    n, unit = _LOOKBACK.match(lookback).groups()  # type: ignore
+    dates = pd.to_datetime(df["date"])
+    since = dates.max() - (pd.DateOffset(years=int(n)) if unit == "Y" else pd.DateOffset(months=int(n)))
+    return df[(dates > since).values].reset_index(drop=True)
+
+def _read_quote(qlib_dir: str, code: str, calendar: np.ndarray) -> pd.DataFrame | None:
+    # 与热数据的查询结果相同：全部字段按名称排序，从最早到最晚的日期按日历对齐
+    inst = read_instrument(os.path.join(qlib_dir, "features", code.lower()))
+    if inst is None:
+        return None
+    start, fields, block = inst
+    df = pd.DataFrame(block.T, columns=[f"${f}" for f in fields])
+    df["date"] = pd.to_datetime(calendar[start:start + block.shape[1]]).date
+    return df
+
+def _to_json(df: pd.DataFrame) -> bytes:
+    # 与 JSONResponse 的序列化方式相同
+    records = df.replace({float('nan'): None}).to_dict(orient="records")
+    for r in records:
+        r["date"] = r["date"].isoformat()
+    return json.dumps(records, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+def _arrow_writer():
+    try:
+        import pyarrow as pa
+    except ImportError:
+        logger.warning("没有安装pyarrow，不生成Arrow文件")
+        return None
+
+    def write(df: pd.DataFrame, path: str) -> None:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        options = pa.ipc.IpcWriteOptions(compression="zstd")
+        def _write(tmp: str):
+            with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema, options=options) as writer:
+                writer.write_table(table)
+        replace_file(path, _write)
+    return write
+
+def write_artifacts(qlib_dir: str, codes: list) -> None:
+    """为 codes 在版本目录 qlib_dir 中生成各区间的响应文件"""
+    if not ARTIFACTS_ENABLED or not codes:
+        return
+    cal_file = os.path.join(qlib_dir, "calendars", "day.txt")
+    if not os.path.exists(cal_file):
+        return
+    calendar = pd.read_csv(cal_file, header=None)[0].values.astype("datetime64[D]")
+    write_arrow = _arrow_writer()
+
+    cnt = 0
+    for code in codes:
+        df = _read_quote(qlib_dir, code, calendar)
+        if df is None:
+            continue
+        out_dir = os.path.join(qlib_dir, "artifacts", code.lower())
+        os.makedirs(out_dir, exist_ok=True)
+        for lookback in ARTIFACT_RANGES:
+            part = slice_lookback(df, lookback)
+            body = gzip.compress(_to_json(part), compresslevel=ARTIFACT_GZIP_LEVEL)
+            replace_file(os.path.join(out_dir, f"{lookback}.json.gz"), lambda tmp: Path(tmp).write_bytes(body))
+            if write_arrow is not None:
+                write_arrow(part, os.path.join(out_dir, f"{lookback}.arrow"))
+        cnt += 1
+    logger.info(f"生成行情响应文件: {cnt} 个标的, 区间 {ARTIFACT_RANGES}")
+
+def artifact_path(ft_name: str, lookback: str, fmt: str = "json") -> str | None:
+    """当前版本中预先生成的文件，没有时返回None"""
+    if not ARTIFACTS_ENABLED or lookback not in ARTIFACT_RANGES:
+        return None
+    qlib_dir = current_version(DATA_DIR)
+    if qlib_dir is None:
+        return None
+    path = os.path.join(qlib_dir, "artifacts", ft_name.lower(), lookback + ARTIFACT_TYPES[fmt][0])
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,175 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-16 09:47:18
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-16 09:47:18
+FilePath: /mss_qianshou/app/qianshou/backfill.py
+Description: 并行回补历史日线
+
+每个标的的历史按 BACKFILL_CHUNK_YEARS 年分段，所有 (标的, 分段) 由线程池并发获取，
+每个线程使用自己的 OpenQuoteContext，所有线程共享一个限速器，不超过富途接口的频率限制。
+获取完成后按分段顺序合并，最后一次性计算指标并导出BIN。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os, time, threading
+import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from loguru import logger
+from futu import OpenQuoteContext
+
+from .models import Equity
+from .sqlite_db import get_equities, set_equities_last_symbols
+from .indicator_tools import IndicatorManager
+from .bin_tools import save_indicator_csv, dump_frames_bin
+from .data_versions import save_csv
+from .hist_futu import request_kline, ocsv_lock, _read_ocsv
+from .series_cache import SERIES_CACHE
+from .screener import update_snapshot
+from .finance_store import attach_fundamentals
+from .market_calendar import last_closed_day
+from .config import (OCSV_DIR, FUTU_API_HOST, FUTU_API_PORT, BACKFILL_WORKERS, BACKFILL_CHUNK_YEARS,
+                     FUTU_KLINE_QUOTA, FUTU_KLINE_WINDOW_S)
+
+
+class RateLimiter:
+    """滑动窗口限速，period 秒内最多 calls 次，多个线程共享"""
+    def __init__(self, calls: int, period: float):
+        self.calls = calls
+        self.period = period
+        self._times: deque = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._times and now - self._times[0] >= self.period:
+                    self._times.popleft()
+                if len(self._times) < self.calls:
+                    self._times.append(now)
+                    return
+                wait = self.period - (now - self._times[0])
+            time.sleep(wait)
+
+
+class _LimitedContext:
+    """每次请求K线（包括翻页）前先经过限速器"""
+    def __init__(self, ctx: OpenQuoteContext, limiter: RateLimiter):
+        self.ctx = ctx
+        self.limiter = limiter
+
+    def request_history_kline(self, **kwargs):
+        self.limiter.acquire()
+        return self.ctx.request_history_kline(**kwargs)
+
+
+def split_range(start: date, end: date, years: int) -> list:
+    """把 [start, end] 按年数分段，分段之间不重叠"""
+    chunks = []
+    s = start
+    while s <= end:
+        e = min(date(s.year + years, 1, 1) - timedelta(days=1), end)
+        chunks.append((s, e))
+        s = date(s.year + years, 1, 1)
+    return chunks
+
+
+def backfill(symbols: list | None = None, markets: list | None = None,
+             start: str = "1990-01-01", end: str | None = None,
+             workers: int = BACKFILL_WORKERS, chunk_years: int = BACKFILL_CHUNK_YEARS) -> dict:
+    """
+    回补历史日线，symbols/markets 为空时回补全部自选标的，返回每个标的的记录数（-1为失败）
+    已有的原始数据会与新数据合并，重叠部分以新数据为准
+    """
+    start_date = datetime.strptime(start, "%Y-%m-%d").date()
+    equities = []
+    for row in get_equities(only_valid=True):
+        e = Equity(**dict(row))
+        # 代码可能被当作数字传入而丢掉前导0，比较时忽略前导0
+        if symbols and e.symbol.lstrip("0") not in [str(s).upper().lstrip("0") for s in symbols]:
+            continue
+        if markets and e.market not in [m.upper() for m in markets]:
+            continue
+        equities.append(e)
+    if not equities:
+        logger.warning("没有需要回补的标的")
+        return {}
+
+    tasks = []
+    for e in equities:
+        end_date = datetime.strptime(end, "%Y-%m-%d").date() if end else last_closed_day(e.market)
+        for i, (s, t) in enumerate(split_range(start_date, end_date, chunk_years)):
+            tasks.append((e.to_futu_symbol(), i, s, t))
+    logger.info(f"回补 {len(equities)} 个标的, {len(tasks)} 个分段, {workers} 个线程")
+
+    limiter = RateLimiter(FUTU_KLINE_QUOTA, FUTU_KLINE_WINDOW_S)
+    local = threading.local()
+    contexts = []
+    ctx_lock = threading.Lock()
+
+    def fetch(ft_name: str, s: date, t: date) -> list:
+        if not hasattr(local, "ctx"):
+            ctx = OpenQuoteContext(host=FUTU_API_HOST, port=FUTU_API_PORT)
+            with ctx_lock:
+                contexts.append(ctx)
+            local.ctx = _LimitedContext(ctx, limiter)
+        return request_kline(local.ctx, ft_name, s, t)  # type: ignore
+
+    chunks: dict[str, dict[int, list]] = {}
+    failed = set()
+    t0 = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {pool.submit(fetch, ft_name, s, t): (ft_name, i) for ft_name, i, s, t in tasks}
+            for done, fut in enumerate(as_completed(futures), 1):
+                ft_name, i = futures[fut]
+                try:
+                    chunks.setdefault(ft_name, {})[i] = fut.result()
+                except Exception as ex:
+                    # 包括接口返回错误（KlineError），不完整的分段不合并
+                    logger.error(f"回补分段失败 {ft_name} #{i}: {ex}")
+                    failed.add(ft_name)
+                if done % 50 == 0 or done == len(futures):
+                    logger.info(f"回补进度 {done}/{len(futures)}, 用时 {time.perf_counter() - t0:.1f}s")
+    finally:
+        for ctx in contexts:
+            ctx.close()
+
+    # 按分段顺序合并，计算指标后一次性导出
+    manager = IndicatorManager()
+    manager.load_all_sets()
+    frames, report = {}, {}
+    for ft_name, parts in chunks.items():
+        if ft_name in failed:
+            # 有分段失败时不写入，避免历史数据中间出现缺口
+            report[ft_name] = -1
+            continue
+        pages = [p for i in sorted(parts) for p in parts[i]]
+        if not pages:
+            report[ft_name] = 0
+            continue
+        ocsv_file = os.path.join(OCSV_DIR, f"{ft_name}.csv")
+        with ocsv_lock(ft_name):
+            df = pd.concat([_read_ocsv(ft_name)] + pages)
+            df = df[~df.index.duplicated(keep="last")].sort_index()
+            save_csv(df, ocsv_file)
+
+        df_with_ind = manager.calculate(df)
+        save_indicator_csv(ft_name, df_with_ind)
+        frames[ft_name] = df_with_ind
+        report[ft_name] = len(df)
+
+    if frames:
+        frames = attach_fundamentals(frames)
+        dump_frames_bin(frames)
+        update_snapshot(frames)
+        SERIES_CACHE.invalidate()
+        # 只更新实际写入的标的，只指定 symbols 时 markets 为空
+        symbols = {e.to_futu_symbol(): e.symbol for e in equities}
+        set_equities_last_symbols([symbols[c] for c in frames])
+    logger.info(f"回补完成 {len(frames)} 个标的, 用时 {time.perf_counter() - t0:.1f}s")
+    return report
@@ -9,47 +9,170 @@ Description: QLib BIN文件工具
 Copyright (c) 2025 by ${git_name_email}, All Rights Reserved. 
 '''
 
-import os, sys, qlib
+import os, threading
+import numpy as np
 import pandas as pd
 from loguru import logger
 from pathlib import Path
 from datetime import date
-from dotenv import load_dotenv
-from qlib.data import D
-
-from .sqlite_db import get_equity_by_symbol
-from .models import Equity
-
-
-# 加载环境变量
-BASE_DIR = Path(__file__).resolve().parent
-load_dotenv(dotenv_path=BASE_DIR / ".." / ".env")
-DATA_DIR = os.path.expanduser(os.getenv("DATA_DIR", "~/Quanter/qlib_data"))
-QLIB_DIR = os.path.expanduser(os.getenv("QLIB_DIR", "~/Quanter/qlib"))
-OCSV_DIR = os.path.join(DATA_DIR, "ocsv")   # for original csv data
-CSV_DIR = os.path.join(DATA_DIR, "csv")     # for csv data with all indicators
-RPT_DIR = os.path.join(DATA_DIR, "finance")   # 年度财务报表
-
-# 初始化各个子路径和文件
-os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(OCSV_DIR, exist_ok=True)
-os.makedirs(CSV_DIR, exist_ok=True)
-os.makedirs(os.path.join(DATA_DIR, "calendars"), exist_ok=True)
-os.makedirs(os.path.join(DATA_DIR, "features"), exist_ok=True)
-os.makedirs(os.path.join(DATA_DIR, "instruments"), exist_ok=True)
-
-def convert_csv_to_bin() -> None:
-    # 准备导出BIN格式的工具脚本
-    sys.path.append(os.path.join(QLIB_DIR, "scripts"))
-    from dump_bin import DumpDataAll  # type: ignore warnings
-
-    # 转换为Qlib的BIN格式
-    dump = DumpDataAll(
-        data_path=CSV_DIR,
-        qlib_dir=DATA_DIR,
-        exclude_fields="date,symbol")
-    dump.dump()
-    logger.info(f"将数据由CSV转换为BIN")
+
+from .equity_registry import EQUITY_REGISTRY
+from .indicator_tools import IndicatorManager, numeric_columns
+from .finance_store import attach_fundamentals
+from .hot_store import HOT_STORE, build_hot_store, read_instrument
+from .resample import reshape_quote
+from .artifacts import write_artifacts, slice_lookback, artifact_path
+from .data_versions import current_version, version_name, staged_version, save_csv, save_text, save_bin
+from .config import DATA_DIR, OCSV_DIR, CSV_DIR, RPT_DIR, KEEP_IND_CSV
+
+
+# 各市场的更新任务可能同时完成，导出BIN时互斥
+_DUMP_LOCK = threading.Lock()
+# qlib当前初始化的数据版本，版本未变时不重复初始化
+_QLIB_LOCK = threading.Lock()
+_qlib_uri: str | None = None
+
+def _refresh_hot_store() -> None:
+    # 刷新查询接口使用的热数据
+    if build_hot_store() is not None:
+        HOT_STORE.reload()
+
+def save_indicator_csv(ft_name: str, df: pd.DataFrame) -> None:
+    """按需保存带指标的CSV，导出BIN不再依赖这些文件"""
+    if not KEEP_IND_CSV:
+        return
+    csv_file = os.path.join(CSV_DIR, f"{ft_name}.csv")
+    save_csv(df, csv_file)
+    logger.info(f"待分析数据文件: {csv_file}")
+
+def _to_bin_frame(df: pd.DataFrame, fmt: str = "%Y-%m-%d") -> pd.DataFrame:
+    # 去重排序，只保留数值列（布尔指标转为0/1），索引转为日历字符串
+    df = numeric_columns(df[~df.index.duplicated(keep="last")].sort_index())
+    df.index = pd.DatetimeIndex(df.index).strftime(fmt)
+    return df
+
+def _read_instruments(inst_file: str) -> dict:
+    res = {}
+    if not os.path.exists(inst_file):
+        return res
+    with open(inst_file, "r") as f:
+        for line in f:
+            parts = line.strip().split("\t")
+            if len(parts) == 3:
+                res[parts[0]] = (parts[1], parts[2])
+    return res
+
+def _read_calendar(qlib_dir: str, freq: str = "day") -> list:
+    cal_file = os.path.join(qlib_dir, "calendars", f"{freq}.txt")
+    if not os.path.exists(cal_file):
+        return []
+    with open(cal_file, "r") as f:
+        return [l.strip() for l in f if l.strip()]
+
+def read_qlib_bins(qlib_dir: str, code: str, calendar: list, freq: str = "day") -> pd.DataFrame:
+    """读取标的已有的BIN文件，返回以日历字符串为索引的DataFrame"""
+    inst = read_instrument(os.path.join(qlib_dir, "features", code.lower()), freq)
+    if inst is None:
+        return pd.DataFrame()
+    start, fields, block = inst
+    return pd.DataFrame(block.T, index=calendar[start:start + block.shape[1]], columns=[f.lower() for f in fields])
+
+def write_qlib_bins(qlib_dir: str, frames: dict, freq: str = "day", rebuild: bool = False) -> bool:
+    """
+    把 frames (代码 -> 以日历字符串为索引的数值DataFrame) 写为Qlib BIN，其他标的的BIN文件保持不变
+    新日期都在原日历之后时，其他标的在日历中的序号不变，可以只改写这些标的；
+    否则（日历中间插入了新日期）不写入并返回False，由调用者全量导出
+    rebuild=True 时忽略原有日历和标的列表，按frames重新生成
+    """
+    cal_file = os.path.join(qlib_dir, "calendars", f"{freq}.txt")
+    inst_file = os.path.join(qlib_dir, "instruments", "all.txt")
+    os.makedirs(os.path.dirname(cal_file), exist_ok=True)
+    os.makedirs(os.path.dirname(inst_file), exist_ok=True)
+
+    old_cal = [] if rebuild else _read_calendar(qlib_dir, freq)
+    new_cal = sorted(set(old_cal).union(*[set(df.index) for df in frames.values()]))
+    if new_cal[:len(old_cal)] != old_cal:
+        return False
+
+    cal_index = {d: i for i, d in enumerate(new_cal)}
+    instruments = {} if rebuild else _read_instruments(inst_file)
+    for code, df in frames.items():
+        if df.empty:
+            continue
+        begin, end = df.index[0], df.index[-1]
+        start_idx = cal_index[begin]
+        # 与日历对齐，缺失的日期为NaN
+        df = df.reindex(new_cal[start_idx:cal_index[end] + 1])
+        features_dir = os.path.join(qlib_dir, "features", code.lower())
+        os.makedirs(features_dir, exist_ok=True)
+        for field in df.columns:
+            bin_file = os.path.join(features_dir, f"{field.lower()}.{freq}.bin")
+            save_bin(np.hstack([[start_idx], df[field].values]).astype("<f"), bin_file)
+        instruments[code.upper()] = (begin, end)
+
+    save_text("\n".join(new_cal) + "\n", cal_file)
+    save_text("".join(f"{c}\t{b}\t{e}\n" for c, (b, e) in sorted(instruments.items())), inst_file)
+    logger.info(f"导出BIN({freq}): {len(frames)} 个标的")
+    return True
+
+def dump_frames_bin(frames: dict) -> None:
+    """
+    把内存中计算好指标的数据 (代码 -> 以日期为索引的DataFrame) 直接写为Qlib BIN，
+    只改写这些标的；日历中间插入新交易日时，读出其他标的已有的BIN重新对齐后全量写入
+    写入新的版本目录，完成后原子发布，查询不会读到写了一半的数据
+    """
+    frames = {code: _to_bin_frame(df) for code, df in frames.items() if df is not None and not df.empty}
+    if not frames:
+        # 不发布内容相同的新版本，否则数据版本和所有行情的ETag都会无故变化
+        logger.info("没有需要导出的数据")
+        return
+    with _DUMP_LOCK:
+        with staged_version(DATA_DIR) as qlib_dir:
+            if not write_qlib_bins(qlib_dir, frames):
+                logger.info(f"日历中间插入了新交易日，重新对齐全部标的")
+                calendar = _read_calendar(qlib_dir)
+                inst_file = os.path.join(qlib_dir, "instruments", "all.txt")
+                others = {
+                    code: read_qlib_bins(qlib_dir, code, calendar)
+                    for code in _read_instruments(inst_file) if code not in frames
+                }
+                write_qlib_bins(qlib_dir, {**others, **frames}, rebuild=True)
+                # 日历变化后其他标的的对齐也变了，全部重新生成
+                write_artifacts(qlib_dir, list(others) + list(frames))
+            else:
+                write_artifacts(qlib_dir, list(frames))
+        _refresh_hot_store()
+
+def convert_csv_to_bin() -> int:
+    """
+    由 OCSV_DIR 中已启用标的的原始CSV重新计算指标并全量重建BIN（手工重建时使用，见 cli.py rebuild_bin）
+    带指标的CSV默认不保存，不能作为重建的来源；没有任何数据时不发布，避免用空数据替换当前版本
+    返回重建的标的数量
+    """
+    manager = IndicatorManager()
+    manager.load_all_sets()
+    frames = {}
+    for entry in EQUITY_REGISTRY.entries():
+        if entry.futu is None:
+            continue
+        ocsv_file = os.path.join(OCSV_DIR, f"{entry.futu}.csv")
+        if not os.path.exists(ocsv_file):
+            continue
+        df = pd.read_csv(ocsv_file, index_col=0, parse_dates=True)
+        if not df.empty:
+            frames[entry.futu] = manager.calculate(df)
+    if not frames:
+        logger.error(f"没有可用的原始数据，不重建BIN: {OCSV_DIR}")
+        return 0
+
+    frames = {code: _to_bin_frame(df) for code, df in attach_fundamentals(frames).items()}
+    with _DUMP_LOCK:
+        with staged_version(DATA_DIR, seed=False) as qlib_dir:
+            write_qlib_bins(qlib_dir, frames, rebuild=True)
+            write_artifacts(qlib_dir, list(frames))
+        _refresh_hot_store()
+    logger.info(f"由原始数据重建BIN: {len(frames)} 个标的")
+    return len(frames)
 
 def _get_all_qlib_fields(data_dir: str, code: str) -> list:
     """
@@ -77,32 +200,75 @@ def _get_all_qlib_fields(data_dir: str, code: str) -> list:
     fields_set = { field_from_filename(p.name) for p in bin_files }
     return [f"${f.upper()}" for f in sorted(fields_set)]
 
-def load_equity_quote(symbol: str, start_date: date, end_date: date) -> list:
-    res = []
+def quote_version(symbol: str) -> tuple:
+    """行情数据的版本: 标的最后更新时间 + 数据版本，不读取BIN和CSV"""
+    entry = EQUITY_REGISTRY.get(symbol)
+    if entry is None:
+        return (None, None)
+    data_version = HOT_STORE.version()
+    if data_version is None:
+        data_version = version_name(DATA_DIR) or 0
+    return (entry.equity.last_date, data_version)
 
-    row = get_equity_by_symbol(symbol=symbol)
-    if row is None:
-        logger.error(f"找不到股票{symbol}，无法获得财务数据")
-        return res
-    
-    e = Equity(**row)
-    ft_name = e.to_futu_symbol()
-    logger.debug(f"找到股票{e.symbol}")
+def quote_artifact(symbol: str, lookback: str, fmt: str = "json") -> str | None:
+    """导出时预先生成的行情文件，没有时返回None"""
+    entry = EQUITY_REGISTRY.get(symbol)
+    if entry is None or entry.futu is None:
+        return None
+    return artifact_path(entry.futu, lookback, fmt)
 
-    qlib.init(provider_uri=DATA_DIR, region="cn")
-    fields = _get_all_qlib_fields(DATA_DIR, ft_name)
+def _load_qlib_quote(ft_name: str, start_date: date, end_date: date) -> pd.DataFrame | None:
+    # qlib只在热数据未命中时才需要，导入很慢
+    import qlib
+    from qlib.data import D
+    # 固定使用查询开始时的版本，导出新版本不影响本次查询
+    qlib_dir = current_version(DATA_DIR)
+    if qlib_dir is None:
+        return None
+    fields = _get_all_qlib_fields(qlib_dir, ft_name)
     if not fields:
-        return res
-    
-    df = D.features(
-        instruments=[ft_name], 
-        fields=fields,                 # ⭐ 一次性取所有字段
-        start_time=start_date, 
-        end_time=end_date
-    )
+        return None
+
+    global _qlib_uri
+    # qlib.init是进程全局的，初始化和读取都在锁内，避免并发查询在读取中途切换版本
+    with _QLIB_LOCK:
+        if _qlib_uri != qlib_dir:
+            qlib.init(provider_uri=qlib_dir, region="cn")
+            _qlib_uri = qlib_dir
+        df = D.features(
+            instruments=[ft_name], 
+            fields=fields,                 # ⭐ 一次性取所有字段
+            start_time=start_date, 
+            end_time=end_date
+        )
     if df is None or not isinstance(df, pd.DataFrame):
-        return res
-    df = df.replace({float('nan'): None}).reset_index()
+        return None
+    df = df.reset_index()
     df['date'] = df['datetime'].dt.date
     df.drop(columns=['instrument', 'datetime'], inplace=True)
-    return df.to_dict(orient="records")
+    return df
+
+def load_equity_quote(symbol: str, start_date: date, end_date: date,
+                      period: str | None = None, points: int | None = None, lookback: str | None = None) -> list:
+    """
+    读取行情，period 为 W/M/Q 时合成周/月/季线，points 指定时用LTTB降采样到该点数
+    lookback 为 1Y、5Y 等时只取最后一根K线之前该区间内的数据
+    """
+    res = []
+
+    entry = EQUITY_REGISTRY.get(symbol)
+    if entry is None:
+        logger.error(f"找不到股票{symbol}，无法获得行情数据")
+        return res
+    
+    ft_name = entry.futu
+    logger.debug(f"找到股票{entry.equity.symbol}")
+
+    # 优先从热数据读取，不在热数据中的标的再通过qlib读取
+    df = HOT_STORE.query(ft_name, start_date, end_date)
+    if df is None:
+        df = _load_qlib_quote(ft_name, start_date, end_date)
+    if df is None:
+        return res
+    df = reshape_quote(slice_lookback(df, lookback), period, points)
+    return df.replace({float('nan'): None}).to_dict(orient="records")
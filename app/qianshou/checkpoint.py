@@ -0,0 +1,73 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-18 14:36:50
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-18 14:36:50
+FilePath: /mss_qianshou/app/qianshou/checkpoint.py
+Description: 可从断点继续的更新运行
+
+每次日线更新是 update_runs 中的一条记录，每个标的的进度保存在 update_progress：
+fetched 原始数据已下载并保存；computed 指标已计算，结果保存在 CHECKPOINT_DIR/<运行>/<代码>.pkl；
+dumped 已导出BIN。进程中途退出后，同一任务、同样市场的下一次运行继续未完成的记录，
+已计算的标的直接读取检查点，已下载的只重新计算，其余的重新下载。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os, shutil, time
+import pandas as pd
+from loguru import logger
+
+from .sqlite_db import (get_open_update_run, create_update_run, finish_update_run,
+                        get_update_progress, set_update_progress)
+from .data_versions import replace_file
+from .config import CHECKPOINT_DIR, CHECKPOINT_MAX_AGE_H
+
+
+def _prune_dirs() -> None:
+    # 放弃的运行不会再继续，清理超过有效期的检查点目录
+    if not os.path.isdir(CHECKPOINT_DIR):
+        return
+    expire = time.time() - CHECKPOINT_MAX_AGE_H * 3600
+    for d in os.listdir(CHECKPOINT_DIR):
+        path = os.path.join(CHECKPOINT_DIR, d)
+        if os.path.isdir(path) and os.path.getmtime(path) < expire:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class UpdateRun:
+    def __init__(self, job: str, markets: list | None = None):
+        run_key = ",".join(sorted(m.upper() for m in markets)) if markets else "*"
+        row = get_open_update_run(job, run_key, CHECKPOINT_MAX_AGE_H)
+        if row is not None:
+            self.id = row["id"]
+            self.progress = get_update_progress(self.id)
+            logger.info(f"继续未完成的更新 {job}[{run_key}] #{self.id}, 已有进度 {len(self.progress)} 个标的")
+        else:
+            self.id = create_update_run(job, run_key)
+            self.progress = {}
+            _prune_dirs()
+        self.dir = os.path.join(CHECKPOINT_DIR, str(self.id))
+
+    def stage(self, code: str) -> str | None:
+        return self.progress.get(code)
+
+    def mark(self, codes: list, stage: str) -> None:
+        set_update_progress(self.id, codes, stage)
+        self.progress.update({c: stage for c in codes})
+
+    def save_frame(self, code: str, df: pd.DataFrame) -> None:
+        os.makedirs(self.dir, exist_ok=True)
+        replace_file(os.path.join(self.dir, f"{code}.pkl"), df.to_pickle)
+
+    def load_frame(self, code: str) -> pd.DataFrame | None:
+        path = os.path.join(self.dir, f"{code}.pkl")
+        try:
+            return pd.read_pickle(path)
+        except Exception as e:
+            logger.warning(f"读取检查点失败 {path}: {e}")
+            return None
+
+    def finish(self, status: str = "done") -> None:
+        finish_update_run(self.id, status)
+        shutil.rmtree(self.dir, ignore_errors=True)
@@ -0,0 +1,100 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-14 10:05:52
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-14 10:05:52
+FilePath: /mss_qianshou/app/qianshou/config.py
+Description: 配置项，统一加载环境变量
+
+只在这里加载一次 .env，各模块从这里导入配置；
+数据目录由 ensure_dirs() 在启动时创建，导入模块时不做任何文件操作。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+
+
+# 加载环境变量
+BASE_DIR = Path(__file__).resolve().parent
+load_dotenv(dotenv_path=BASE_DIR / ".." / ".env")
+
+# 数据目录
+DATA_DIR = os.path.expanduser(os.getenv("DATA_DIR", "~/Quanter/qlib_data"))
+OCSV_DIR = os.path.join(DATA_DIR, "ocsv")   # for original csv data
+CSV_DIR = os.path.join(DATA_DIR, "csv")     # for csv data with all indicators
+RPT_DIR = os.path.join(DATA_DIR, "finance")   # 年度财务报表
+HOT_DIR = os.path.join(DATA_DIR, "hotstore")    # 热数据
+MKT_CAL_DIR = os.path.join(DATA_DIR, "mkt_calendars")   # 各市场交易日历
+INTRA_DIR = os.path.join(DATA_DIR, "intraday")  # 分钟K线
+INDS_DIR = os.path.join(BASE_DIR, ".." , os.getenv("INDS_DIR", "indicators"))
+DB_FILE = os.getenv("DB_FILE", "qianshou.db")
+
+# 富途
+FUTU_API_HOST = os.getenv("FUTU_API_HOST", "127.0.0.1")
+FUTU_API_PORT = int(os.getenv("FUTU_API_PORT", "21111"))
+FUTU_GROUP_NAME = os.getenv("FUTU_GROUP_NAME", "量化分析")
+FETCH_SLEEP_S = float(os.getenv("FETCH_SLEEP_S", "3"))     # 每个标的下载K线后等待的秒数，避免触发频率限制
+SYNC_SLEEP_S = float(os.getenv("SYNC_SLEEP_S", "5"))       # 新建标的、下载财报后等待的秒数
+
+# 日线更新
+KEEP_IND_CSV = os.getenv("KEEP_IND_CSV", "0") == "1"   # 是否另外保存带指标的CSV
+ADJUST_TOLERANCE = float(os.getenv("ADJUST_TOLERANCE", "0.001"))   # 重叠K线收盘价的相对误差超过该值视为复权变化
+POST_CLOSE_DELAY_M = int(os.getenv("POST_CLOSE_DELAY_M", "30"))    # 收盘后多久开始更新
+QLIB_VERSIONS_KEEP = int(os.getenv("QLIB_VERSIONS_KEEP", "3"))     # 保留的Qlib数据版本数量
+CHECKPOINT_DIR = os.path.join(DATA_DIR, "checkpoints")     # 未完成的更新中已计算的数据
+CHECKPOINT_MAX_AGE_H = float(os.getenv("CHECKPOINT_MAX_AGE_H", "12"))    # 超过该时间的未完成更新不再继续，重新开始
+
+# 历史数据回补，富途历史K线接口限制为每30秒60次
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", "4"))
+BACKFILL_CHUNK_YEARS = int(os.getenv("BACKFILL_CHUNK_YEARS", "5"))     # 每个分段的年数
+FUTU_KLINE_QUOTA = int(os.getenv("FUTU_KLINE_QUOTA", "60"))
+FUTU_KLINE_WINDOW_S = float(os.getenv("FUTU_KLINE_WINDOW_S", "30"))
+
+# 选股快照保留的最近K线数量，REF(x, n) 最多引用到 n = SNAPSHOT_BARS-1
+SNAPSHOT_BARS = int(os.getenv("SNAPSHOT_BARS", "5"))
+
+# 按公告日对齐到日线的财报项目，作为 fin_<项目> 特征导出到Qlib
+PIT_FIELDS = [f.strip().upper() for f in os.getenv("PIT_FIELDS", "TOTAL_ASSETS,TOTAL_PARENT_EQUITY,PARENT_NETPROFIT,TOTAL_OPERATE_INCOME").split(",") if f.strip()]
+PIT_NOTICE_LAG_D = int(os.getenv("PIT_NOTICE_LAG_D", "120"))  # 没有公告日时，按报告期后多少天视为已公告
+
+# 分钟K线
+INTRADAY_KTYPES = [k for k in os.getenv("INTRADAY_KTYPES", "").split(",") if k]   # 例如 K_1M,K_5M，为空则不启用
+INTRADAY_HISTORY_DAYS = int(os.getenv("INTRADAY_HISTORY_DAYS", "30"))    # 新标的首次获取的天数
+
+# 实时推送
+REALTIME_ENABLED = os.getenv("REALTIME_ENABLED", "0") == "1"
+LIVE_INDICATORS = [i.strip().upper() for i in os.getenv("LIVE_INDICATORS", "MA5,MA20,EMA12,EMA26,RSI14").split(",") if i.strip()]
+LIVE_FLUSH_S = float(os.getenv("LIVE_FLUSH_S", "1"))    # 主进程把实时数据写入数据库的间隔，其他worker从数据库读取
+
+# 查询缓存
+SERIES_CACHE_SIZE = int(os.getenv("SERIES_CACHE_SIZE", "64"))   # 最多缓存的标的数量
+HOT_STORE_ENABLED = os.getenv("HOT_STORE_ENABLED", "1") == "1"
+HOT_STORE_KEEP = int(os.getenv("HOT_STORE_KEEP", "2"))     # 保留的历史版本数量
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "60"))    # 代理和客户端可直接复用的秒数
+ARTIFACTS_ENABLED = os.getenv("ARTIFACTS_ENABLED", "1") == "1"    # 导出时预先生成行情响应文件
+ARTIFACT_RANGES = [r.strip().upper() for r in os.getenv("ARTIFACT_RANGES", "ALL,1Y,5Y").split(",") if r.strip()]
+ARTIFACT_GZIP_LEVEL = int(os.getenv("ARTIFACT_GZIP_LEVEL", "6"))
+SINGLE_FLIGHT_TTL_S = float(os.getenv("SINGLE_FLIGHT_TTL_S", "2"))     # 相同查询完成后结果保留的秒数
+SINGLE_FLIGHT_MAX = int(os.getenv("SINGLE_FLIGHT_MAX", "64"))    # 最多保留的查询结果数量
+EQUITY_REGISTRY_TTL_S = float(os.getenv("EQUITY_REGISTRY_TTL_S", "30"))     # 其他worker修改标的后，本进程最迟多久重新加载
+
+# 按需性能分析，见 profiler.py
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "1") == "1"    # 为0时不安装接口的分析钩子
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))   # 采样间隔
+PROFILE_TOP_ALLOC = int(os.getenv("PROFILE_TOP_ALLOC", "50"))       # 保存的内存分配位置数量
+PROFILE_POLL_S = float(os.getenv("PROFILE_POLL_S", "5"))     # 其他worker设置的分析请求最迟多久生效
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))     # 保留的分析结果数量
+
+# 启动耗时预算（秒），见 cli.py bench_startup
+IMPORT_BUDGET_S = float(os.getenv("IMPORT_BUDGET_S", "1.5"))
+
+
+def ensure_dirs() -> None:
+    """初始化各个子路径"""
+    # Qlib数据在 DATA_DIR/versions 下按版本保存，见 data_versions.py
+    for d in [DATA_DIR, OCSV_DIR, CSV_DIR, RPT_DIR, HOT_DIR, MKT_CAL_DIR, INTRA_DIR, INDS_DIR]:
+        os.makedirs(d, exist_ok=True)
@@ -0,0 +1,142 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-18 09:15:07
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-18 09:15:07
+FilePath: /mss_qianshou/app/qianshou/data_versions.py
+Description: Qlib数据的版本目录与原子发布
+
+Qlib数据按版本保存在 <根目录>/versions/<版本>/ 下，<根目录>/current 是指向当前版本的符号链接。
+导出时先用硬链接复制当前版本得到新的版本目录，只改写需要更新的文件，
+每个文件都先写临时文件再 os.replace，替换的是新目录中的链接，不会改动旧版本共享的文件；
+全部写完后原子替换 current 链接。读取方每次查询先解析一次 current，
+整个查询都使用同一个版本，导出过程中不会读到写了一半的数据。
+从复制到发布都持有 <根目录>/versions.lock 文件锁，多个进程（worker、命令行的回补和补缺口）
+依次基于最新版本修改，不会互相覆盖；写入中的目录带 .staging 后缀，发布前才改名，清理时不会删除。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os, fcntl, shutil
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+from datetime import datetime
+from loguru import logger
+
+from .config import QLIB_VERSIONS_KEEP
+
+
+# 旧版本直接保存在根目录下的Qlib数据
+_LEGACY_DIRS = ["calendars", "instruments", "features"]
+_STAGING = ".staging"
+
+
+def current_version(root: str) -> str | None:
+    """当前版本目录的真实路径，读取方在一次查询中固定使用这个路径"""
+    link = os.path.join(root, "current")
+    if os.path.islink(link):
+        return os.path.realpath(link)
+    # 还没有发布过版本时使用根目录下原有的数据
+    if os.path.exists(os.path.join(root, "calendars")):
+        return root
+    return None
+
+def version_name(root: str) -> str | None:
+    """当前版本的名称，只读取一次链接，用于生成缓存验证器"""
+    try:
+        return os.path.basename(os.readlink(os.path.join(root, "current")))
+    except OSError:
+        return None
+
+def _new_version(root: str, seed: bool) -> str:
+    versions = os.path.join(root, "versions")
+    os.makedirs(versions, exist_ok=True)
+    # 持有锁时没有其他进程在写入，剩下的 .staging 目录是中途退出留下的
+    for d in os.listdir(versions):
+        if d.endswith(_STAGING):
+            shutil.rmtree(os.path.join(versions, d), ignore_errors=True)
+    path = os.path.join(versions, datetime.now().strftime("%Y%m%d%H%M%S%f") + _STAGING)
+    src = current_version(root)
+    if not seed or src is None:
+        os.makedirs(path)
+        return path
+    if src == root:
+        # 第一次发布，从根目录下原有的数据复制
+        os.makedirs(path)
+        for d in _LEGACY_DIRS:
+            if os.path.exists(os.path.join(root, d)):
+                shutil.copytree(os.path.join(root, d), os.path.join(path, d), copy_function=os.link)
+        logger.info(f"由原有的Qlib数据创建第一个版本: {root}")
+    else:
+        shutil.copytree(src, path, copy_function=os.link, symlinks=True)
+    return path
+
+def _publish(root: str, path: str) -> None:
+    final = path[:-len(_STAGING)]
+    os.rename(path, final)
+    path = final
+    link = os.path.join(root, "current")
+    tmp = link + ".tmp"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.symlink(os.path.relpath(path, root), tmp)
+    os.replace(tmp, link)
+    logger.info(f"发布Qlib数据版本 {os.path.basename(path)}: {root}")
+
+    # 清理旧版本，保留最近几个，正在读取旧版本的查询有足够的时间完成
+    versions = os.path.join(root, "versions")
+    names = sorted(d for d in os.listdir(versions)
+                   if not d.endswith(_STAGING) and os.path.isdir(os.path.join(versions, d)))
+    for d in names[:-QLIB_VERSIONS_KEEP]:
+        shutil.rmtree(os.path.join(versions, d), ignore_errors=True)
+
+@contextmanager
+def file_lock(path: str):
+    """with file_lock(path): 多个进程（worker、命令行）之间互斥，进程退出时由系统释放"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+@contextmanager
+def staged_version(root: str, seed: bool = True):
+    """
+    with staged_version(root) as path: 在 path 中写入新版本，正常退出时发布，出错时丢弃
+    seed=False 时新版本从空目录开始（全量重建）；其他进程正在导出时等待其发布后再开始
+    """
+    with file_lock(os.path.join(root, "versions.lock")):
+        path = _new_version(root, seed)
+        try:
+            yield path
+        except BaseException:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        _publish(root, path)
+
+
+def replace_file(path: str, write) -> None:
+    """write(tmp) 写入临时文件后原子替换 path，path 是硬链接时不影响其他版本"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def save_csv(df: pd.DataFrame, path: str) -> None:
+    replace_file(path, df.to_csv)
+
+def save_text(text: str, path: str) -> None:
+    def write(tmp: str):
+        with open(tmp, "w") as f:
+            f.write(text)
+    replace_file(path, write)
+
+def save_bin(arr: np.ndarray, path: str) -> None:
+    replace_file(path, arr.tofile)
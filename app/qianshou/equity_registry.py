@@ -0,0 +1,107 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-17 14:05:52
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-17 14:05:52
+FilePath: /mss_qianshou/app/qianshou/equity_registry.py
+Description: 进程内的标的注册表
+
+一次读出全部标的，按代码、id、市场、富途代码建立索引，并预先算好富途、yfinance、AKShare的代码，
+查询接口查找标的时不再访问SQLite。sqlite_db 中写入标的的函数会增加本进程的修改计数，
+计数变化后下次查找时重新加载；其他worker的修改最迟 EQUITY_REGISTRY_TTL_S 秒后生效。
+返回的 Equity 为共享对象，调用者不要修改。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import time, threading
+from loguru import logger
+
+from .models import Equity
+from .sqlite_db import get_equities, equities_version_local
+from .config import EQUITY_REGISTRY_TTL_S
+
+
+def _try(f):
+    # 部分市场不支持某些数据源，对应的代码为None
+    try:
+        return f()
+    except ValueError:
+        return None
+
+
+class EquityEntry:
+    __slots__ = ("equity", "futu", "yfinance", "akshare")
+
+    def __init__(self, e: Equity):
+        self.equity = e
+        self.futu = _try(e.to_futu_symbol)
+        self.yfinance = _try(e.to_yfinance_symbol)
+        self.akshare = _try(e.to_akshare_name)
+
+
+class _Snapshot:
+    def __init__(self, rows: list, version: int):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.entries = [EquityEntry(Equity(**dict(r))) for r in rows]
+        self.by_id = {x.equity.id: x for x in self.entries}
+        self.by_symbol = {x.equity.symbol.upper(): x for x in self.entries}
+        self.by_futu = {x.futu: x for x in self.entries if x.futu}
+        self.by_market: dict[str, list] = {}
+        for x in self.entries:
+            self.by_market.setdefault(x.equity.market.upper(), []).append(x)
+        # 与 get_equities_version 相同的版本信息，用于列表接口的ETag
+        # 启用数量单独计入，同一秒内的启用/停用也会改变ETag
+        self.fingerprint = (len(self.entries),
+                            sum(1 for x in self.entries if x.equity.enabled),
+                            max((x.equity.updated_at for x in self.entries if x.equity.updated_at), default=None),
+                            max((x.equity.last_date for x in self.entries if x.equity.last_date), default=None))
+
+
+class EquityRegistry:
+    def __init__(self, ttl: float = EQUITY_REGISTRY_TTL_S):
+        self.ttl = ttl
+        self._snap: _Snapshot | None = None
+        self._lock = threading.Lock()
+
+    def _current(self) -> _Snapshot:
+        snap = self._snap
+        version = equities_version_local()
+        if snap is not None and snap.version == version and time.monotonic() - snap.loaded_at < self.ttl:
+            return snap
+        with self._lock:
+            snap = self._snap
+            if snap is None or snap.version != version or time.monotonic() - snap.loaded_at >= self.ttl:
+                snap = _Snapshot(get_equities(only_valid=False), version)
+                self._snap = snap
+                logger.debug(f"加载标的注册表 {len(snap.entries)} 个标的")
+        return snap
+
+    def invalidate(self) -> None:
+        self._snap = None
+
+    def get(self, symbol: str) -> EquityEntry | None:
+        return self._current().by_symbol.get(symbol.upper())
+
+    def get_by_id(self, e_id: int) -> EquityEntry | None:
+        return self._current().by_id.get(e_id)
+
+    def get_by_futu(self, code: str) -> EquityEntry | None:
+        return self._current().by_futu.get(code)
+
+    def by_market(self, market: str, only_valid: bool = True) -> list:
+        return [x for x in self._current().by_market.get(market.upper(), []) if x.equity.enabled or not only_valid]
+
+    def entries(self, only_valid: bool = True) -> list:
+        return [x for x in self._current().entries if x.equity.enabled or not only_valid]
+
+    def equities(self, only_valid: bool = True) -> list:
+        return [x.equity for x in self.entries(only_valid)]
+
+    def fingerprint(self) -> tuple:
+        """(数量, 启用数量, 最后修改时间, 最后更新行情时间)"""
+        return self._current().fingerprint
+
+
+EQUITY_REGISTRY = EquityRegistry()
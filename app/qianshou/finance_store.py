@@ -0,0 +1,198 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-16 15:08:52
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-16 15:08:52
+FilePath: /mss_qianshou/app/qianshou/finance_store.py
+Description: 财报统一存储
+
+三张报表都以 (标的, 报表, 报告期, 项目, 数值) 保存在 finance_items 表中，非数值的项目（币种、审计意见等）
+保存在同一行的 text 中，单个标的的查询按原来的宽表返回全部列。
+按项目保存而不是每张报表一个宽表：港股和A股、不同年份的报表项目各不相同，宽表的列会不断增加，
+按项目保存时横截面查询和公告日对齐都只需要 (项目, 报告期) 索引。
+港股（STD_ITEM_NAME 中文项目名）和A股（东方财富字段名）的常用项目统一为相同的项目名，
+便于按项目做横截面比较；原始项目名也保留，单个标的的查询仍按原始名称返回。
+每期报表同时保存公告日期，导出日线时按公告日把 PIT_FIELDS 中的项目对齐到每个交易日，
+作为 fin_<项目> 特征写入Qlib，某个交易日只能看到当天及以前已公告的数据。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os
+import numpy as np
+import pandas as pd
+from datetime import date
+from loguru import logger
+
+from .sqlite_db import (replace_finance_items, has_finance_statement,
+                        get_finance_items, get_finance_version, get_finance_item_all, get_finance_pit)
+from .equity_registry import EQUITY_REGISTRY
+from .config import RPT_DIR, PIT_FIELDS, PIT_NOTICE_LAG_D
+
+
+# 报表 -> 接口返回的名称
+STATEMENTS = {
+    "balance": "BalanceSheet",
+    "profit": "ProfitSheet",
+    "cashflow": "CashFlow",
+}
+
+# 原始项目名 -> 统一的项目名，没有列出的项目保留原名（A股字段名转为大写）
+ITEM_ALIASES = {
+    # 资产负债表
+    "总资产": "TOTAL_ASSETS",
+    "总负债": "TOTAL_LIABILITIES",
+    "流动资产合计": "TOTAL_CURRENT_ASSETS",
+    "流动负债合计": "TOTAL_CURRENT_LIAB",
+    "股东权益": "TOTAL_PARENT_EQUITY",
+    "总权益": "TOTAL_EQUITY",
+    "现金及等价物": "MONETARYFUNDS",
+    "存货": "INVENTORY",
+    # 利润表
+    "营业额": "TOTAL_OPERATE_INCOME",
+    "营运收入": "OPERATE_INCOME",
+    "毛利": "GROSS_PROFIT",
+    "除税前溢利": "TOTAL_PROFIT",
+    "除税后溢利": "NETPROFIT",
+    "股东应占溢利": "PARENT_NETPROFIT",
+    "每股基本盈利": "BASIC_EPS",
+    # 现金流量表
+    "经营业务现金净额": "NETCASH_OPERATE",
+    "投资业务现金净额": "NETCASH_INVEST",
+    "融资业务现金净额": "NETCASH_FINANCE",
+}
+
+
+def normalize_item(name: str) -> str:
+    name = str(name).strip()
+    return ITEM_ALIASES.get(name, name.upper())
+
+def _to_rows(df: pd.DataFrame) -> list:
+    """宽表（date [+ notice_date] + 各项目列）转为 (报告期, 公告日, 项目, 原始项目, 数值, 文本)，空值不保存"""
+    df = df.copy()
+    dates = pd.to_datetime(df.pop("date")).dt.strftime("%Y-%m-%d")
+    if "notice_date" in df.columns:
+        notices = pd.to_datetime(df.pop("notice_date"), errors="coerce").dt.strftime("%Y-%m-%d")
+        notices = notices.astype(object).where(notices.notna(), None)
+    else:
+        notices = [None] * len(df)
+    rows = []
+    for col in df.columns:
+        values = pd.to_numeric(df[col], errors="coerce")
+        item = normalize_item(col)
+        for d, n, v, raw in zip(dates, notices, values, df[col]):
+            if pd.notna(v):
+                rows.append((d, n, item, str(col), float(v), None))
+            elif pd.notna(raw) and str(raw).strip():
+                rows.append((d, n, item, str(col), None, str(raw)))
+    return rows
+
+def save_statement(symbol: str, statement: str, df: pd.DataFrame) -> None:
+    rows = _to_rows(df)
+    replace_finance_items(symbol, statement, rows)
+    logger.info(f"保存财报 {symbol} {statement}: {len(rows)} 项")
+
+def has_statement(symbol: str, statement: str) -> bool:
+    return has_finance_statement(symbol, statement)
+
+def migrate_finance_csv() -> int:
+    """把 RPT_DIR 下旧的 <报表>_<标的>.csv 导入统一存储，已导入的跳过，返回导入的文件数"""
+    if not os.path.exists(RPT_DIR):
+        return 0
+    count = 0
+    for fname in sorted(os.listdir(RPT_DIR)):
+        statement, _, rest = fname.partition("_")
+        if statement not in STATEMENTS or not rest.endswith(".csv"):
+            continue
+        symbol = rest[:-4]
+        if has_finance_statement(symbol, statement):
+            continue
+        df = pd.read_csv(os.path.join(RPT_DIR, fname))
+        if "date" not in df.columns or df.empty:
+            continue
+        save_statement(symbol, statement, df)
+        count += 1
+    if count:
+        logger.info(f"导入旧的财报CSV {count} 个")
+    return count
+
+def finance_version(symbol: str) -> tuple:
+    """财报的版本: 项目数量 + 最后写入时间"""
+    row = get_finance_version(symbol)
+    return (row["cnt"], row["updated_at"])
+
+def load_equity_finance(symbol: str, start_date: date, end_date: date) -> dict:
+    res = dict()
+
+    entry = EQUITY_REGISTRY.get(symbol)
+    if entry is None:
+        logger.error(f"找不到股票{symbol}，无法获得财务数据")
+        return res
+
+    e = entry.equity
+    logger.debug(f"找到股票{e.symbol}")
+
+    # 一次查询取出三张报表，再按报表还原为宽表
+    df = pd.DataFrame(get_finance_items(e.symbol, str(start_date), str(end_date)),
+                      columns=["statement", "report_date", "notice_date", "raw_item", "value"])
+    for statement, name in STATEMENTS.items():
+        part = df[df["statement"] == statement]
+        if part.empty:
+            res[name] = []
+            continue
+        wide = part.pivot(index="report_date", columns="raw_item", values="value").sort_index()
+        notices = part.groupby("report_date")["notice_date"].first()
+        if notices.notna().any():
+            wide.insert(0, "notice_date", pd.to_datetime(notices.reindex(wide.index)).dt.date)
+        wide.insert(0, "date", pd.to_datetime(wide.index).date)
+        res[name] = wide.reset_index(drop=True).replace({float('nan'): None}).to_dict(orient="records")
+    return res
+
+def load_finance_item(item: str, start_date: date, end_date: date) -> list:
+    """某个项目在所有标的中的数值，例如 TOTAL_ASSETS 在某几年的横截面"""
+    rows = get_finance_item_all(normalize_item(item), str(start_date), str(end_date))
+    return [{"symbol": r["symbol"], "statement": r["statement"], "date": r["report_date"],
+             "item": r["raw_item"], "value": r["value"]} for r in rows]
+
+def pit_features(symbol: str, dates: pd.DatetimeIndex, items: list = PIT_FIELDS) -> pd.DataFrame:
+    """
+    按公告日把财报项目对齐到交易日，返回以 dates 为索引、fin_<项目> 为列的表
+    没有公告日的报表按报告期后 PIT_NOTICE_LAG_D 天视为已公告；
+    同一交易日已公告多期时取报告期最新的一期，晚公告的旧报告期（更正）不会覆盖新一期
+    """
+    columns = [f"fin_{i.lower()}" for i in items]
+    out = pd.DataFrame(np.nan, index=dates, columns=columns)
+    rows = get_finance_pit(symbol, items) if items else []
+    if not rows or len(dates) == 0:
+        return out
+
+    df = pd.DataFrame(rows, columns=["report_date", "notice_date", "item", "value"])
+    df["report_date"] = pd.to_datetime(df["report_date"])
+    lagged = df["report_date"] + pd.Timedelta(days=PIT_NOTICE_LAG_D)
+    df["known"] = pd.to_datetime(df["notice_date"], errors="coerce").fillna(lagged)
+    # 三张报表可能有同名项目，同一期同一项目只保留一个
+    df = df.sort_values(["known", "report_date"]).drop_duplicates(["item", "report_date"], keep="first")
+    # 按公告顺序，只保留报告期比已公告的更新的记录
+    newest = df.groupby("item")["report_date"].cummax()
+    df = df[df["report_date"] >= newest]
+
+    wide = df.pivot_table(index="known", columns="item", values="value", aggfunc="last").ffill()
+    wide.columns = [f"fin_{str(c).lower()}" for c in wide.columns]
+    left = pd.DataFrame({"date": pd.DatetimeIndex(dates).normalize()}).reset_index()
+    joined = pd.merge_asof(left.sort_values("date"), wide.reset_index().rename(columns={"known": "date"}),
+                           on="date", direction="backward").sort_values("index")
+    return joined.set_index(pd.Index(dates)).reindex(columns=columns)
+
+def attach_fundamentals(frames: dict) -> dict:
+    """导出BIN前给每个标的的日线加上 fin_<项目> 列，frames: {futu代码: DataFrame}"""
+    if not PIT_FIELDS:
+        return frames
+    symbols = {x.futu: x.equity.symbol for x in EQUITY_REGISTRY.entries(only_valid=False) if x.futu}
+    res = {}
+    for code, df in frames.items():
+        if df is None or df.empty or code not in symbols:
+            res[code] = df
+            continue
+        fin = pit_features(symbols[code], pd.DatetimeIndex(df.index))
+        res[code] = pd.concat([df.drop(columns=fin.columns, errors="ignore"), fin], axis=1)
+    return res
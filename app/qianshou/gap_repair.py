@@ -0,0 +1,162 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-17 16:22:48
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-17 16:22:48
+FilePath: /mss_qianshou/app/qianshou/gap_repair.py
+Description: 检查并补齐历史日线中的缺口
+
+日线更新只从最后一根K线之后开始下载，某次分页中途失败留下的缺口不会再被补上。
+这里把每个标的已保存的日期与市场交易日历比较，找出连续缺失的区间，只下载这些区间并合并。
+只检查交易日历已覆盖的日期，避免把更早的节假日当作缺口；没有缓存交易日历的市场（TW、TOKYO、LONDON等）
+无法区分节假日和缺口，不检查，否则每次运行都会为每个当地假日请求一次K线。
+下载时多取缺口两侧已保存的K线，如果两侧收盘价与已保存的不一致，说明复权基准已变化，
+这时不合并，需要重新下载全部历史。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os, time
+import numpy as np
+import pandas as pd
+from datetime import date
+from loguru import logger
+from futu import OpenQuoteContext
+
+from .models import Equity
+from .sqlite_db import get_equities
+from .indicator_tools import IndicatorManager
+from .bin_tools import save_indicator_csv, dump_frames_bin
+from .data_versions import save_csv
+from .hist_futu import request_kline, _adjust_changed, KlineError, ocsv_lock, _read_ocsv
+from .backfill import RateLimiter, _LimitedContext
+from .finance_store import attach_fundamentals
+from .screener import update_snapshot
+from .series_cache import SERIES_CACHE
+from .market_calendar import CALENDAR_MARKETS, load_market_calendar, trading_days
+from .config import OCSV_DIR, FUTU_API_HOST, FUTU_API_PORT, FUTU_KLINE_QUOTA, FUTU_KLINE_WINDOW_S
+
+
+def find_gaps(dates: pd.DatetimeIndex, market: str, start: date | None = None) -> list:
+    """
+    已保存的日期与交易日历比较，返回缺失的区间 [(开始, 结束, 缺失天数)]
+    只检查第一根和最后一根K线之间、且不早于 start 和交易日历开始日期的部分，没有交易日历时返回空
+    """
+    cal = CALENDAR_MARKETS.get(market.upper())
+    days = load_market_calendar(cal) if cal else np.array([], dtype="datetime64[D]")
+    if len(dates) == 0 or days.size == 0:
+        return []
+    stored = np.unique(pd.DatetimeIndex(dates).normalize().values.astype("datetime64[D]"))
+    first, last = max(stored[0], days[0]), stored[-1]
+    if start is not None:
+        first = max(first, np.datetime64(start, "D"))
+    expected = trading_days(market, first.astype(object), last.astype(object))
+    missing = np.setdiff1d(expected, stored, assume_unique=True)
+    if missing.size == 0:
+        return []
+
+    # 在交易日序列中相邻的缺失日属于同一个区间
+    pos = np.searchsorted(expected, missing)
+    breaks = np.flatnonzero(np.diff(pos) != 1) + 1
+    return [(g[0].astype(object), g[-1].astype(object), len(g)) for g in np.split(missing, breaks)]
+
+def _neighbours(stored: pd.DatetimeIndex, s: date, e: date) -> tuple:
+    """缺口两侧最近的已保存日期，用于检查复权基准"""
+    before = stored[stored < pd.Timestamp(s)]
+    after = stored[stored > pd.Timestamp(e)]
+    return (before[-1].date() if len(before) else s, after[0].date() if len(after) else e)
+
+def repair_gaps(symbols: list | None = None, markets: list | None = None,
+                start: str | None = None, dry_run: bool = False) -> dict:
+    """
+    检查并补齐缺口，返回 {futu代码: {"gaps": [...], "repaired": [...], "failed": [...]}}，
+    dry_run=True 时只检查不下载；只包含有缺口的标的
+    """
+    start_date = date.fromisoformat(start) if start else None
+    equities = []
+    for row in get_equities(only_valid=True):
+        e = Equity(**dict(row))
+        if symbols and e.symbol.lstrip("0") not in [str(s).upper().lstrip("0") for s in symbols]:
+            continue
+        if markets and e.market not in [m.upper() for m in markets]:
+            continue
+        equities.append(e)
+    no_cal = sorted({e.market for e in equities if e.market not in CALENDAR_MARKETS
+                     or load_market_calendar(CALENDAR_MARKETS[e.market]).size == 0})
+    if no_cal:
+        logger.info(f"没有交易日历，不检查缺口: {no_cal}")
+        equities = [e for e in equities if e.market not in no_cal]
+
+    t0 = time.perf_counter()
+    report, todo = {}, []
+    for e in equities:
+        ft_name = e.to_futu_symbol()
+        ocsv_file = os.path.join(OCSV_DIR, f"{ft_name}.csv")
+        if not os.path.exists(ocsv_file):
+            continue
+        df = pd.read_csv(ocsv_file, index_col=0, parse_dates=True)
+        gaps = find_gaps(pd.DatetimeIndex(df.index), e.market, start_date)
+        if gaps:
+            report[ft_name] = {"gaps": [{"start": str(s), "end": str(t), "days": n} for s, t, n in gaps],
+                               "repaired": [], "failed": []}
+            todo.append((ft_name, ocsv_file, df, gaps))
+    logger.info(f"检查缺口 {len(equities)} 个标的, {len(todo)} 个有缺口, 用时 {time.perf_counter() - t0:.1f}s")
+    if dry_run or not todo:
+        return report
+
+    manager = IndicatorManager()
+    manager.load_all_sets()
+    limiter = RateLimiter(FUTU_KLINE_QUOTA, FUTU_KLINE_WINDOW_S)
+    quote_ctx = OpenQuoteContext(host=FUTU_API_HOST, port=FUTU_API_PORT)
+    ctx = _LimitedContext(quote_ctx, limiter)
+    frames = {}
+    try:
+        for ft_name, ocsv_file, df, gaps in todo:
+            stored = pd.DatetimeIndex(df.index)
+            pages = []
+            for s, t, n in gaps:
+                lo, hi = _neighbours(stored, s, t)
+                item = {"start": str(s), "end": str(t), "days": n}
+                try:
+                    fetched = request_kline(ctx, ft_name, lo, hi)  # type: ignore
+                except KlineError as ex:
+                    report[ft_name]["failed"].append({**item, "reason": str(ex)})
+                    continue
+                data = pd.concat(fetched) if fetched else pd.DataFrame()
+                if data.empty:
+                    report[ft_name]["failed"].append({**item, "reason": "没有数据"})
+                    continue
+                if _adjust_changed(df, data):
+                    report[ft_name]["failed"].append({**item, "reason": "复权基准已变化，需要重新下载全部历史"})
+                    continue
+                got = data[(data.index >= pd.Timestamp(s)) & (data.index <= pd.Timestamp(t))]
+                got = got[~got.index.isin(stored)]
+                if got.empty:
+                    # 停牌或假期，缺口内本来就没有K线，无法补齐
+                    report[ft_name]["failed"].append({**item, "reason": "缺口内没有K线，无法补齐"})
+                    continue
+                pages.append(got)
+                report[ft_name]["repaired"].append({**item, "bars": len(got)})
+            if not pages:
+                # 没有新增K线时不改写数据
+                continue
+
+            # 缺口内的K线直接插入，已保存的K线保持不变；检查之后日线更新可能已写入新的K线，重新读取再合并
+            with ocsv_lock(ft_name):
+                df = pd.concat([_read_ocsv(ft_name)] + pages)
+                df = df[~df.index.duplicated(keep="first")].sort_index()
+                save_csv(df, ocsv_file)
+            df_with_ind = manager.calculate(df)
+            save_indicator_csv(ft_name, df_with_ind)
+            frames[ft_name] = df_with_ind
+            logger.info(f"补齐缺口 {ft_name}: {report[ft_name]['repaired']}")
+    finally:
+        quote_ctx.close()
+
+    if frames:
+        frames = attach_fundamentals(frames)
+        dump_frames_bin(frames)
+        update_snapshot(frames)
+        SERIES_CACHE.invalidate()
+    logger.info(f"补齐缺口完成 {len(frames)} 个标的, 用时 {time.perf_counter() - t0:.1f}s")
+    return report
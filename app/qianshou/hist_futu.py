@@ -14,23 +14,21 @@ import pandas as pd
 import akshare as ak
 import time as t
 from loguru import logger
-from datetime import datetime, timedelta, time
-from pathlib import Path
-from dotenv import load_dotenv
-from futu import OpenQuoteContext, RET_OK, KL_FIELD
+from datetime import datetime, timedelta, date
+from futu import OpenQuoteContext, RET_OK, KL_FIELD, TradeDateMarket
 
 from .models import Equity
-from .sqlite_db import get_equities, set_equities_last
+from .sqlite_db import get_equities, set_equities_last_symbols
 from .indicator_tools import IndicatorManager
 from .bin_tools import *
-
-
-
-# 加载环境变量
-BASE_DIR = Path(__file__).resolve().parent
-load_dotenv(dotenv_path=BASE_DIR / ".." / ".env")
-FUTU_API_HOST = os.getenv("FUTU_API_HOST", "127.0.0.1")
-FUTU_API_PORT = int(os.getenv("FUTU_API_PORT", "21111"))
+from .data_versions import save_csv, file_lock
+from .series_cache import SERIES_CACHE
+from .screener import update_snapshot
+from .finance_store import attach_fundamentals
+from .market_calendar import save_market_calendar, has_new_session, last_closed_day
+from .stage_timer import stage
+from .checkpoint import UpdateRun
+from .config import DATA_DIR, FUTU_API_HOST, FUTU_API_PORT, ADJUST_TOLERANCE, FETCH_SLEEP_S
 
 
 def _get_public_ip() -> str:
@@ -51,10 +49,21 @@ def _is_chinese_mainland() -> bool:
     country, region = _get_geo_info(ip)
     if country != "中国":
         return False
-    if region != "香港" or region != "澳门" or region != "台湾":
+    if region in ("香港", "澳门", "台湾"):
         return False
     return True
  
+def _refresh_market_calendars(ctx: OpenQuoteContext) -> None:
+    # 获取最近一年的交易日历并缓存，用于跳过休市的市场
+    start = (datetime.today() - timedelta(days=365)).strftime("%Y-%m-%d")
+    end = (datetime.today() + timedelta(days=30)).strftime("%Y-%m-%d")
+    for cal, market in [("US", TradeDateMarket.US), ("HK", TradeDateMarket.HK), ("CN", TradeDateMarket.CN)]:
+        ret, data = ctx.request_trading_days(market=market, start=start, end=end)
+        if ret != RET_OK or not data:
+            logger.warning(f"获取交易日历失败 {cal}: {data}")
+            continue
+        save_market_calendar(cal, [d['time'] for d in data])
+
 def _format_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     if df is None or df.empty:
         return df
@@ -71,85 +80,167 @@ def _format_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     # 设置为索引
     return df.set_index("date")
 
-def _update_equity(e: Equity, manager: IndicatorManager, ctx: OpenQuoteContext):
+class KlineError(RuntimeError):
+    """富途K线接口返回错误（限频、网络等），已取得的分页不完整"""
+
+
+def request_kline(ctx: OpenQuoteContext, ft_name: str, start_date: date, end_date: date,
+                  ktype: str = "K_DAY") -> list:
+    """
+    分页获取K线，返回每一页整理后的DataFrame
+    接口返回错误时抛出 KlineError，不返回不完整的分页，调用者决定跳过还是重试
+    """
+    pages = []
+    last_end = None
+    while True:
+        ret, data, last_page = ctx.request_history_kline(
+            code=ft_name,
+            start=start_date.strftime("%Y-%m-%d"),
+            end=end_date.strftime("%Y-%m-%d"),
+            ktype=ktype,
+            max_count=1000,
+            page_req_key=last_end,
+            fields=[KL_FIELD.DATE_TIME, 
+                    KL_FIELD.OPEN, KL_FIELD.HIGH, 
+                    KL_FIELD.LOW, KL_FIELD.CLOSE, 
+                    KL_FIELD.TRADE_VOL, 
+                    KL_FIELD.TRADE_VAL,         # 成交额
+                    KL_FIELD.PE_RATIO,          # 市盈率
+                    KL_FIELD.TURNOVER_RATE],    # 换手率
+        )
+        if ret != RET_OK:
+            raise KlineError(f"获取K线失败 {ft_name} {ktype} from {start_date} to {end_date}: {data}")
+        if data is None or not isinstance(data, pd.DataFrame) or data.empty:
+            logger.info(f"没有历史行情数据 {ft_name} {ktype} from {start_date} to {end_date}: {ret} {data}")
+            break
+        
+        # 重新整理格式，并保存到列表中
+        pages.append(_format_dataframe(data))
+
+        if last_page is None:  # 没有更多分页
+            logger.info(f"最后一页行情数据{ft_name} {ktype} from {start_date} to {end_date}")
+            break
+        last_end = last_page
+        logger.info(f"中间页行情数据{ft_name} {ktype} from {start_date} to {end_date}")
+    return pages
+
+def _adjust_changed(df: pd.DataFrame, new_data: pd.DataFrame) -> bool:
+    """
+    比较重叠K线的收盘价，判断前复权的基准是否发生变化（拆股、分红等）
+    前复权数据在除权后会整体改变历史价格，已保存的数据需要重新下载
+    """
+    if df.empty or new_data.empty:
+        return False
+    old = df["close"].groupby(level=0).last()
+    new = new_data["close"].groupby(level=0).last()
+    overlap = old.index.intersection(new.index)
+    if overlap.empty:
+        return False
+    old, new = old.loc[overlap].astype(float), new.loc[overlap].astype(float)
+    diff = ((new - old).abs() / old.abs()).max()
+    return bool(diff > ADJUST_TOLERANCE)
+
+def _covers_history(df: pd.DataFrame, pages: list) -> bool:
+    """重新下载的全部历史是否覆盖已保存的第一根到最后一根K线，不完整时不能替换已有数据"""
+    pages = [p for p in pages if isinstance(p, pd.DataFrame) and not p.empty]
+    if not pages:
+        return False
+    if df.empty:
+        return True
+    return (min(p.index.min() for p in pages) <= df.index.min()
+            and max(p.index.max() for p in pages) >= df.index.max())
+
+def ocsv_lock(ft_name: str):
+    """
+    读取、合并、写回同一个标的的原始CSV时持有，日线更新、命令行回补和补缺口可能在不同进程中同时运行，
+    不加锁时后写入的一方会覆盖另一方合并的K线
+    """
+    return file_lock(os.path.join(DATA_DIR, "locks", f"ocsv_{ft_name}.lock"))
+
+def _read_ocsv(ft_name: str) -> pd.DataFrame:
+    ocsv_file = os.path.join(OCSV_DIR, f"{ft_name}.csv")
+    if not os.path.exists(ocsv_file):
+        return pd.DataFrame()
+    return pd.read_csv(ocsv_file, index_col=0, parse_dates=True)
+
+def _compute_equity(ft_name: str, df: pd.DataFrame, manager: IndicatorManager) -> pd.DataFrame:
+    # 计算各种指标，即使数据无更新，自定义指标库也可能已发生变化，重新计算
+    with stage("daily.indicators"):
+        df_with_ind = manager.calculate(df) 
+
+    # 保存有指标结果的CSV
+    save_indicator_csv(ft_name, df_with_ind)
+    return df_with_ind
+
+def _fetch_equity(e: Equity, ctx: OpenQuoteContext) -> tuple[pd.DataFrame, bool]:
+    """下载增量行情并保存原始CSV，返回合并后的原始数据，以及是否成功（失败时为已保存的数据）"""
     ft_name = e.to_futu_symbol()
     logger.debug(f"准备更新标的 {ft_name}")
     
     ocsv_file = os.path.join(OCSV_DIR, f"{ft_name}.csv")
     logger.info(f"原始数据文件: {ocsv_file}")
 
-    # 读取已有csv
+    # 读取已有csv，增量下载时多取最后一根已保存的K线用于检查复权变化
+    hist_start = datetime.strptime("1990-01-01", "%Y-%m-%d").date()
     if os.path.exists(ocsv_file):
         df = pd.read_csv(ocsv_file, index_col=0, parse_dates=True)
         last_date = df.index.max()
         start_date = (last_date + timedelta(days=1)).date()
+        fetch_start = last_date.date()
     else:
         df = pd.DataFrame()
-        start_date = datetime.strptime("1990-01-01", "%Y-%m-%d").date()
+        start_date = fetch_start = hist_start
 
-    # 下载增量数据
-    if datetime.now().time() < time(17, 0, 0):
-        today = (datetime.today() - timedelta(days=1)).date()
-    else:
-        today = datetime.today().date()
+    # 下载增量数据，截止到该市场最近一个已收盘的日期
+    today = last_closed_day(e.market)
     logger.info(f"{ft_name}: {start_date} - {today}")
 
-    if start_date <= today:
+    fetched, ok = False, True
+    if start_date <= today and not has_new_session(e.market, start_date, today):
+        logger.info(f"{e.market}市场休市，无需下载 {ft_name}: {start_date} - {today}")
+    elif start_date <= today:
+        fetched = True
         # 分页获取行情
-        all_data = []
-        all_data.append(df)
-        last_end = None
-        while True:
-            ret, data, last_page = ctx.request_history_kline(
-                code=ft_name,
-                start=start_date.strftime("%Y-%m-%d"),
-                end=today.strftime("%Y-%m-%d"),
-                ktype="K_DAY",
-                max_count=1000,
-                page_req_key=last_end,
-                fields=[KL_FIELD.DATE_TIME, 
-                        KL_FIELD.OPEN, KL_FIELD.HIGH, 
-                        KL_FIELD.LOW, KL_FIELD.CLOSE, 
-                        KL_FIELD.TRADE_VOL, 
-                        KL_FIELD.TRADE_VAL,         # 成交额
-                        KL_FIELD.PE_RATIO,          # 市盈率
-                        KL_FIELD.TURNOVER_RATE],    # 换手率
-            )
-            if ret != RET_OK or data is None or not isinstance(data, pd.DataFrame) or data.empty:
-                logger.info(f"没有历史行情数据 {ft_name} from {start_date} to {today}: {ret} {data}")
-                break
-            
-            # 重新整理格式，并保存到列表中
-            all_data.append(_format_dataframe(data))
-
-            if last_page is None:  # 没有更多分页
-                logger.info(f"最后一页行情数据{ft_name} from {start_date} to {today}")
-                break
-            last_end = last_page
-            logger.info(f"中间页行情数据{ft_name} from {start_date} to {today}")
+        try:
+            with stage("daily.fetch"):
+                pages = request_kline(ctx, ft_name, fetch_start, today)
+            if pages and _adjust_changed(df, pd.concat(pages)):
+                logger.warning(f"复权基准已变化，重新下载全部历史 {ft_name}")
+                with stage("daily.fetch"):
+                    full = request_kline(ctx, ft_name, hist_start, today)
+                if _covers_history(df, full):
+                    df, pages = pd.DataFrame(), full
+                else:
+                    # 新旧复权基准的数据不能混合，增量数据也不合并，下次更新时重试
+                    logger.error(f"重新下载的历史没有覆盖已保存的K线，保留已有数据 {ft_name}")
+                    pages, ok = [], False
+        except KlineError as ex:
+            # 不合并不完整的数据，保留已保存的历史，下次更新时重新下载
+            logger.error(f"{ex}，保留已有数据 {ft_name}")
+            pages, ok = [], False
+            df = _read_ocsv(ft_name)
+        all_data = [df] + pages
         
         if len(all_data) == 1:
             logger.info(f"没有历史行情数据 {ft_name} from {start_date} to {today}")
         else:
-            # 合并数据
+            # 合并数据，重叠的K线以新数据为准
             df = pd.concat(all_data)
+            df = df[~df.index.duplicated(keep="last")]
 
             # 保存原始的CSV
-            df.to_csv(ocsv_file)
+            with stage("daily.write_csv"):
+                save_csv(df, ocsv_file)
             logger.info(f"更新数据文件: {ocsv_file}, 总记录数: {len(df)} => {ft_name} {start_date} - {today}")
         
     else:
         logger.warning(f"尝试下载行情数据失败: {ft_name}: {start_date} - {today}")
     
 
-    # 计算各种指标，即使数据无更新，自定义指标库也可能已发生变化，重新计算
-    df_with_ind = manager.calculate(df) 
-
-    # 保存有指标结果的CSV
-    csv_file = os.path.join(CSV_DIR, f"{ft_name}.csv")
-    df_with_ind.to_csv(csv_file)
-    logger.info(f"待分析数据文件: {csv_file}")
-    t.sleep(3)
+    if fetched:
+        with stage("daily.sleep"):
+            t.sleep(FETCH_SLEEP_S)
+    return df, ok
 
 def _ak_request_history(symbol: str, start: str, end: str) -> pd.DataFrame | None:  
     logger.debug(f"AK获取历史数据{symbol} {start}-{end}")  
@@ -190,7 +281,7 @@ def _ak_request_history(symbol: str, start: str, end: str) -> pd.DataFrame | Non
     # 设置为索引
     return df.set_index("date")
 
-def _akshare_update_equity(e: Equity, manager: IndicatorManager):
+def _akshare_fetch_equity(e: Equity) -> tuple[pd.DataFrame, bool]:
     ft_name = e.to_futu_symbol()
     ak_name = e.to_akshare_name()
     logger.debug(f"AK准备更新标的 {ak_name}")
@@ -198,79 +289,148 @@ def _akshare_update_equity(e: Equity, manager: IndicatorManager):
     ocsv_file = os.path.join(OCSV_DIR, f"{ft_name}.csv")
     logger.info(f"原始数据文件: {ocsv_file}")
 
-    # 读取已有csv
+    # 读取已有csv，增量下载时多取最后一根已保存的K线用于检查复权变化
+    hist_start = datetime.strptime("1990-01-01", "%Y-%m-%d").date()
     if os.path.exists(ocsv_file):
         df = pd.read_csv(ocsv_file, index_col=0, parse_dates=True)
         last_date = df.index.max()
         start_date = (last_date + timedelta(days=1)).date()
+        fetch_start = last_date.date()
     else:
         df = pd.DataFrame()
-        start_date = datetime.strptime("1990-01-01", "%Y-%m-%d").date()
+        start_date = fetch_start = hist_start
 
-    # 下载增量数据
-    if datetime.now().time() < time(17, 0, 0):
-        today = (datetime.today() - timedelta(days=1)).date()
-    else:
-        today = datetime.today().date()
+    # 下载增量数据，截止到该市场最近一个已收盘的日期
+    today = last_closed_day(e.market)
     
     logger.info(f"{ft_name}: {start_date} - {today}")
 
-    if start_date <= today:
+    fetched, ok = False, True
+    if start_date <= today and not has_new_session(e.market, start_date, today):
+        logger.info(f"{e.market}市场休市，AK无需下载 {ak_name}: {start_date} - {today}")
+    elif start_date <= today:
+        fetched = True
         # 获取行情
-        data = _ak_request_history(symbol=ak_name, start=start_date.strftime("%Y%m%d"), end=today.strftime("%Y%m%d"))
+        with stage("daily.fetch_ak"):
+            data = _ak_request_history(symbol=ak_name, start=fetch_start.strftime("%Y%m%d"), end=today.strftime("%Y%m%d"))
+        if isinstance(data, pd.DataFrame) and _adjust_changed(df, data):
+            logger.warning(f"AK复权基准已变化，重新下载全部历史 {ak_name}")
+            full = _ak_request_history(symbol=ak_name, start=hist_start.strftime("%Y%m%d"), end=today.strftime("%Y%m%d"))
+            if isinstance(full, pd.DataFrame) and _covers_history(df, [full]):
+                df, data = pd.DataFrame(), full
+            else:
+                logger.error(f"AK重新下载的历史没有覆盖已保存的K线，保留已有数据 {ak_name}")
+                data = None
+        # 多次重试仍失败时为None，没有新数据时为空表
+        ok = isinstance(data, pd.DataFrame)
         if data is None or not isinstance(data, pd.DataFrame) or data.empty:
             logger.info(f"AK没有历史行情数据 {ak_name} from {start_date} to {today}")
         else:
-            # 合并数据
+            # 合并数据，重叠的K线以新数据为准
             df = pd.concat([df, data])
+            df = df[~df.index.duplicated(keep="last")]
 
             # 保存原始的CSV
-            df.to_csv(ocsv_file)
+            with stage("daily.write_csv"):
+                save_csv(df, ocsv_file)
             logger.info(f"AK 更新数据文件: {ocsv_file}, 总记录数: {len(df)} => {ak_name} {start_date} - {today}")
         
     else:
         logger.warning(f"AK尝试下载行情数据失败: {ak_name}: {start_date} - {today}")  
 
 
-    # 计算各种指标，即使数据无更新，自定义指标库也可能已发生变化，重新计算
-    df_with_ind = manager.calculate(df) 
-
-    # 保存有指标结果的CSV
-    csv_file = os.path.join(CSV_DIR, f"{ft_name}.csv")
-    df_with_ind.to_csv(csv_file)
-    logger.info(f"待分析数据文件: {csv_file}")
-    t.sleep(3)
-
-def futu_update_daily():
-    a_shares = []
-
-    # 连接 FUTU
-    quote_ctx = OpenQuoteContext(host=FUTU_API_HOST, port=FUTU_API_PORT)
-
-    # 加载指标管理
-    manager = IndicatorManager()
-    manager.load_all_sets()
+    if fetched:
+        with stage("daily.sleep"):
+            t.sleep(FETCH_SLEEP_S)
+    return df, ok
 
+def _checkpointed_equity(run: UpdateRun, e: Equity, manager: IndicatorManager, fetch) -> tuple[pd.DataFrame, bool]:
+    """
+    按检查点进度处理一个标的：已计算的直接读取，已下载的只重新计算，其余的下载后计算
+    返回计算结果和是否下载成功；下载失败时用已保存的数据计算，不记录进度，继续运行时重新下载
+    """
+    ft_name = e.to_futu_symbol()
+    done = run.stage(ft_name)
+    if done in ("computed", "dumped"):
+        df = run.load_frame(ft_name)
+        if df is not None:
+            logger.info(f"使用检查点 {ft_name}")
+            return df, True
+    if done is None:
+        with ocsv_lock(ft_name):
+            df, ok = fetch(e)
+        if not ok:
+            return _compute_equity(ft_name, df, manager), False
+        run.mark([ft_name], "fetched")
+    else:
+        logger.info(f"已下载，只重新计算 {ft_name}")
+        df = _read_ocsv(ft_name)
+    df_with_ind = _compute_equity(ft_name, df, manager)
+    run.save_frame(ft_name, df_with_ind)
+    run.mark([ft_name], "computed")
+    return df_with_ind, True
+
+def futu_update_daily(markets: list | None = None):
+    """
+    更新日线数据，指定markets时只更新并导出这些市场的标的
+    每个标的的进度保存为检查点，中途退出后再次运行时跳过已完成的标的
+    """
+    equities = []
     for row in get_equities(only_valid=True):
         e = Equity(**dict(row))
-        _update_equity(e, manager, quote_ctx)
-        if e.market == 'SH' or e.market == 'SZ':
-            a_shares.append(e)
-    
-    quote_ctx.close()
+        if markets and e.market not in markets:
+            continue
+        equities.append(e)
+    if not equities:
+        # 例如没有 OTHER_MARKETS 的标的，不连接Futu，也不发布新版本
+        logger.info(f"没有需要更新的标的: {markets}")
+        return
 
     # 摘自FUTU API 文档：
     # - 中国内地 IP 个人客户：免费获取 LV1 行情
     # - 港澳台及海外IP客户/机构客户：暂不支持
     # 
-    # 当位置不在大陆时，使用akshre获取历史数据
-    if not _is_chinese_mainland():
-        for e in a_shares:
-            _akshare_update_equity(e, manager)
+    # 当位置不在大陆时，使用akshre获取A股历史数据
+    use_ak = any(e.market in ('SH', 'SZ') for e in equities) and not _is_chinese_mainland()
 
-    # 转换为Qlib的BIN格式
-    convert_csv_to_bin()
-    
-    # 更新最后更新时间
-    set_equities_last()
+    run = UpdateRun("futu_daily", markets)
+    frames, updated = {}, []
 
+    # 连接 FUTU
+    quote_ctx = OpenQuoteContext(host=FUTU_API_HOST, port=FUTU_API_PORT)
+    try:
+        with stage("daily.calendars"):
+            _refresh_market_calendars(quote_ctx)
+
+        # 加载指标管理
+        manager = IndicatorManager()
+        manager.load_all_sets()
+
+        for e in equities:
+            if use_ak and e.market in ('SH', 'SZ'):
+                fetch = _akshare_fetch_equity
+            else:
+                fetch = lambda x: _fetch_equity(x, quote_ctx)
+            frames[e.to_futu_symbol()], ok = _checkpointed_equity(run, e, manager, fetch)
+            if ok:
+                updated.append(e)
+    finally:
+        quote_ctx.close()
+
+    # 按公告日加上财报特征，直接把计算结果写为Qlib的BIN格式
+    with stage("daily.fundamentals"):
+        frames = attach_fundamentals(frames)
+    with stage("daily.dump_bin"):
+        dump_frames_bin(frames)
+    run.mark([e.to_futu_symbol() for e in updated], "dumped")
+
+    # 刷新选股快照
+    with stage("daily.snapshot"):
+        update_snapshot(frames)
+    
+    # 原始数据已更新，清除临时公式计算的行情缓存
+    SERIES_CACHE.invalidate()
+    
+    # 更新最后更新时间，只包括本次下载成功的标的，失败的标的保持原来的时间
+    set_equities_last_symbols([e.symbol for e in updated])
+    run.finish()
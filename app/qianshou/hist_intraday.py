@@ -0,0 +1,189 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-11 19:40:26
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-11 19:40:26
+FilePath: /mss_qianshou/app/qianshou/hist_intraday.py
+Description: 分钟级K线的获取与按日分区存储
+
+数据按 标的/交易日 分区保存: DATA_DIR/intraday/<K线类型>/<标的>/<YYYY-MM-DD>.csv
+追加和按日期范围读取都只涉及相关的分区文件。
+导出的Qlib BIN每个市场一个目录和分钟日历: DATA_DIR/intraday/qlib_<频率>/<市场>/current，
+各市场的分钟时间是当地时间，放在同一个日历中会互相交错；已导出的标的只读取最后导出日及以后的分区。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os, threading
+import pandas as pd
+import time as t
+from datetime import date, datetime, timedelta
+from loguru import logger
+
+from .models import Equity
+from .sqlite_db import get_equities
+from .equity_registry import EQUITY_REGISTRY
+from .bin_tools import write_qlib_bins, read_qlib_bins, _read_calendar, _read_instruments
+from .indicator_tools import numeric_columns
+from .data_versions import staged_version, save_csv
+from .market_calendar import last_closed_day
+from .config import FUTU_API_HOST, FUTU_API_PORT, INTRADAY_KTYPES, INTRADAY_HISTORY_DAYS, INTRA_DIR, FETCH_SLEEP_S
+from .providers import lazy_import
+
+# 读取分区时不需要加载futu
+futu = lazy_import("futu")
+
+# Futu K线类型 -> Qlib 频率
+QLIB_FREQ = {
+    "K_1M": "1min",
+    "K_5M": "5min",
+    "K_15M": "15min",
+    "K_30M": "30min",
+    "K_60M": "60min",
+}
+
+# 不同市场的任务可能同时导出
+_EXPORT_LOCK = threading.Lock()
+
+
+def _partition_dir(ktype: str, ft_name: str) -> str:
+    # ktype 来自请求参数，只允许支持的类型，避免拼出 INTRA_DIR 之外的路径
+    if ktype not in QLIB_FREQ:
+        raise ValueError(f"unsupported ktype: {ktype}")
+    return os.path.join(INTRA_DIR, ktype, ft_name)
+
+def list_partitions(ktype: str, ft_name: str) -> list:
+    """已保存的交易日分区，按日期排序"""
+    p_dir = _partition_dir(ktype, ft_name)
+    if not os.path.exists(p_dir):
+        return []
+    return sorted(f[:-4] for f in os.listdir(p_dir) if f.endswith(".csv"))
+
+def _read_partition(path: str) -> pd.DataFrame:
+    return pd.read_csv(path, index_col=0, parse_dates=True)
+
+def write_partitions(ktype: str, ft_name: str, df: pd.DataFrame) -> int:
+    """按交易日写入分区，与分区中已有的数据合并，返回写入的分区数"""
+    p_dir = _partition_dir(ktype, ft_name)
+    os.makedirs(p_dir, exist_ok=True)
+    count = 0
+    for day, part in df.groupby(df.index.date):
+        path = os.path.join(p_dir, f"{day}.csv")
+        if os.path.exists(path):
+            part = pd.concat([_read_partition(path), part])
+        part = part[~part.index.duplicated(keep="last")].sort_index()
+        save_csv(part, path)
+        count += 1
+    return count
+
+def read_intraday(ft_name: str, ktype: str, start_date: date, end_date: date) -> pd.DataFrame:
+    """只读取日期范围内的分区"""
+    days = [d for d in list_partitions(ktype, ft_name) if str(start_date) <= d <= str(end_date)]
+    if not days:
+        return pd.DataFrame()
+    p_dir = _partition_dir(ktype, ft_name)
+    return pd.concat([_read_partition(os.path.join(p_dir, f"{d}.csv")) for d in days])
+
+def _update_intraday(e: Equity, ktype: str, ctx) -> None:
+    from .hist_futu import request_kline, KlineError    # hist_futu会加载akshare，只在更新时导入
+    ft_name = e.to_futu_symbol()
+    parts = list_partitions(ktype, ft_name)
+    today = last_closed_day(e.market)
+    if parts:
+        # 从最后一个分区所在的交易日重新获取，补齐可能不完整的分区
+        start_date = datetime.strptime(parts[-1], "%Y-%m-%d").date()
+    else:
+        start_date = today - timedelta(days=INTRADAY_HISTORY_DAYS)
+    if start_date > today:
+        return
+
+    try:
+        pages = request_kline(ctx, ft_name, start_date, today, ktype=ktype)
+    except KlineError as ex:
+        logger.error(f"{ex}，跳过 {ft_name} {ktype}")
+        return
+    if not pages:
+        logger.info(f"没有分钟行情数据 {ft_name} {ktype} from {start_date} to {today}")
+        return
+    df = pd.concat(pages).rename_axis("datetime")
+    count = write_partitions(ktype, ft_name, df)
+    logger.info(f"更新分钟行情 {ft_name} {ktype}: {len(df)} 条, {count} 个分区")
+    t.sleep(FETCH_SLEEP_S)
+
+def _load_frame(ktype: str, code: str, qlib_dir: str, calendar: list, exported: dict, freq: str) -> pd.DataFrame | None:
+    # 已导出的标的只读取最后导出日及以后的分区（该日可能已补齐），之前的部分读取已有的BIN
+    end = exported.get(code.upper())
+    since = end[1][:10] if end else None
+    days = [d for d in list_partitions(ktype, code) if since is None or d >= since]
+    if not days:
+        return None
+    p_dir = _partition_dir(ktype, code)
+    df = pd.concat([_read_partition(os.path.join(p_dir, f"{d}.csv")) for d in days])
+    df.index = df.index.strftime("%Y-%m-%d %H:%M:%S")
+    df.columns = [str(c).lower() for c in df.columns]
+    if since is not None:
+        old = read_qlib_bins(qlib_dir, code, calendar, freq)
+        df = pd.concat([old[old.index < since], df])
+    df = df[~df.index.duplicated(keep="last")].sort_index()
+    return numeric_columns(df)
+
+def export_intraday_bin(ktype: str, codes: list | None = None) -> None:
+    """导出为Qlib分钟频率的BIN格式，每个市场的当前版本为 DATA_DIR/intraday/qlib_<freq>/<市场>/current"""
+    freq = QLIB_FREQ[ktype]
+    k_dir = os.path.join(INTRA_DIR, ktype)
+    all_codes = sorted(os.listdir(k_dir)) if os.path.exists(k_dir) else []
+    by_market = {}
+    for code in (codes or all_codes):
+        if code in all_codes:
+            by_market.setdefault(code.split(".")[0], []).append(code)
+
+    with _EXPORT_LOCK:
+        for market, m_codes in sorted(by_market.items()):
+            root = os.path.join(INTRA_DIR, f"qlib_{freq}", market)
+            with staged_version(root) as qlib_dir:
+                calendar = _read_calendar(qlib_dir, freq)
+                exported = _read_instruments(os.path.join(qlib_dir, "instruments", "all.txt"))
+                frames = {}
+                for code in m_codes:
+                    df = _load_frame(ktype, code, qlib_dir, calendar, exported, freq)
+                    if df is not None:
+                        frames[code] = df
+                if frames and not write_qlib_bins(qlib_dir, frames, freq):
+                    # 同一市场中个别标的有更早的分钟时间（例如补齐的分区），读出其他标的已有的BIN重新对齐
+                    logger.info(f"分钟日历中间插入了新时间，重新对齐 {market} {ktype}")
+                    others = {c: read_qlib_bins(qlib_dir, c, calendar, freq) for c in exported if c not in frames}
+                    write_qlib_bins(qlib_dir, {**others, **frames}, freq, rebuild=True)
+
+def futu_update_intraday(markets: list | None = None, ktypes: list | None = None):
+    """更新分钟K线并导出Qlib BIN，未指定ktypes时使用 INTRADAY_KTYPES"""
+    ktypes = ktypes or INTRADAY_KTYPES
+    if not ktypes:
+        return
+
+    quote_ctx = futu.OpenQuoteContext(host=FUTU_API_HOST, port=FUTU_API_PORT)
+    codes = []
+    for row in get_equities(only_valid=True):
+        e = Equity(**dict(row))
+        if markets and e.market not in markets:
+            continue
+        codes.append(e.to_futu_symbol())
+        for ktype in ktypes:
+            _update_intraday(e, ktype, quote_ctx)
+    quote_ctx.close()
+
+    for ktype in ktypes:
+        export_intraday_bin(ktype, codes)
+
+def load_equity_intraday(symbol: str, ktype: str, start_date: date, end_date: date) -> list:
+    res = []
+
+    entry = EQUITY_REGISTRY.get(symbol)
+    if entry is None:
+        logger.error(f"找不到股票{symbol}，无法获得分钟行情")
+        return res
+
+    df = read_intraday(entry.futu, ktype, start_date, end_date)
+    if df.empty:
+        return res
+    df = df.replace({float('nan'): None}).reset_index()
+    return df.to_dict(orient="records")
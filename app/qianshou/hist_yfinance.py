@@ -14,13 +14,16 @@ import yfinance as yf
 import pandas as pd
 from loguru import logger
 from datetime import datetime, timedelta
-from pathlib import Path
-from dotenv import load_dotenv
 
 from .models import Equity
 from .sqlite_db import get_equities, set_equities_last
 from .indicator_tools import IndicatorManager
 from .bin_tools import *
+from .data_versions import save_csv
+from .series_cache import SERIES_CACHE
+from .screener import update_snapshot
+from .finance_store import attach_fundamentals
+from .market_calendar import has_new_session
 
 
 def _has_not_stock(ticker: str) -> bool:
@@ -55,13 +58,13 @@ def _format_dataframe(df: pd.DataFrame, symbol: str) -> pd.DataFrame:
     # 将date作为index准备与已有数据合并
     return df.set_index("date")
 
-def _update_equity(e: Equity, manager: IndicatorManager):
+def _update_equity(e: Equity, manager: IndicatorManager) -> pd.DataFrame | None:
     yf_name = e.to_yfinance_symbol()
     ft_name = e.to_futu_symbol()
     logger.debug(f"准备更新标的{yf_name}==={ft_name}")
     if _has_not_stock(yf_name):
         logger.info(f"没有行情数据 {yf_name}")
-        return
+        return None
     
     ocsv_file = os.path.join(OCSV_DIR, f"{ft_name}.csv")
     logger.info(f"原始数据文件: {ocsv_file}")
@@ -78,7 +81,9 @@ def _update_equity(e: Equity, manager: IndicatorManager):
     # 下载增量数据
     today = datetime.today()
     logger.info(f"{yf_name}: {start_date} - {today}")
-    if start_date <= today:
+    if start_date <= today and not has_new_session(e.market, start_date.date(), today.date()):
+        logger.info(f"{e.market}市场休市，无需下载 {yf_name}: {start_date} - {today}")
+    elif start_date <= today:
         new_data = yf.download(yf_name, 
                                start=start_date.strftime("%Y-%m-%d"), 
                                end=today.strftime("%Y-%m-%d"), 
@@ -94,34 +99,41 @@ def _update_equity(e: Equity, manager: IndicatorManager):
             df = pd.concat([df, new_data])
 
             # 保存原始的CSV
-            df.to_csv(ocsv_file)
+            save_csv(df, ocsv_file)
             logger.info(f"更新数据文件: {ocsv_file}, 总记录数: {len(new_data)} => {yf_name} {start_date} - {today}")
     else:
         logger.warning(f"尝试下载行情数据失败: {yf_name}: {start_date} - {today}")
     
     if df is None or df.empty:
         logger.info(f"没有原始数据需要计算指标 {yf_name}")
-        return
+        return None
     
     # 计算各种指标，即使数据无更新，自定义指标库也可能已发生变化，重新计算
     df_with_ind = manager.calculate(df) 
 
     # 保存有指标结果的CSV
-    csv_file = os.path.join(CSV_DIR, f"{ft_name}.csv")
-    df_with_ind.to_csv(csv_file)
-    logger.info(f"生成待分析数据文件: {csv_file}")
+    save_indicator_csv(ft_name, df_with_ind)
+    return df_with_ind
 
 def yfinance_update_daily():
     # 加载指标管理
     manager = IndicatorManager()
     manager.load_all_sets()
 
+    frames = {}
     for row in get_equities(only_valid=True):
         e = Equity(**dict(row))
-        _update_equity(e, manager)
+        frames[e.to_futu_symbol()] = _update_equity(e, manager)
     
-    # 转换为Qlib的BIN格式
-    convert_csv_to_bin()
+    # 按公告日加上财报特征，直接把计算结果写为Qlib的BIN格式
+    frames = attach_fundamentals(frames)
+    dump_frames_bin(frames)
+
+    # 刷新选股快照
+    update_snapshot(frames)
+    
+    # 原始数据已更新，清除临时公式计算的行情缓存
+    SERIES_CACHE.invalidate()
     
     # 更新最后更新时间
     set_equities_last()
@@ -0,0 +1,207 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-09 09:32:18
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-09 09:32:18
+FilePath: /mss_qianshou/app/qianshou/hot_store.py
+Description: 行情与指标的热数据存储（内存映射），供查询接口使用
+
+每次导出BIN之后，把每个标的的全部字段整理成一个连续的二维数组
+(字段 x 交易日) 保存为 .npy，查询时以只读方式内存映射。
+多个 uvicorn worker 映射同一组文件，共享操作系统的页缓存，不会重复占用内存。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os, json, shutil, threading
+import numpy as np
+import pandas as pd
+from datetime import date, datetime
+from pathlib import Path
+from loguru import logger
+
+from .data_versions import current_version, file_lock
+from .config import DATA_DIR, HOT_STORE_ENABLED, HOT_STORE_KEEP, HOT_DIR
+
+HOT_POINTER = os.path.join(HOT_DIR, "CURRENT")              # 当前版本指针
+HOT_BUILD_LOCK = os.path.join(HOT_DIR, "build.lock")        # 多个进程（worker、命令行）生成热数据时互斥
+
+
+def read_bin(path: Path) -> tuple[int, np.ndarray]:
+    # Qlib BIN格式: 第一个float32为起始日在日历中的序号，其后为逐日数据
+    arr = np.fromfile(path, dtype="<f4")
+    if arr.size == 0:
+        return 0, arr
+    return int(arr[0]), arr[1:]
+
+def read_instrument(inst_dir: str | Path, freq: str = "day") -> tuple[int, list, np.ndarray] | None:
+    """
+    读取标的全部字段的BIN并按日历对齐，返回 (起始日序号, 字段名, 二维数组)
+    字段名大写并排序，每个字段在数组中占一行，覆盖从最早到最晚的日期，缺失处为NaN
+    """
+    suffix = f".{freq}.bin"
+    series = {}
+    for p in Path(inst_dir).glob(f"*{suffix}"):
+        start, values = read_bin(p)
+        if values.size:
+            series[p.name[:-len(suffix)].upper()] = (start, values)
+    if not series:
+        return None
+    fields = sorted(series.keys())
+    start = min(s for s, _ in series.values())
+    end = max(s + len(v) for s, v in series.values())
+    block = np.full((len(fields), end - start), np.nan, dtype="<f4")
+    for i, f in enumerate(fields):
+        s, v = series[f]
+        block[i, s - start:s - start + len(v)] = v
+    return start, fields, block
+
+def build_hot_store(only_missing: bool = False) -> str | None:
+    """
+    根据当前的Qlib BIN数据生成新版本的热数据，并原子切换版本指针
+    生成和清理旧版本都在文件锁内进行，不会删除其他进程正在生成的目录；
+    only_missing=True 时如果其他进程已经生成过则直接返回
+    """
+    with file_lock(HOT_BUILD_LOCK):
+        if only_missing and os.path.exists(HOT_POINTER):
+            return None
+        return _build_hot_store()
+
+def _build_hot_store() -> str | None:
+    qlib_dir = current_version(DATA_DIR) or DATA_DIR
+    cal_file = os.path.join(qlib_dir, "calendars", "day.txt")
+    features_dir = Path(os.path.join(qlib_dir, "features"))
+    if not os.path.exists(cal_file) or not features_dir.exists():
+        logger.warning(f"没有Qlib数据，无法生成热数据: {DATA_DIR}")
+        return None
+
+    stamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    build_dir = os.path.join(HOT_DIR, stamp)
+    os.makedirs(build_dir, exist_ok=True)
+
+    calendar = pd.read_csv(cal_file, header=None)[0].values.astype("datetime64[D]")
+    np.save(os.path.join(build_dir, "calendar.npy"), calendar)
+
+    index = {}
+    for inst_dir in features_dir.iterdir():
+        # 对齐所有字段，每个字段在二维数组中占连续的一行
+        inst = read_instrument(inst_dir)
+        if inst is None:
+            continue
+        start, fields, block = inst
+        np.save(os.path.join(build_dir, f"{inst_dir.name}.npy"), block)
+        index[inst_dir.name] = {"start": start, "fields": fields}
+
+    with open(os.path.join(build_dir, "index.json"), "w") as f:
+        json.dump(index, f)
+
+    # 原子切换指针，正在读取旧版本的进程不受影响
+    tmp = HOT_POINTER + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(stamp)
+    os.replace(tmp, HOT_POINTER)
+    logger.info(f"生成热数据版本 {stamp}, 标的数量: {len(index)}")
+
+    # 清理旧版本（已映射的文件在删除后仍然可读）
+    builds = sorted(d for d in os.listdir(HOT_DIR) if os.path.isdir(os.path.join(HOT_DIR, d)))
+    for d in builds[:-HOT_STORE_KEEP]:
+        shutil.rmtree(os.path.join(HOT_DIR, d), ignore_errors=True)
+    return stamp
+
+
+class _HotSnapshot:
+    """一个热数据版本，加载后不再修改，查询时整体读取一次"""
+    __slots__ = ("stamp", "calendar", "index", "arrays")
+
+    def __init__(self, stamp: str | None, calendar: np.ndarray, index: dict, arrays: dict):
+        self.stamp = stamp
+        self.calendar = calendar
+        self.index = index
+        self.arrays = arrays
+
+
+_EMPTY = _HotSnapshot(None, np.array([], dtype="datetime64[D]"), {}, {})
+
+
+class HotStore:
+    def __init__(self):
+        self._snap = _EMPTY
+        self._pointer_mtime: int = 0
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """启动时加载，如果还没有热数据则先生成"""
+        if not HOT_STORE_ENABLED:
+            return
+        if not os.path.exists(HOT_POINTER):
+            build_hot_store(only_missing=True)
+        self.reload()
+
+    def reload(self) -> None:
+        if not HOT_STORE_ENABLED or not os.path.exists(HOT_POINTER):
+            return
+        with self._lock:
+            mtime = os.stat(HOT_POINTER).st_mtime_ns
+            with open(HOT_POINTER, "r") as f:
+                stamp = f.read().strip()
+            if stamp == self._snap.stamp:
+                self._pointer_mtime = mtime
+                return
+            build_dir = os.path.join(HOT_DIR, stamp)
+            try:
+                calendar = np.load(os.path.join(build_dir, "calendar.npy"))
+                with open(os.path.join(build_dir, "index.json"), "r") as f:
+                    index = json.load(f)
+                arrays = {
+                    code: np.load(os.path.join(build_dir, f"{code}.npy"), mmap_mode="r")
+                    for code in index.keys()
+                }
+            except Exception as e:
+                logger.error(f"加载热数据版本 {stamp} 失败: {e}")
+                return
+            self._snap = _HotSnapshot(stamp, calendar, index, arrays)
+            self._pointer_mtime = mtime
+        logger.info(f"加载热数据版本 {stamp}, 标的数量: {len(index)}")
+
+    def _refresh(self) -> None:
+        # 其他进程导出数据后会更新指针文件，这里只需比较修改时间
+        try:
+            mtime = os.stat(HOT_POINTER).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._pointer_mtime:
+            self.reload()
+
+    def version(self) -> str | None:
+        """当前热数据版本，用于生成缓存验证器"""
+        if not HOT_STORE_ENABLED:
+            return None
+        self._refresh()
+        return self._snap.stamp
+
+    def query(self, ft_name: str, start_date: date, end_date: date) -> pd.DataFrame | None:
+        """按日期范围读取标的全部字段，不在热数据中时返回None"""
+        if not HOT_STORE_ENABLED:
+            return None
+        self._refresh()
+        # 只读取一次，并发的 reload 不会让数组和日历来自不同版本
+        snap = self._snap
+        code = ft_name.lower()
+        meta = snap.index.get(code)
+        arr = snap.arrays.get(code)
+        if meta is None or arr is None:
+            return None
+
+        s, n = meta["start"], arr.shape[1]
+        i0 = max(int(np.searchsorted(snap.calendar, np.datetime64(start_date, "D"), side="left")), s)
+        i1 = min(int(np.searchsorted(snap.calendar, np.datetime64(end_date, "D"), side="right")), s + n)
+        i1 = max(i0, i1)
+
+        # 零拷贝切片，DataFrame直接引用内存映射的数据
+        view = arr[:, i0 - s:i1 - s]
+        df = pd.DataFrame(view.T, columns=[f"${f}" for f in meta["fields"]], copy=False)
+        df["date"] = pd.to_datetime(snap.calendar[i0:i1]).date
+        return df
+
+
+HOT_STORE = HotStore()
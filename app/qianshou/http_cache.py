@@ -0,0 +1,95 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-09 15:06:42
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-09 15:06:42
+FilePath: /mss_qianshou/app/qianshou/http_cache.py
+Description: HTTP条件缓存（ETag/Last-Modified）
+
+coalesced_response 另外合并相同的并发请求：版本查询按请求参数合并，
+生成的JSON按ETag合并，多个面板同时请求同一数据时只查询和序列化一次，见 single_flight.py
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os, hashlib
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Callable
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, FileResponse
+
+from .single_flight import REQUEST_FLIGHT
+from .config import HTTP_CACHE_MAX_AGE
+
+
+def make_etag(*parts: Any) -> str:
+    """由数据版本和请求参数生成ETag"""
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+    return f'"{digest[:20]}"'
+
+def db_timestamp(value: str | None) -> float | None:
+    """SQLite CURRENT_TIMESTAMP (UTC) 转为时间戳"""
+    if not value:
+        return None
+    try:
+        dt = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+def _is_fresh(request: Request, etag: str, last_modified: float | None) -> bool:
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        # 有If-None-Match时忽略If-Modified-Since
+        tags = [t.strip().removeprefix("W/") for t in inm.split(",")]
+        return "*" in tags or etag in tags
+    ims = request.headers.get("if-modified-since")
+    if ims is not None and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def _headers(etag: str, last_modified: float | None) -> dict:
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={HTTP_CACHE_MAX_AGE}",
+    }
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    return headers
+
+def conditional_response(request: Request, etag: str, builder: Callable[[], Any],
+                         last_modified: float | None = None) -> Response:
+    """验证器匹配时直接返回304，不再调用builder生成数据"""
+    headers = _headers(etag, last_modified)
+    if _is_fresh(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(jsonable_encoder(builder()), headers=headers)
+
+def coalesced_response(request: Request, key: tuple, validator: Callable[[], tuple],
+                       builder: Callable[[], Any]) -> Response:
+    """
+    与 conditional_response 相同，并合并相同的并发请求
+    key 为请求参数，validator() 返回 (ETag, Last-Modified)，builder() 返回数据
+    """
+    etag, last_modified = REQUEST_FLIGHT.do(("validator",) + key, validator)
+    headers = _headers(etag, last_modified)
+    if _is_fresh(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    body = REQUEST_FLIGHT.do(("body", etag), lambda: JSONResponse(jsonable_encoder(builder())).body)
+    return Response(body, media_type="application/json", headers=headers)
+
+def file_response(request: Request, path: str, etag: str, media_type: str,
+                  last_modified: float | None = None, encoding: str | None = None) -> Response:
+    """直接发送预先生成的文件，encoding 为文件本身的压缩方式"""
+    headers = _headers(etag, last_modified)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        headers["Vary"] = "Accept-Encoding"
+    if _is_fresh(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
@@ -10,26 +10,18 @@ Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
 '''
 import pandas as pd
 import numpy as np
-import os, json, re
-import talib
-from pathlib import Path
+import os, json, re, ast
 from typing import Dict, List
 from loguru import logger
-from dotenv import load_dotenv
 from pydantic import ValidationError
 
 from .models import IndicatorSet
-
-# 加载环境变量
-BASE_DIR = Path(__file__).resolve().parent
-load_dotenv(dotenv_path=BASE_DIR / ".." / ".env")
-INDS_DIR = os.path.join(BASE_DIR, ".." , os.getenv("INDS_DIR", "indicators"))
-
-os.makedirs(INDS_DIR, exist_ok=True)
+from .config import INDS_DIR
 
 
 class IndicatorEngine:
     def __init__(self):
+        import talib    # 只在计算指标时加载
         self.sets: Dict[str, Dict[str, str]] = {}
         self.context_base = {
             # 基础行情
@@ -93,16 +85,51 @@ class IndicatorEngine:
         }
         logger.info(f"✅ 已加载指标集 {indicator_set.set_name}")
 
-    def calculate_set(self, df: pd.DataFrame, set_name: str) -> pd.DataFrame:
-        if set_name not in self.sets:
-            raise ValueError(f"指标集 {set_name} 未加载")
-        result = df.copy()
+    def _make_context(self, df: pd.DataFrame) -> dict:
         context = dict(self.context_base)
         context.update({
             "OPEN": df["open"], "HIGH": df["high"],
             "LOW": df["low"], "CLOSE": df["close"],
             "VOL": df["volume"],
         })
+        return context
+
+    def validate_formula(self, formula: str, names: List[str] | None = None) -> None:
+        """检查公式只包含引擎支持的函数、变量和运算，防止执行任意代码"""
+        allowed = set(self.context_base.keys()) | set(names or [])
+        tree = ast.parse(formula, mode="eval")
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name):
+                if node.id not in allowed:
+                    raise ValueError(f"未知的变量或函数: {node.id}")
+            elif isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name):
+                    raise ValueError("只允许直接调用引擎函数")
+            elif not isinstance(node, (ast.Expression, ast.Constant, ast.Load,
+                                       ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare,
+                                       ast.operator, ast.unaryop, ast.boolop, ast.cmpop)):
+                raise ValueError(f"不支持的语法: {type(node).__name__}")
+
+    def evaluate(self, df: pd.DataFrame, formulas: Dict[str, str]) -> tuple[pd.DataFrame, Dict[str, str]]:
+        """临时计算一组公式（不需要预先加载指标集），返回结果和失败原因"""
+        result = pd.DataFrame(index=df.index)
+        errors = {}
+        context = self._make_context(df)
+        for name, formula in formulas.items():
+            try:
+                self.validate_formula(formula, list(result.columns))
+                result[name] = eval(formula, {"__builtins__": None}, context)
+                context[name] = result[name]   # 允许公式引用前面计算的指标
+            except Exception as e:
+                errors[name] = str(e)
+                logger.warning(f"⚠️ 临时公式 {name} 计算失败: {formula} -> {e}")
+        return result, errors
+
+    def calculate_set(self, df: pd.DataFrame, set_name: str) -> pd.DataFrame:
+        if set_name not in self.sets:
+            raise ValueError(f"指标集 {set_name} 未加载")
+        result = df.copy()
+        context = self._make_context(df)
         for name, formula in self.sets[set_name].items():
             try:
                 result[name] = eval(formula, {"__builtins__": None}, context)
@@ -163,6 +190,13 @@ def normalize_formula(formula: str) -> str:
 
     return formula
 
+def numeric_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """只保留数值列，比较运算得到的布尔指标转为0/1保留"""
+    bools = df.select_dtypes(include="bool").columns
+    if len(bools):
+        df = df.astype({c: "float64" for c in bools})
+    return df.select_dtypes(include="number")
+
 def formulas_to_json(set_name: str, indicators: Dict[str, str], out_path: str):
     """将指标字典转存为 JSON 文件"""
     ind_list = []
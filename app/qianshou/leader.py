@@ -0,0 +1,54 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-14 15:20:38
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-14 15:20:38
+FilePath: /mss_qianshou/app/qianshou/leader.py
+Description: 多worker部署时选出唯一执行定时任务的主进程
+
+通过 DATA_DIR/scheduler.lock 上的文件锁选主，锁由持有的进程一直保持，
+进程退出（包括崩溃）时由系统释放，其他进程定时重试即可接替。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os, fcntl
+from loguru import logger
+
+from .config import DATA_DIR
+
+
+LEADER_LOCK = os.path.join(DATA_DIR, "scheduler.lock")
+
+_lock_fd: int | None = None
+
+
+def try_acquire_leader() -> bool:
+    """尝试成为主进程，已经是主进程时直接返回True"""
+    global _lock_fd
+    if _lock_fd is not None:
+        return True
+    fd = os.open(LEADER_LOCK, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    # 记录主进程的pid，便于排查
+    os.ftruncate(fd, 0)
+    os.write(fd, str(os.getpid()).encode())
+    _lock_fd = fd
+    logger.info(f"进程 {os.getpid()} 成为定时任务主进程")
+    return True
+
+def is_leader() -> bool:
+    return _lock_fd is not None
+
+def release_leader() -> None:
+    global _lock_fd
+    if _lock_fd is None:
+        return
+    fcntl.flock(_lock_fd, fcntl.LOCK_UN)
+    os.close(_lock_fd)
+    _lock_fd = None
+    logger.info(f"进程 {os.getpid()} 释放定时任务主进程")
@@ -0,0 +1,112 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-10 08:47:05
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-10 08:47:05
+FilePath: /mss_qianshou/app/qianshou/market_calendar.py
+Description: 各市场交易日历
+
+交易日历从行情接口获取后缓存在 DATA_DIR/mkt_calendars/<市场>.txt，
+缓存没有覆盖的日期按周一到周五视为交易日。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os
+import numpy as np
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+from loguru import logger
+
+from .config import MKT_CAL_DIR, POST_CLOSE_DELAY_M
+
+# 标的市场 -> 交易日历
+CALENDAR_MARKETS = {
+    "US": "US",
+    "HK": "HK",
+    "SH": "CN",
+    "SZ": "CN",
+}
+
+# 交易日历 -> 包含的标的市场
+MARKET_GROUPS = {
+    "US": ["US"],
+    "HK": ["HK"],
+    "CN": ["SH", "SZ"],
+}
+# 没有单独交易日历的市场，仍按固定时间更新
+OTHER_MARKETS = ["TW", "TOKYO", "LONDON"]
+
+# 交易日历 -> (时区, 收盘时间)
+MARKET_CLOSE = {
+    "US": ("America/New_York", time(16, 0)),
+    "HK": ("Asia/Hong_Kong", time(16, 0)),
+    "CN": ("Asia/Shanghai", time(15, 0)),
+}
+
+_cache: dict[str, tuple[int, np.ndarray]] = {}
+
+
+def _cal_file(cal: str) -> str:
+    return os.path.join(MKT_CAL_DIR, f"{cal}.txt")
+
+def save_market_calendar(cal: str, days: list) -> None:
+    """合并新获取的交易日到缓存文件"""
+    merged = set(load_market_calendar(cal).astype(str).tolist())
+    merged.update(str(d)[:10] for d in days)
+    tmp = _cal_file(cal) + ".tmp"
+    with open(tmp, "w") as f:
+        f.write("\n".join(sorted(merged)))
+    os.replace(tmp, _cal_file(cal))
+    logger.info(f"更新交易日历 {cal}, 共 {len(merged)} 个交易日")
+
+def load_market_calendar(cal: str) -> np.ndarray:
+    path = _cal_file(cal)
+    if not os.path.exists(path):
+        return np.array([], dtype="datetime64[D]")
+    mtime = os.stat(path).st_mtime_ns
+    cached = _cache.get(cal)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(path, "r") as f:
+        days = np.array([l.strip() for l in f if l.strip()], dtype="datetime64[D]")
+    _cache[cal] = (mtime, days)
+    return days
+
+def trading_days(market: str, start: date, end: date) -> np.ndarray:
+    """[start, end] 内的交易日，日历没有覆盖的部分按工作日计算"""
+    s, e = np.datetime64(start, "D"), np.datetime64(end, "D")
+    if e < s:
+        return np.array([], dtype="datetime64[D]")
+    cal = CALENDAR_MARKETS.get(market.upper())
+    days = load_market_calendar(cal) if cal else np.array([], dtype="datetime64[D]")
+    if days.size == 0:
+        known = np.array([], dtype="datetime64[D]")
+        rest_start = s
+    else:
+        known = days[(days >= s) & (days <= e)]
+        rest_start = max(s, days[-1] + 1)
+    rest = np.arange(rest_start, e + 1, dtype="datetime64[D]")
+    rest = rest[np.is_busday(rest)]
+    return np.concatenate([known, rest])
+
+def has_new_session(market: str, start: date, end: date) -> bool:
+    """[start, end] 内该市场是否有交易日"""
+    return trading_days(market, start, end).size > 0
+
+def last_closed_day(market: str) -> date:
+    """该市场最近一个已经收盘的日期（按市场所在时区）"""
+    cal = CALENDAR_MARKETS.get(market.upper())
+    if cal is None:
+        # 其他市场沿用本地时间17点的规则
+        now, close = datetime.now(), time(17, 0)
+    else:
+        tz, close = MARKET_CLOSE[cal]
+        now = datetime.now(ZoneInfo(tz))
+    return now.date() if now.time() >= close else now.date() - timedelta(days=1)
+
+def post_close_cron(cal: str) -> dict:
+    """收盘后 POST_CLOSE_DELAY_M 分钟触发的cron参数"""
+    tz, close = MARKET_CLOSE[cal]
+    at = datetime.combine(date.today(), close) + timedelta(minutes=POST_CLOSE_DELAY_M)
+    return {"hour": at.hour, "minute": at.minute, "timezone": tz}
@@ -0,0 +1,210 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-18 16:40:12
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-18 16:40:12
+FilePath: /mss_qianshou/app/qianshou/profiler.py
+Description: 按需的性能分析
+
+管理员先请求分析某个任务（futu_daily、futu_sync 等）或接口路径（/equity/quote），
+请求保存在 profile_requests 表中，任意worker都能看到。之后该任务或接口的下一次执行
+在采样分析和 tracemalloc 下运行，结果保存在 PROFILE_DIR：
+  <名称>.folded     折叠的调用栈和采样次数，可直接用 flamegraph.pl 或 speedscope 生成火焰图
+  <名称>.alloc.txt  内存峰值，以及接近峰值时占用内存最多的分配位置
+  <名称>.json       摘要，列表接口读取
+
+采样线程每隔 PROFILE_INTERVAL_MS 读取一次所有线程的调用栈，不需要额外依赖；
+在等待锁、队列、IO多路复用的线程不计入。同一时间只分析一个，其他的照常执行。
+没有请求时，任务只在开始时查一次表，接口只比较一次时间和集合，每隔 PROFILE_POLL_S 在线程中重新查表，
+不阻塞事件循环；PROFILE_ENABLED=0 时完全不检查。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os, re, sys, json, time, asyncio, threading, tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from loguru import logger
+
+from .sqlite_db import set_profile_request, get_profile_requests, take_profile_request
+from .config import PROFILE_ENABLED, PROFILE_DIR, PROFILE_INTERVAL_MS, PROFILE_TOP_ALLOC, PROFILE_POLL_S, PROFILE_KEEP
+
+
+# 调用栈最内层在这些模块中的线程视为空闲
+_IDLE_FILES = ("threading.py", "queue.py", "selectors.py")
+
+_running = threading.Lock()
+_armed: tuple = (0.0, frozenset())     # (加载时间, 等待分析的目标)
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, interval: float):
+        super().__init__(name="profiler", daemon=True)
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        # 内存增长超过上次快照的20%时重新快照，保留接近峰值时的分配位置
+        self.snapshot: tracemalloc.Snapshot | None = None
+        self.snapshot_size = 1 << 20
+        self._done = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        while not self._done.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me or frame.f_code.co_filename.endswith(_IDLE_FILES):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            current, _ = tracemalloc.get_traced_memory()
+            if current > self.snapshot_size * 1.2:
+                self.snapshot = tracemalloc.take_snapshot()
+                self.snapshot_size = current
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def _write(path: str, text: str) -> None:
+    with open(path, "w") as f:
+        f.write(text)
+
+def _prune() -> None:
+    names = sorted(f[:-5] for f in os.listdir(PROFILE_DIR) if f.endswith(".json"))
+    for name in names[:-PROFILE_KEEP]:
+        for ext in [".json", ".folded", ".alloc.txt"]:
+            path = os.path.join(PROFILE_DIR, name + ext)
+            if os.path.exists(path):
+                os.remove(path)
+
+@contextmanager
+def profile_run(target: str):
+    """在采样分析和 tracemalloc 下执行，已有分析在进行时直接执行"""
+    if not _running.acquire(blocking=False):
+        logger.warning(f"已有性能分析在进行，跳过 {target}")
+        yield
+        return
+    started = datetime.now()
+    own_trace = not tracemalloc.is_tracing()
+    if own_trace:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    sampler = _Sampler(PROFILE_INTERVAL_MS / 1000)
+    t0 = time.perf_counter()
+    sampler.start()
+    try:
+        yield
+    finally:
+        try:
+            sampler.stop()
+            elapsed = time.perf_counter() - t0
+            current, peak = tracemalloc.get_traced_memory()
+            # 采样线程没有快照（内存一直没有超过初始阈值），或当前占用更高时重新快照
+            if sampler.snapshot is not None and sampler.snapshot_size > current:
+                snapshot = sampler.snapshot
+            else:
+                snapshot = tracemalloc.take_snapshot()
+            snapshot = snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ])
+            _save(target, started, elapsed, sampler, snapshot, current, peak)
+        except Exception as e:
+            logger.error(f"保存性能分析结果失败 {target}: {e}")
+        finally:
+            if own_trace:
+                tracemalloc.stop()
+            _running.release()
+
+def _save(target: str, started: datetime, elapsed: float, sampler: _Sampler,
+          snapshot: tracemalloc.Snapshot, current: int, peak: int) -> None:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{started.strftime('%Y%m%d%H%M%S')}_{re.sub(r'[^0-9A-Za-z]+', '_', target).strip('_')}"
+    base = os.path.join(PROFILE_DIR, name)
+
+    _write(base + ".folded", "".join(f"{s} {n}\n" for s, n in sampler.stacks.most_common()))
+
+    stats = snapshot.statistics("lineno")[:PROFILE_TOP_ALLOC]
+    lines = [f"peak: {peak / 2**20:.1f} MiB, current: {current / 2**20:.1f} MiB, "
+             f"sites at: {sum(s.size for s in snapshot.statistics('filename')) / 2**20:.1f} MiB", ""]
+    lines += [f"{s.size / 2**10:10.1f} KiB {s.count:8d} blocks  {s.traceback[0].filename}:{s.traceback[0].lineno}"
+              for s in stats]
+    _write(base + ".alloc.txt", "\n".join(lines) + "\n")
+
+    summary = {"name": name, "target": target, "started": started.isoformat(timespec="seconds"),
+               "elapsed_s": round(elapsed, 3), "samples": sampler.samples,
+               "interval_ms": PROFILE_INTERVAL_MS,
+               "peak_mb": round(peak / 2**20, 2), "current_mb": round(current / 2**20, 2)}
+    _write(base + ".json", json.dumps(summary, ensure_ascii=False))
+    _prune()
+    logger.info(f"性能分析完成 {target}: {elapsed:.1f}s, {sampler.samples} 次采样, 峰值 {summary['peak_mb']} MB -> {base}")
+
+
+def request_profile(target: str, count: int = 1) -> dict:
+    """请求分析 target 接下来的 count 次执行，count=0 时取消"""
+    global _armed
+    set_profile_request(target, count)
+    _armed = (0.0, frozenset())
+    return get_profile_requests()
+
+def profile_requests() -> dict:
+    return get_profile_requests()
+
+def profile_job(target: str):
+    """任务入口使用：with profile_job("futu_daily"): ...，有请求时分析本次执行"""
+    if PROFILE_ENABLED and take_profile_request(target):
+        return profile_run(target)
+    return nullcontext()
+
+async def profile_job_async(target: str):
+    """异步任务入口使用：with await profile_job_async("futu_sync"): ...，在线程中查表，不阻塞事件循环"""
+    if PROFILE_ENABLED and await asyncio.to_thread(take_profile_request, target):
+        return profile_run(target)
+    return nullcontext()
+
+async def _endpoint_armed(path: str) -> bool:
+    # 在线程中查表，不阻塞事件循环；查询期间到达的请求继续使用原来的集合
+    global _armed
+    loaded_at, targets = _armed
+    if time.monotonic() - loaded_at >= PROFILE_POLL_S:
+        _armed = (time.monotonic(), targets)
+        requests = await asyncio.to_thread(get_profile_requests)
+        targets = frozenset(t for t in requests if t.startswith("/"))
+        _armed = (time.monotonic(), targets)
+    return path in targets and await asyncio.to_thread(take_profile_request, path)
+
+class ProfileMiddleware:
+    """ASGI中间件，请求过分析的接口路径在下一次调用时分析"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not await _endpoint_armed(scope["path"]):
+            return await self.app(scope, receive, send)
+        with profile_run(scope["path"]):
+            await self.app(scope, receive, send)
+
+
+def list_profiles() -> list:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    res = []
+    for f in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if f.endswith(".json"):
+            with open(os.path.join(PROFILE_DIR, f)) as fp:
+                res.append(json.load(fp))
+    return res
+
+def profile_file(filename: str) -> str | None:
+    """结果文件的路径，只允许 PROFILE_DIR 下的文件"""
+    path = os.path.join(PROFILE_DIR, os.path.basename(filename))
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,81 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-14 10:31:07
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-14 10:31:07
+FilePath: /mss_qianshou/app/qianshou/providers.py
+Description: 数据提供方的统一入口，按需加载
+
+futu、akshare、yfinance、qlib 等依赖导入很慢、占用内存多，
+API进程只在真正执行任务或查询时才导入对应的模块，只提供查询的worker不会加载它们。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import asyncio, importlib
+from datetime import date
+from types import ModuleType
+
+from .profiler import profile_job, profile_job_async
+from .config import REALTIME_ENABLED
+
+
+class _LazyModule(ModuleType):
+    """第一次访问属性时才导入的模块代理"""
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._module: ModuleType | None = None
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self.__name__)
+        return getattr(self._module, attr)
+
+def lazy_import(name: str) -> ModuleType:
+    """例如 ak = lazy_import("akshare")，用法与 import akshare as ak 相同"""
+    return _LazyModule(name)
+
+def _provider(name: str) -> ModuleType:
+    return importlib.import_module(f".{name}", __package__)
+
+
+# 日线
+def futu_update_daily(markets: list | None = None):
+    with profile_job("futu_daily"):
+        return _provider("hist_futu").futu_update_daily(markets)
+
+def yfinance_update_daily():
+    return _provider("hist_yfinance").yfinance_update_daily()
+
+# 补齐历史日线的缺口
+def repair_gaps(symbols: list | None = None, markets: list | None = None,
+                start: str | None = None, dry_run: bool = False) -> dict:
+    with profile_job("repair_gaps"):
+        return _provider("gap_repair").repair_gaps(symbols, markets, start, dry_run)
+
+# 分钟K线
+def futu_update_intraday(markets: list | None = None, ktypes: list | None = None):
+    with profile_job("futu_intraday"):
+        return _provider("hist_intraday").futu_update_intraday(markets, ktypes)
+
+# 自选股和财报
+async def futu_sync_group(full: bool = False):
+    with await profile_job_async("futu_sync"):
+        await _provider("account_futu").futu_sync_group(full)
+    # 同步在主进程中执行，订阅新增的标的
+    if REALTIME_ENABLED:
+        await asyncio.to_thread(_provider("realtime_futu").refresh_realtime)
+
+# 实时推送，未启用时不加载futu
+def start_realtime() -> None:
+    if REALTIME_ENABLED:
+        _provider("realtime_futu").start_realtime()
+
+def stop_realtime() -> None:
+    if REALTIME_ENABLED:
+        _provider("realtime_futu").stop_realtime()
+
+def load_equity_live(symbol: str) -> dict:
+    if not REALTIME_ENABLED:
+        return {}
+    return _provider("realtime_futu").load_equity_live(symbol)
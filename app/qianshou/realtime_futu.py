@@ -0,0 +1,291 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-12 21:18:09
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-12 21:18:09
+FilePath: /mss_qianshou/app/qianshou/realtime_futu.py
+Description: 实时K线推送，增量更新最新K线和流式指标
+
+启动时用历史收盘价初始化各指标的状态，之后每次推送只做O(1)的计算：
+同一根K线的多次推送只重新计算当根的暂定值，新的一根K线出现时才把上一根确认进状态。
+只有主进程连接Futu并订阅，每隔 LIVE_FLUSH_S 把有变化的标的写入 live_quotes 表，其他worker查询时从表中读取；
+自选列表同步后订阅新增的标的。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os, re, threading
+import pandas as pd
+from collections import deque
+from datetime import datetime
+from loguru import logger
+from futu import OpenQuoteContext, CurKlineHandlerBase, SubType, RET_OK, RET_ERROR
+
+from .models import Equity
+from .sqlite_db import get_equities, save_live_quotes, get_live_quote
+from .equity_registry import EQUITY_REGISTRY
+from .config import OCSV_DIR, FUTU_API_HOST, FUTU_API_PORT, REALTIME_ENABLED, LIVE_INDICATORS, LIVE_FLUSH_S
+
+
+class StreamingMA:
+    def __init__(self, n: int):
+        self.n = n
+        self.window = deque(maxlen=n - 1)   # 已确认的最近 n-1 个收盘价
+        self.total = 0.0
+
+    def commit(self, x: float) -> None:
+        if self.n == 1:
+            return
+        if len(self.window) == self.window.maxlen:
+            self.total -= self.window[0]
+        self.window.append(x)
+        self.total += x
+
+    def value(self, x: float) -> float | None:
+        if len(self.window) < self.n - 1:
+            return None
+        return (self.total + x) / self.n
+
+
+class StreamingEMA:
+    def __init__(self, n: int):
+        self.alpha = 2.0 / (n + 1)
+        self.ema: float | None = None
+
+    def commit(self, x: float) -> None:
+        self.ema = self.value(x)
+
+    def value(self, x: float) -> float | None:
+        if self.ema is None:
+            return x
+        return self.alpha * x + (1 - self.alpha) * self.ema
+
+
+class StreamingRSI:
+    """Wilder平滑的RSI"""
+    def __init__(self, n: int):
+        self.n = n
+        self.prev: float | None = None
+        self.count = 0
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+
+    def _next(self, x: float) -> tuple:
+        change = x - self.prev   # type: ignore
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+        if self.count < self.n:
+            # 前n个变化取简单平均
+            k = self.count + 1
+            return (self.avg_gain * self.count + gain) / k, (self.avg_loss * self.count + loss) / k
+        return ((self.avg_gain * (self.n - 1) + gain) / self.n,
+                (self.avg_loss * (self.n - 1) + loss) / self.n)
+
+    def commit(self, x: float) -> None:
+        if self.prev is not None:
+            self.avg_gain, self.avg_loss = self._next(x)
+            self.count += 1
+        self.prev = x
+
+    def value(self, x: float) -> float | None:
+        if self.prev is None or self.count + 1 < self.n:
+            return None
+        gain, loss = self._next(x)
+        if loss == 0:
+            return 100.0
+        return 100.0 - 100.0 / (1.0 + gain / loss)
+
+
+STREAMING = {"MA": StreamingMA, "EMA": StreamingEMA, "RSI": StreamingRSI}
+
+def _make_indicators() -> dict:
+    inds = {}
+    for name in LIVE_INDICATORS:
+        m = re.match(r"^([A-Z]+)(\d+)$", name)
+        if m is None or m.group(1) not in STREAMING:
+            logger.warning(f"不支持的实时指标: {name}")
+            continue
+        inds[name] = STREAMING[m.group(1)](int(m.group(2)))
+    return inds
+
+
+class LiveState:
+    def __init__(self):
+        self.indicators = _make_indicators()
+        self.bar_date: str | None = None
+        self.bar: dict = {}
+        self.values: dict = {}
+        self.updated_at: str | None = None
+
+    def seed(self, df: pd.DataFrame) -> None:
+        """用历史数据初始化，最后一根K线作为当前K线，尚未确认"""
+        if df.empty:
+            return
+        closes = df["close"].astype(float).tolist()
+        for x in closes[:-1]:
+            for ind in self.indicators.values():
+                ind.commit(x)
+        last = df.iloc[[-1]].to_dict(orient="records")[0]
+        self.bar_date = str(df.index[-1])[:10]
+        self.bar = {k: last.get(k) for k in ["open", "high", "low", "close", "volume"]}
+        self._evaluate(closes[-1])
+
+    def on_bar(self, bar: dict) -> None:
+        bar_date = str(bar["time_key"])[:10]
+        if self.bar_date is not None and bar_date < self.bar_date:
+            return
+        if self.bar_date is not None and bar_date > self.bar_date:
+            # 新的一根K线，确认上一根
+            for ind in self.indicators.values():
+                ind.commit(float(self.bar["close"]))
+        self.bar_date = bar_date
+        self.bar = {k: bar.get(k) for k in ["open", "high", "low", "close", "volume"]}
+        self._evaluate(float(bar["close"]))
+
+    def _evaluate(self, close: float) -> None:
+        self.values = {name: ind.value(close) for name, ind in self.indicators.items()}
+        self.updated_at = datetime.now().isoformat(timespec="milliseconds")
+
+    def snapshot(self) -> dict:
+        return {"date": self.bar_date, **self.bar, **self.values, "updated_at": self.updated_at}
+
+
+class LiveBook:
+    def __init__(self):
+        self.states: dict[str, LiveState] = {}
+        self._dirty: set = set()
+        self._lock = threading.Lock()
+
+    def seed(self, ft_name: str) -> None:
+        state = LiveState()
+        ocsv_file = os.path.join(OCSV_DIR, f"{ft_name}.csv")
+        if os.path.exists(ocsv_file):
+            state.seed(pd.read_csv(ocsv_file, index_col=0, parse_dates=True).sort_index())
+        with self._lock:
+            self.states[ft_name] = state
+            self._dirty.add(ft_name)
+
+    def on_bar(self, ft_name: str, bar: dict) -> None:
+        with self._lock:
+            state = self.states.get(ft_name)
+            if state is None:
+                state = self.states[ft_name] = LiveState()
+            state.on_bar(bar)
+            self._dirty.add(ft_name)
+
+    def take_dirty(self) -> dict:
+        """上次取出之后有变化的标的"""
+        with self._lock:
+            res = {code: self.states[code].snapshot() for code in self._dirty}
+            self._dirty.clear()
+            return res
+
+    def get(self, ft_name: str) -> dict | None:
+        with self._lock:
+            state = self.states.get(ft_name)
+            return None if state is None else state.snapshot()
+
+
+class _KlinePushHandler(CurKlineHandlerBase):
+    def __init__(self, book: LiveBook):
+        super().__init__()
+        self.book = book
+
+    def on_recv_rsp(self, rsp_pb):
+        ret, data = super().on_recv_rsp(rsp_pb)
+        if ret != RET_OK:
+            logger.warning(f"K线推送错误: {data}")
+            return RET_ERROR, data
+        for bar in data.to_dict(orient="records"):
+            self.book.on_bar(bar["code"], bar)
+        return RET_OK, data
+
+
+LIVE_BOOK = LiveBook()
+_ctx: OpenQuoteContext | None = None
+_subscribed: set = set()
+_sub_lock = threading.Lock()
+_flusher: threading.Thread | None = None
+_stop = threading.Event()
+
+def _watch_codes() -> list:
+    return [Equity(**dict(row)).to_futu_symbol() for row in get_equities(only_valid=True)]
+
+def _subscribe(codes: list) -> None:
+    for code in codes:
+        LIVE_BOOK.seed(code)
+    ret, err = _ctx.subscribe(codes, [SubType.K_DAY], subscribe_push=True)  # type: ignore
+    if ret != RET_OK:
+        logger.error(f"订阅实时K线失败: {err}")
+    else:
+        _subscribed.update(codes)
+        logger.info(f"订阅实时K线: {len(codes)} 个标的")
+
+def _flush() -> None:
+    quotes = LIVE_BOOK.take_dirty()
+    if not quotes:
+        return
+    try:
+        save_live_quotes(quotes)
+    except Exception as e:
+        logger.warning(f"保存实时数据失败: {e}")
+
+def _flush_loop() -> None:
+    while not _stop.wait(LIVE_FLUSH_S):
+        _flush()
+
+def start_realtime() -> None:
+    """订阅自选标的的日K推送，只在主进程中调用"""
+    global _ctx, _flusher
+    with _sub_lock:
+        if not REALTIME_ENABLED or _ctx is not None:
+            return
+        _ctx = OpenQuoteContext(host=FUTU_API_HOST, port=FUTU_API_PORT)
+        _ctx.set_handler(_KlinePushHandler(LIVE_BOOK))
+        _subscribe(_watch_codes())
+        _stop.clear()
+        _flusher = threading.Thread(target=_flush_loop, name="live-flush", daemon=True)
+        _flusher.start()
+
+def refresh_realtime() -> None:
+    """自选列表同步后订阅新增的标的，取消已停用的标的"""
+    with _sub_lock:
+        if _ctx is None:
+            return
+        codes = _watch_codes()
+        added = [c for c in codes if c not in _subscribed]
+        removed = sorted(_subscribed - set(codes))
+        if added:
+            _subscribe(added)
+        if removed:
+            # Futu要求订阅至少一分钟后才能取消，失败时下次同步再试
+            ret, err = _ctx.unsubscribe(removed, [SubType.K_DAY])
+            if ret != RET_OK:
+                logger.warning(f"取消订阅实时K线失败: {err}")
+            else:
+                _subscribed.difference_update(removed)
+                logger.info(f"取消订阅实时K线: {removed}")
+
+def stop_realtime() -> None:
+    global _ctx, _flusher
+    with _sub_lock:
+        if _ctx is None:
+            return
+        _stop.set()
+        if _flusher is not None:
+            _flusher.join()
+            _flusher = None
+        _ctx.close()
+        _ctx = None
+        _flush()
+        _subscribed.clear()
+        logger.info("停止实时K线推送")
+
+def load_equity_live(symbol: str) -> dict:
+    entry = EQUITY_REGISTRY.get(symbol)
+    if entry is None:
+        logger.error(f"找不到股票{symbol}，无法获得实时数据")
+        return {}
+    if _ctx is not None:
+        return LIVE_BOOK.get(entry.futu) or {}
+    # 本进程没有订阅，读取主进程写入的数据
+    return get_live_quote(entry.futu) or {}
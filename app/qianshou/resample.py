@@ -0,0 +1,91 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-15 09:12:40
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-15 09:12:40
+FilePath: /mss_qianshou/app/qianshou/resample.py
+Description: 行情序列的周期合成与降采样
+
+周期合成按周、月、季聚合日线，日期取周期内最后一个交易日；
+降采样使用 LTTB（Largest-Triangle-Three-Buckets），在减少点数的同时保留走势形状。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+# 周期 -> pandas 的 Period 频率
+PERIODS = {
+    "W": "W-FRI",
+    "M": "M",
+    "Q": "Q",
+}
+
+# K线字段的聚合方式，其他字段（指标、估值等）取周期内最后一个值
+OHLCV_AGG = {
+    "$OPEN": "first",
+    "$HIGH": "max",
+    "$LOW": "min",
+    "$CLOSE": "last",
+    "$VOLUME": "sum",
+    "$TURNOVER": "sum",
+}
+
+
+def resample_period(df: pd.DataFrame, period: str) -> pd.DataFrame:
+    """把带 date 列的日线合成为周/月/季线"""
+    if df.empty:
+        return df
+    dates = pd.DatetimeIndex(pd.to_datetime(df["date"]))
+    key = dates.to_period(PERIODS[period.upper()])
+    agg = {c: OHLCV_AGG.get(c, "last") for c in df.columns if c != "date"}
+    out = df.drop(columns=["date"]).groupby(key, sort=True).agg(agg)
+    # 周期内全部是停牌的空行时，成交量求和会得到0，恢复为空值
+    for c in ["$VOLUME", "$TURNOVER"]:
+        if c in out.columns:
+            out.loc[df[c].groupby(key).count() == 0, c] = np.nan
+    out.insert(0, "date", pd.Series(dates.date, index=key).groupby(level=0).last())
+    return out.reset_index(drop=True)
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """LTTB 选出的点的下标，首尾两个点总是保留"""
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    # 中间的点平均分成 points-2 个桶
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    selected = np.empty(points, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # 下一个桶的平均点，最后一个桶使用终点
+        nlo, nhi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        # 与上一个选中点、下一个桶平均点构成的三角形面积最大的点
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+def downsample_lttb(df: pd.DataFrame, points: int, field: str = "$CLOSE") -> pd.DataFrame:
+    """按 field 的走势降采样到 points 行，保留选中行的全部字段"""
+    if field not in df.columns:
+        return df
+    df = df[df[field].notna()]
+    if points >= len(df) or points < 3:
+        return df.reset_index(drop=True)
+    x = pd.to_datetime(df["date"]).to_numpy(dtype="datetime64[D]").astype("float64")
+    y = df[field].to_numpy(dtype="float64")
+    return df.iloc[lttb_indices(x, y, points)].reset_index(drop=True)
+
+def reshape_quote(df: pd.DataFrame, period: str | None = None, points: int | None = None) -> pd.DataFrame:
+    """先按周期合成，再降采样"""
+    if period and period.upper() != "D":
+        df = resample_period(df, period)
+    if points:
+        df = downsample_lttb(df, points)
+    return df
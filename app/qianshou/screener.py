@@ -0,0 +1,209 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-15 14:36:21
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-15 14:36:21
+FilePath: /mss_qianshou/app/qianshou/screener.py
+Description: 基于最新快照的横截面选股
+
+每日更新后把各标的最近 SNAPSHOT_BARS 根K线的全部字段写入 indicator_snapshot 表，
+选股条件例如 "RSI14 < 30 AND CLOSE > MA200 AND CLOSE > REF(CLOSE, 1)"：
+顶层 AND 中 "字段 比较 常数" 的条件先用索引在SQLite中过滤，
+其余条件在候选标的组成的宽表上一次向量化计算。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import ast, re, time
+import numpy as np
+import pandas as pd
+from functools import reduce
+from loguru import logger
+
+from .sqlite_db import replace_snapshot, filter_snapshot_codes, load_snapshot
+from .equity_registry import EQUITY_REGISTRY
+from .indicator_tools import normalize_formula, numeric_columns
+from .config import SNAPSHOT_BARS
+
+
+# 公式中的变量名 -> 快照中的字段名
+FIELD_ALIAS = {"VOL": "VOLUME"}
+
+FUNCS = {
+    "ABS": np.abs, "LOG": np.log, "SQRT": np.sqrt,
+    "MAX": np.maximum, "MIN": np.minimum,
+    # 以下由 AND/OR/NOT 和连续比较改写而来
+    "_ALL": lambda *xs: reduce(lambda a, b: a & b, xs),
+    "_ANY": lambda *xs: reduce(lambda a, b: a | b, xs),
+    "_NOT": lambda x: ~x,
+}
+
+# 可以下推到SQLite的比较运算
+SQL_OPS = {ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">=", ast.Eq: "="}
+# 常数在左边时把运算翻转
+FLIP_OPS = {ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt, ast.GtE: ast.LtE, ast.Eq: ast.Eq}
+
+
+def update_snapshot(frames: dict) -> None:
+    """用每日计算结果刷新快照，frames: {futu代码: 带指标的DataFrame}"""
+    codes, rows = [], []
+    for code, df in frames.items():
+        if df is None or df.empty:
+            continue
+        df = numeric_columns(df[~df.index.duplicated(keep="last")].sort_index())
+        tail = df.iloc[-SNAPSHOT_BARS:]
+        dates = [str(d)[:10] for d in tail.index]
+        values = tail.to_numpy(dtype="float64")
+        fields = [str(c).upper() for c in tail.columns]
+        codes.append(code)
+        for i in range(len(tail)):
+            lag = len(tail) - 1 - i
+            for j, field in enumerate(fields):
+                if not np.isnan(values[i, j]):
+                    rows.append((code, lag, dates[i], field, float(values[i, j])))
+    if codes:
+        replace_snapshot(codes, rows)
+        logger.info(f"更新选股快照 {len(codes)} 个标的, {len(rows)} 个值")
+
+
+def _call(name: str, args: list) -> ast.Call:
+    return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=args, keywords=[])
+
+class _Rewriter(ast.NodeTransformer):
+    """把布尔运算改写为逐元素运算，pandas的Series不支持 and/or/not 和连续比较"""
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        return _call("_ALL" if isinstance(node.op, ast.And) else "_ANY", node.values)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        return _call("_NOT", [node.operand]) if isinstance(node.op, ast.Not) else node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        parts, left = [], node.left
+        for op, right in zip(node.ops, node.comparators):
+            parts.append(ast.Compare(left=left, ops=[op], comparators=[right]))
+            left = right
+        return _call("_ALL", parts)
+
+    def visit_Name(self, node):
+        node.id = FIELD_ALIAS.get(node.id, node.id)
+        return node
+
+class _RefArg(ast.NodeTransformer):
+    """REF(CLOSE, 1) -> REF('CLOSE', 1)，按字段名取对应lag的列"""
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if isinstance(node.func, ast.Name) and node.func.id == "REF" and isinstance(node.args[0], ast.Name):
+            node.args[0] = ast.Constant(value=node.args[0].id)
+        return node
+
+
+def _parse(expr: str) -> ast.Expression:
+    expr = normalize_formula(expr)
+    for word, op in [("AND", "and"), ("OR", "or"), ("NOT", "not")]:
+        expr = re.sub(rf"\b{word}\b", f" {op} ", expr)
+    # 以NOT开头时替换后有前导空格，ast.parse会当作缩进错误
+    tree = ast.fix_missing_locations(_Rewriter().visit(ast.parse(expr.strip(), mode="eval")))
+    return tree  # type: ignore
+
+def _collect(tree: ast.Expression) -> set:
+    """检查语法，返回用到的 (字段, lag)"""
+    used = set()
+    def walk(node):
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name):
+                raise ValueError("只允许直接调用函数")
+            if node.func.id == "REF":
+                if (len(node.args) != 2 or not isinstance(node.args[0], ast.Name)
+                        or not isinstance(node.args[1], ast.Constant) or not isinstance(node.args[1].value, int)):
+                    raise ValueError("REF的用法为 REF(字段, 整数)")
+                lag = node.args[1].value
+                if not 0 <= lag < SNAPSHOT_BARS:
+                    raise ValueError(f"REF最多引用 {SNAPSHOT_BARS - 1} 根K线之前")
+                used.add((node.args[0].id, lag))
+                return
+            if node.func.id not in FUNCS:
+                raise ValueError(f"未知的函数: {node.func.id}")
+            for a in node.args:
+                walk(a)
+        elif isinstance(node, ast.Name):
+            if node.id in FUNCS or node.id == "REF":
+                raise ValueError(f"函数不能作为变量: {node.id}")
+            used.add((node.id, 0))
+        elif isinstance(node, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare)):
+            for child in ast.iter_child_nodes(node):
+                walk(child)
+        elif not isinstance(node, (ast.Constant, ast.Load, ast.operator, ast.unaryop, ast.cmpop)):
+            raise ValueError(f"不支持的语法: {type(node).__name__}")
+    walk(tree)
+    return used
+
+def _pushdown(tree: ast.Expression) -> list:
+    """顶层AND中 字段 比较 常数 的条件，返回 [(字段, 运算, 常数)]"""
+    body = tree.body
+    conjuncts = body.args if isinstance(body, ast.Call) and body.func.id == "_ALL" else [body]  # type: ignore
+    res = []
+    for c in conjuncts:
+        if not isinstance(c, ast.Compare) or type(c.ops[0]) not in SQL_OPS:
+            continue
+        left, right, op = c.left, c.comparators[0], type(c.ops[0])
+        if isinstance(left, ast.Constant):
+            left, right, op = right, left, FLIP_OPS[op]
+        if isinstance(left, ast.Name) and isinstance(right, ast.Constant) and isinstance(right.value, (int, float)):
+            res.append((left.id, SQL_OPS[op], float(right.value)))
+    return res
+
+
+def screen(expr: str) -> dict:
+    """返回满足条件的自选标的及条件中用到的最新字段值"""
+    t0 = time.perf_counter()
+    try:
+        tree = _parse(expr)
+        used = _collect(tree)
+    except (SyntaxError, ValueError) as e:
+        return {"results": [], "error": str(e)}
+    if not used:
+        return {"results": [], "error": "条件中没有用到任何字段"}
+
+    symbols = {x.futu: x.equity.symbol for x in EQUITY_REGISTRY.entries() if x.futu}
+
+    # 先用索引过滤，再只读取候选标的的相关字段
+    candidates = set(symbols)
+    for field, op, value in _pushdown(tree):
+        candidates &= filter_snapshot_codes(field, 0, op, value)
+    results = []
+    if candidates:
+        fields = sorted({f for f, _ in used})
+        rows = load_snapshot(fields, max(l for _, l in used), sorted(candidates))
+        df = pd.DataFrame(rows, columns=["code", "lag", "date", "field", "value"])
+        wide = df.pivot(index="code", columns=["lag", "field"], values="value")
+        wide = wide.reindex(index=sorted(candidates), columns=pd.MultiIndex.from_tuples(
+            sorted((l, f) for f, l in used), names=["lag", "field"]))
+        dates = df[df["lag"] == 0].groupby("code")["date"].last()
+
+        context = dict(FUNCS)
+        context.update({f: wide[(0, f)] for f, l in used if l == 0})
+        context["REF"] = lambda x, n: wide[(n, x)]
+        code = compile(ast.fix_missing_locations(_RefArg().visit(tree)), "<screen>", "eval")
+        try:
+            mask = eval(code, {"__builtins__": None}, context)
+        except Exception as e:
+            return {"results": [], "error": str(e)}
+        mask = pd.Series(mask, index=wide.index).fillna(False).astype(bool)
+
+        out = wide.loc[mask.values]
+        latest = sorted({f for f, _ in used})
+        for c in out.index:
+            item = {"symbol": symbols.get(c), "code": c, "date": dates.get(c)}
+            for f in latest:
+                v = out.at[c, (0, f)] if (0, f) in out.columns else np.nan
+                item[f] = None if pd.isna(v) else float(v)
+            results.append(item)
+
+    elapsed = (time.perf_counter() - t0) * 1000
+    logger.debug(f"选股 {expr}: {len(results)} 个结果, {elapsed:.1f}ms")
+    return {"results": results, "elapsed_ms": round(elapsed, 2)}
@@ -0,0 +1,108 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-08 20:14:37
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-08 20:14:37
+FilePath: /mss_qianshou/app/qianshou/series_cache.py
+Description: 行情序列内存缓存（LRU），用于临时公式计算
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os, threading
+import pandas as pd
+from collections import OrderedDict
+from datetime import date
+from loguru import logger
+
+from .equity_registry import EQUITY_REGISTRY
+from .indicator_tools import IndicatorEngine, normalize_formula
+from .config import OCSV_DIR, SERIES_CACHE_SIZE
+
+OHLCV_COLUMNS = ["open", "high", "low", "close", "volume"]
+
+
+class SeriesCache:
+    """按标的缓存原始OHLCV数据，超过容量时淘汰最久未使用的标的"""
+    def __init__(self, max_items: int = SERIES_CACHE_SIZE):
+        self.max_items = max(1, max_items)
+        self._items: OrderedDict[str, tuple[int, pd.DataFrame]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ft_name: str) -> pd.DataFrame | None:
+        # 同时比较文件修改时间，其他进程更新了数据时缓存也会失效
+        ocsv_file = os.path.join(OCSV_DIR, f"{ft_name}.csv")
+        mtime = os.stat(ocsv_file).st_mtime_ns if os.path.exists(ocsv_file) else 0
+        with self._lock:
+            item = self._items.get(ft_name)
+            if item is not None and item[0] == mtime:
+                self._items.move_to_end(ft_name)
+                return item[1]
+
+        # 未命中时才读取原始数据文件
+        df = self._load(ft_name)
+        if df is None:
+            return None
+        with self._lock:
+            self._items[ft_name] = (mtime, df)
+            self._items.move_to_end(ft_name)
+            while len(self._items) > self.max_items:
+                evicted, _ = self._items.popitem(last=False)
+                logger.debug(f"行情缓存淘汰 {evicted}")
+        return df
+
+    def invalidate(self, ft_name: str | None = None) -> None:
+        """数据更新后清除缓存，不指定标的则全部清除"""
+        with self._lock:
+            if ft_name is None:
+                self._items.clear()
+            else:
+                self._items.pop(ft_name, None)
+
+    def _load(self, ft_name: str) -> pd.DataFrame | None:
+        ocsv_file = os.path.join(OCSV_DIR, f"{ft_name}.csv")
+        if not os.path.exists(ocsv_file):
+            logger.warning(f"原始数据文件不存在: {ocsv_file}")
+            return None
+        df = pd.read_csv(ocsv_file, index_col=0, parse_dates=True)
+        missing = [c for c in OHLCV_COLUMNS if c not in df.columns]
+        if missing:
+            logger.error(f"原始数据缺少字段 {missing}: {ocsv_file}")
+            return None
+        df = df[OHLCV_COLUMNS].astype("float64").sort_index()
+        return df[~df.index.duplicated(keep="last")]
+
+
+SERIES_CACHE = SeriesCache()
+_engine: IndicatorEngine | None = None
+
+def _get_engine() -> IndicatorEngine:
+    global _engine
+    if _engine is None:
+        _engine = IndicatorEngine()
+    return _engine
+
+def evaluate_formulas(symbols: list, formulas: dict, start_date: date, end_date: date) -> dict:
+    """对一个或多个标的临时计算公式，公式语言与指标集相同"""
+    res = {"results": {}, "errors": {}}
+    formulas = {name.upper(): normalize_formula(f) for name, f in formulas.items()}
+
+    for symbol in symbols:
+        entry = EQUITY_REGISTRY.get(symbol)
+        if entry is None:
+            res["errors"][symbol] = "找不到股票"
+            continue
+        df = SERIES_CACHE.get(entry.futu)
+        if df is None:
+            res["errors"][symbol] = "没有行情数据"
+            continue
+
+        # 用全部历史计算，保证均线等指标有足够的预热数据，再按日期截取
+        out, errors = _get_engine().evaluate(df, formulas)
+        if errors:
+            res["errors"][symbol] = errors
+        out = out[(out.index.date >= start_date) & (out.index.date <= end_date)]
+        out = out.replace([float('inf'), float('-inf')], float('nan')).replace({float('nan'): None})
+        out.insert(0, "date", out.index.date)
+        res["results"][symbol] = out.to_dict(orient="records")
+    return res
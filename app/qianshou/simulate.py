@@ -0,0 +1,319 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-17 10:40:16
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-17 10:40:16
+FilePath: /mss_qianshou/app/qianshou/simulate.py
+Description: 离线压测，用模拟的富途和AKShare接口驱动完整的任务和API
+
+install() 把模拟的 futu、akshare 模块放入 sys.modules，之后的导入都得到模拟模块，
+必须在任何代码导入真实模块之前调用。模拟接口可以设置延迟、K线接口的频率限制和随机失败。
+run_loadtest() 在本进程中启动API服务，依次执行自选股同步和日线更新，
+同时多个线程并发请求查询接口，返回任务耗时、各阶段耗时和接口延迟的 p50/p99。
+由 cli.py loadtest 在独立进程中调用，数据写入临时目录，不影响正式数据。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import sys, time, random, socket, threading, zlib
+import urllib.request, urllib.error
+import numpy as np
+import pandas as pd
+from collections import deque
+from datetime import date, datetime, timedelta
+from types import ModuleType, SimpleNamespace
+from loguru import logger
+
+
+RET_OK = 0
+RET_ERROR = -1
+
+# 模拟财报的项目，港股为中文项目名
+HK_ITEMS = {
+    "资产负债表": {"总资产": 1.0, "总负债": 0.6, "股东权益": 0.4},
+    "利润表": {"营业额": 0.3, "股东应占溢利": 0.05},
+    "现金流量表": {"经营业务现金净额": 0.08},
+}
+
+
+class SimProvider:
+    """模拟接口的共同行为：延迟、K线接口的滑动窗口限频、随机失败，并统计调用次数"""
+    def __init__(self, symbols: int = 20, years: int = 5, latency_ms: float = 50, jitter_ms: float = 20,
+                 fail_rate: float = 0.0, quota: int = 60, window_s: float = 30, seed: int = 0):
+        self.years = years
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.fail_rate = fail_rate
+        self.quota = quota
+        self.window_s = window_s
+        # 港股和美股各一半，A股需要检查IP所在地，不参与模拟
+        self.codes = [f"HK.{i:05d}" if i % 2 else f"US.SIM{i}" for i in range(1, symbols + 1)]
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._kline_times: deque = deque()
+        self.stats: dict[str, dict] = {}
+
+    def call(self, api: str, limited: bool = False) -> str | None:
+        """模拟一次调用，返回错误信息，成功时返回None"""
+        with self._lock:
+            delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            failed = self._rng.random() < self.fail_rate
+            s = self.stats.setdefault(api, {"calls": 0, "errors": 0, "throttled": 0})
+            s["calls"] += 1
+            throttled = False
+            if limited:
+                now = time.monotonic()
+                while self._kline_times and now - self._kline_times[0] >= self.window_s:
+                    self._kline_times.popleft()
+                throttled = len(self._kline_times) >= self.quota
+                if not throttled:
+                    self._kline_times.append(now)
+            if throttled:
+                s["throttled"] += 1
+            elif failed:
+                s["errors"] += 1
+        time.sleep(delay)
+        if throttled:
+            return f"{api}: 请求过于频繁，{self.window_s:g}秒内最多{self.quota}次"
+        if failed:
+            return f"{api}: 模拟的接口错误"
+        return None
+
+    def bars(self, code: str, start: str, end: str) -> pd.DataFrame:
+        """确定性的随机游走日线，同一代码每次生成的历史相同"""
+        first = date.today() - timedelta(days=365 * self.years)
+        start_d = max(datetime.strptime(start, "%Y-%m-%d").date(), first)
+        days = pd.bdate_range(first, datetime.strptime(end, "%Y-%m-%d").date())
+        rng = np.random.default_rng(zlib.crc32(code.encode()))
+        close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, len(days))))
+        volume = rng.integers(1e5, 1e7, len(days)).astype("float64")
+        df = pd.DataFrame({
+            "code": code, "name": code,
+            "time_key": days.strftime("%Y-%m-%d 00:00:00"),
+            "open": close * (1 + rng.normal(0, 0.005, len(days))),
+            "high": close * (1 + np.abs(rng.normal(0, 0.01, len(days)))),
+            "low": close * (1 - np.abs(rng.normal(0, 0.01, len(days)))),
+            "close": close,
+            "volume": volume,
+            "turnover": volume * close,
+            "pe_ratio": 15 + rng.normal(0, 1, len(days)),
+            "turnover_rate": rng.uniform(0.1, 3, len(days)),
+        })
+        return df[days.date >= start_d].reset_index(drop=True)
+
+
+class SimQuoteContext:
+    """模拟 futu.OpenQuoteContext，只实现本项目用到的接口"""
+    sim: SimProvider
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 11111, **kwargs):
+        self.sim.call("connect")
+
+    def request_history_kline(self, code, start=None, end=None, ktype="K_DAY", autype=None, fields=None,
+                              max_count=1000, page_req_key=None, **kwargs):
+        err = self.sim.call("request_history_kline", limited=True)
+        if err:
+            return RET_ERROR, err, None
+        if ktype != "K_DAY":
+            return RET_OK, pd.DataFrame(), None
+        df = self.sim.bars(code, start, end)
+        offset = page_req_key or 0
+        page = df.iloc[offset:offset + max_count].reset_index(drop=True)
+        next_key = offset + max_count if offset + max_count < len(df) else None
+        return RET_OK, page, next_key
+
+    def request_trading_days(self, market=None, start=None, end=None, code=None):
+        err = self.sim.call("request_trading_days")
+        if err:
+            return RET_ERROR, err
+        return RET_OK, [{"time": d.strftime("%Y-%m-%d"), "trade_date_type": "WHOLE"}
+                        for d in pd.bdate_range(start, end)]
+
+    def get_user_security(self, group_name: str):
+        err = self.sim.call("get_user_security")
+        if err:
+            return RET_ERROR, err
+        return RET_OK, pd.DataFrame({"code": self.sim.codes, "name": self.sim.codes})
+
+    def set_handler(self, handler):
+        return RET_OK
+
+    def subscribe(self, codes, subtypes, subscribe_push=True, **kwargs):
+        return RET_OK, None
+
+    def unsubscribe_all(self):
+        return RET_OK, None
+
+    def close(self):
+        pass
+
+
+def _sim_futu(sim: SimProvider) -> ModuleType:
+    mod = ModuleType("futu")
+    mod.OpenQuoteContext = type("OpenQuoteContext", (SimQuoteContext,), {"sim": sim})  # type: ignore
+    mod.RET_OK, mod.RET_ERROR = RET_OK, RET_ERROR  # type: ignore
+    mod.KL_FIELD = SimpleNamespace(DATE_TIME="time_key", OPEN="open", HIGH="high", LOW="low", CLOSE="close",  # type: ignore
+                                   TRADE_VOL="volume", TRADE_VAL="turnover", PE_RATIO="pe_ratio",
+                                   TURNOVER_RATE="turnover_rate")
+    mod.TradeDateMarket = SimpleNamespace(US="US", HK="HK", CN="CN")  # type: ignore
+    mod.SubType = SimpleNamespace(K_DAY="K_DAY", K_1M="K_1M", K_5M="K_5M")  # type: ignore
+    mod.CurKlineHandlerBase = type("CurKlineHandlerBase", (), {"on_recv_rsp": lambda self, rsp_pb: (RET_OK, None)})  # type: ignore
+    return mod
+
+def _sim_akshare(sim: SimProvider) -> ModuleType:
+    mod = ModuleType("akshare")
+
+    def check(api: str):
+        # akshare 出错时直接抛出异常
+        err = sim.call(api)
+        if err:
+            raise ConnectionError(err)
+
+    def basic_info(symbol: str) -> pd.DataFrame:
+        return pd.DataFrame({"item": ["org_name_cn", "org_short_name_cn"], "value": [f"模拟公司{symbol}", symbol]})
+
+    def hk_info(symbol: str) -> pd.DataFrame:
+        check("stock_individual_basic_info_hk_xq")
+        return basic_info(symbol)
+
+    def cn_info(symbol: str) -> pd.DataFrame:
+        check("stock_individual_basic_info_xq")
+        return basic_info(symbol)
+
+    def hk_report(stock: str, symbol: str, indicator: str = "年度") -> pd.DataFrame:
+        check("stock_financial_hk_report_em")
+        rng = np.random.default_rng(zlib.crc32(f"{stock}{symbol}".encode()))
+        base = rng.uniform(1e9, 1e11)
+        rows = []
+        for y in range(date.today().year - sim.years, date.today().year):
+            for item, ratio in HK_ITEMS[symbol].items():
+                rows.append({"SECUCODE": f"{stock}.HK", "REPORT_DATE": f"{y}-12-31 00:00:00",
+                             "NOTICE_DATE": f"{y + 1}-03-{rng.integers(10, 31)} 00:00:00",
+                             "STD_ITEM_NAME": item, "AMOUNT": base * ratio * (1 + 0.1 * (y % 7))})
+        return pd.DataFrame(rows)
+
+    def cn_report(symbol: str) -> pd.DataFrame:
+        check("stock_sheet_by_yearly_em")
+        years = range(date.today().year - sim.years, date.today().year)
+        return pd.DataFrame({"REPORT_DATE": [f"{y}-12-31 00:00:00" for y in years],
+                             "NOTICE_DATE": [f"{y + 1}-04-20 00:00:00" for y in years],
+                             "TOTAL_ASSETS": [1e10 * (1 + 0.1 * i) for i, _ in enumerate(years)]})
+
+    def zh_a_hist(symbol: str, start_date: str, end_date: str, adjust: str = "") -> pd.DataFrame:
+        check("stock_zh_a_hist")
+        df = sim.bars(f"SH.{symbol}", datetime.strptime(start_date, "%Y%m%d").strftime("%Y-%m-%d"),
+                      datetime.strptime(end_date, "%Y%m%d").strftime("%Y-%m-%d"))
+        return pd.DataFrame({"日期": df["time_key"].str[:10], "股票代码": symbol, "开盘": df["open"],
+                             "收盘": df["close"], "最高": df["high"], "最低": df["low"],
+                             "成交量": df["volume"], "成交额": df["turnover"], "换手率": df["turnover_rate"]})
+
+    mod.stock_individual_basic_info_hk_xq = hk_info  # type: ignore
+    mod.stock_individual_basic_info_xq = cn_info  # type: ignore
+    mod.stock_financial_hk_report_em = hk_report  # type: ignore
+    mod.stock_balance_sheet_by_yearly_em = cn_report  # type: ignore
+    mod.stock_profit_sheet_by_yearly_em = cn_report  # type: ignore
+    mod.stock_cash_flow_sheet_by_yearly_em = cn_report  # type: ignore
+    mod.stock_zh_a_hist = zh_a_hist  # type: ignore
+    return mod
+
+def install(sim: SimProvider) -> None:
+    """用模拟模块替换 futu 和 akshare"""
+    for name in ["futu", "akshare"]:
+        if name in sys.modules and not getattr(sys.modules[name], "__sim__", False):
+            raise RuntimeError(f"{name} 已经导入，必须在导入前安装模拟模块")
+    for mod in [_sim_futu(sim), _sim_akshare(sim)]:
+        mod.__sim__ = True  # type: ignore
+        sys.modules[mod.__name__] = mod
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _request(url: str, method: str = "GET") -> int:
+    req = urllib.request.Request(url, data=b"" if method == "POST" else None, method=method)
+    try:
+        with urllib.request.urlopen(req, timeout=600) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def _latency(samples: list) -> dict:
+    ms = np.array([s for s, ok in samples])
+    return {"count": len(samples), "errors": sum(1 for _, ok in samples if not ok),
+            "p50_ms": round(float(np.percentile(ms, 50)), 2) if len(ms) else None,
+            "p99_ms": round(float(np.percentile(ms, 99)), 2) if len(ms) else None,
+            "max_ms": round(float(ms.max()), 2) if len(ms) else None}
+
+def run_loadtest(symbols: int = 20, years: int = 5, latency_ms: float = 50, jitter_ms: float = 20,
+                 fail_rate: float = 0.0, quota: int = 60, window_s: float = 30,
+                 concurrency: int = 8, seed: int = 0) -> dict:
+    """
+    同步自选股、更新日线两个任务依次通过API执行，期间 concurrency 个线程循环请求查询接口
+    """
+    sim = SimProvider(symbols, years, latency_ms, jitter_ms, fail_rate, quota, window_s, seed)
+    install(sim)
+
+    import uvicorn
+    from main import app
+    from .stage_timer import stage_report
+
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    th = threading.Thread(target=server.run, daemon=True)
+    th.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    syms = [c.split(".")[1] for c in sim.codes]
+    queries = {
+        "equities": lambda s: "/equities",
+        "quote": lambda s: f"/equity/quote?symbol={s}&start=2020-01-01",
+        "quote_weekly": lambda s: f"/equity/quote?symbol={s}&period=W&points=200",
+        "finance": lambda s: f"/equity/finance?symbol={s}",
+        "screener": lambda s: "/screener?expr=CLOSE%20%3E%20MA20",
+    }
+    samples: dict[str, list] = {name: [] for name in queries}
+    done = threading.Event()
+
+    def reader(i: int):
+        rng = random.Random(seed + i)
+        while not done.is_set():
+            name = rng.choice(list(queries))
+            t0 = time.perf_counter()
+            try:
+                ok = _request(base + queries[name](rng.choice(syms))) < 500
+            except OSError:
+                ok = False
+            samples[name].append(((time.perf_counter() - t0) * 1000, ok))
+
+    readers = [threading.Thread(target=reader, args=(i,), daemon=True) for i in range(concurrency)]
+    for r in readers:
+        r.start()
+
+    stage_report(reset=True)
+    jobs = {}
+    for job, path in [("futu_sync", "/sync/futu/group"), ("futu_daily", "/update/futu/daily")]:
+        logger.info(f"压测任务 {job} 开始")
+        t0 = time.perf_counter()
+        status = _request(base + path, "POST")
+        jobs[job] = {"status": status, "elapsed_s": round(time.perf_counter() - t0, 3)}
+        logger.info(f"压测任务 {job} 完成: {jobs[job]}")
+
+    done.set()
+    for r in readers:
+        r.join()
+    server.should_exit = True
+    th.join()
+
+    return {
+        "settings": {"symbols": symbols, "years": years, "latency_ms": latency_ms, "jitter_ms": jitter_ms,
+                     "fail_rate": fail_rate, "quota": quota, "window_s": window_s, "concurrency": concurrency},
+        "jobs": jobs,
+        "stages": stage_report(),
+        "api": {name: _latency(s) for name, s in samples.items()},
+        "provider": sim.stats,
+    }
@@ -0,0 +1,94 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-19 09:48:26
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-19 09:48:26
+FilePath: /mss_qianshou/app/qianshou/single_flight.py
+Description: 相同请求的合并执行
+
+同一个key同时只执行一次，执行期间到达的相同请求等待并共享结果；
+完成后结果再保留 ttl 秒，紧接着到达的相同请求直接使用。执行出错时所有等待者都收到同一个异常，错误不缓存。
+只在本进程内合并，多个worker之间不共享。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import time, threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+from .config import SINGLE_FLIGHT_TTL_S, SINGLE_FLIGHT_MAX
+
+
+class _Call:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    def __init__(self, ttl: float = SINGLE_FLIGHT_TTL_S, max_items: int = SINGLE_FLIGHT_MAX):
+        self.ttl = ttl
+        self.max_items = max(1, max_items)
+        self._calls: dict[Hashable, _Call] = {}
+        self._results: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "shared": 0, "cached": 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            item = self._results.get(key)
+            if item is not None:
+                if item[0] > now:
+                    self.stats["cached"] += 1
+                    return item[1]
+                del self._results[key]
+            call = self._calls.get(key)
+            leader = call is None
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.stats["calls"] += 1
+            else:
+                self.stats["shared"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if call.error is None and self.ttl > 0:
+                    self._store(key, call.value)
+            call.done.set()
+        return call.value
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        # 所有结果的有效期相同，按加入顺序就是按过期顺序
+        now = time.monotonic()
+        self._results[key] = (now + self.ttl, value)
+        self._results.move_to_end(key)
+        while self._results:
+            k, (expires, _) = next(iter(self._results.items()))
+            if expires > now and len(self._results) <= self.max_items:
+                break
+            del self._results[k]
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._results.clear()
+
+
+# 查询接口共用
+REQUEST_FLIGHT = SingleFlight()
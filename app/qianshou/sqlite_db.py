@@ -9,20 +9,23 @@ Description:
 Copyright (c) 2025 by ${git_name_email}, All Rights Reserved. 
 '''
 
-import os, sqlite3
-from pathlib import Path
+import os, json, sqlite3
 from typing import Any
 from loguru import logger
-from dotenv import load_dotenv
 
 from .models import Equity
+from .config import DB_FILE
 
 
-# 加载环境变量
-BASE_DIR = Path(__file__).resolve().parent
-load_dotenv(dotenv_path=BASE_DIR / ".." / ".env")
-DB_FILE = os.getenv("DB_FILE", "qianshou.db")
+# 标的表的本进程修改计数，写入标的的函数都会增加，equity_registry 据此判断是否需要重新加载
+_equities_version = 0
 
+def _equities_changed() -> None:
+    global _equities_version
+    _equities_version += 1
+
+def equities_version_local() -> int:
+    return _equities_version
 
 # 初始化数据库
 def init_db():
@@ -48,6 +51,59 @@ def init_db():
         last_date TIMESTAMP, updated_at TIMESTAMP
     )""")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_equities_symbol ON equities(symbol)")
+    # 最近几根K线的全部字段，lag=0为最新一根，用于横截面选股
+    cur.execute("""CREATE TABLE IF NOT EXISTS indicator_snapshot(
+        code TEXT NOT NULL, lag INTEGER NOT NULL, date TEXT,
+        field TEXT NOT NULL, value REAL,
+        PRIMARY KEY(code, lag, field)
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_field ON indicator_snapshot(field, lag, value)")
+    # 财报的全部项目，item为统一后的项目名，raw_item为数据源中的原始名称
+    cur.execute("""CREATE TABLE IF NOT EXISTS finance_items(
+        symbol TEXT NOT NULL, statement TEXT NOT NULL, report_date TEXT NOT NULL,
+        item TEXT NOT NULL, raw_item TEXT NOT NULL, value REAL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY(symbol, statement, report_date, raw_item)
+    ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_finance_item ON finance_items(item, report_date)")
+    # 旧的财报表没有公告日期
+    columns = [r[1] for r in cur.execute("PRAGMA table_info(finance_items)").fetchall()]
+    if "notice_date" not in columns:
+        cur.execute("ALTER TABLE finance_items ADD COLUMN notice_date TEXT")
+    # 非数值的项目（币种、审计意见等）保存在 text 中，value 为空
+    if "text" not in columns:
+        cur.execute("ALTER TABLE finance_items ADD COLUMN text TEXT")
+    # 上次同步完成的自选列表，下次同步只处理增减的部分
+    cur.execute("""CREATE TABLE IF NOT EXISTS watchlist_snapshot(
+        code TEXT PRIMARY KEY, synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID""")
+    # 日线更新的运行记录和每个标的的进度，进程中途退出后下次运行从断点继续
+    cur.execute("""CREATE TABLE IF NOT EXISTS update_runs(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job TEXT NOT NULL, run_key TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'running',
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, finished_at TIMESTAMP
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_update_runs ON update_runs(job, run_key, status)")
+    cur.execute("""CREATE TABLE IF NOT EXISTS update_progress(
+        run_id INTEGER NOT NULL, code TEXT NOT NULL, stage TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY(run_id, code)
+    ) WITHOUT ROWID""")
+    # 等待性能分析的任务或接口，remaining 为还要分析的次数
+    cur.execute("""CREATE TABLE IF NOT EXISTS profile_requests(
+        target TEXT PRIMARY KEY, remaining INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID""")
+    # 非主进程收到的任务请求，由主进程取出执行
+    cur.execute("""CREATE TABLE IF NOT EXISTS job_triggers(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job TEXT NOT NULL, kwargs TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, taken_at TIMESTAMP
+    )""")
+    # 主进程订阅的实时K线和指标，其他worker查询时读取
+    cur.execute("""CREATE TABLE IF NOT EXISTS live_quotes(
+        code TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID""")
     # 提交事务并关闭连接
     conn.commit()
     conn.close()
@@ -61,6 +117,7 @@ def add_equity(e: Equity) -> Any:
     conn.commit()
     rule_id = cur.lastrowid
     conn.close()
+    _equities_changed()
     return rule_id
 
 def get_equities(only_valid: bool = True) -> list[Any]:
@@ -73,6 +130,15 @@ def get_equities(only_valid: bool = True) -> list[Any]:
     conn.close()
     return rows
 
+def get_equities_version() -> Any:
+    # 用于生成列表接口的缓存验证器
+    conn = sqlite3.connect(DB_FILE)
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("SELECT COUNT(*) AS cnt, SUM(enabled) AS enabled, MAX(updated_at) AS updated_at, "
+                       "MAX(last_date) AS last_date FROM equities").fetchone()
+    conn.close()
+    return row
+
 def get_equity(e_id: int) -> Any:
     conn = sqlite3.connect(DB_FILE)
     conn.row_factory = sqlite3.Row
@@ -100,25 +166,46 @@ def update_equity(e_id: int, e: Equity) -> Any:
                  (e.symbol.upper(), e.market.upper(), e.note, int(e.enabled), e_id))
     conn.commit()
     conn.close()
+    _equities_changed()
     return e_id
 
-def set_equities_last() -> Any:
+def set_equities_last(markets: list | None = None) -> Any:
     conn = sqlite3.connect(DB_FILE)
-    conn.execute("UPDATE equities SET last_date=CURRENT_TIMESTAMP WHERE enabled=1")
+    if markets:
+        ph = ','.join('?' for _ in markets)
+        conn.execute(f"UPDATE equities SET last_date=CURRENT_TIMESTAMP WHERE enabled=1 AND market IN ({ph})",
+                     [m.upper() for m in markets])
+    else:
+        conn.execute("UPDATE equities SET last_date=CURRENT_TIMESTAMP WHERE enabled=1")
     conn.commit()
     conn.close()
+    _equities_changed()
+
+def set_equities_last_symbols(symbols: list) -> None:
+    if not symbols:
+        return
+    ph = ','.join('?' for _ in symbols)
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute(f"UPDATE equities SET last_date=CURRENT_TIMESTAMP WHERE symbol IN ({ph})",
+                 [s.upper() for s in symbols])
+    conn.commit()
+    conn.close()
+    _equities_changed()
 
 def delete_equity(rule_id: int) -> None:
     conn = sqlite3.connect(DB_FILE)
-    conn.execute("UPDATE equities SET enabled=0 WHERE id=?", (rule_id,))
+    # 同时更新修改时间，列表接口的ETag随之变化
+    conn.execute("UPDATE equities SET enabled=0,updated_at=CURRENT_TIMESTAMP WHERE id=?", (rule_id,))
     conn.commit()
     conn.close()
+    _equities_changed()
 
 def purge_equity(rule_id: int) -> None:
     conn = sqlite3.connect(DB_FILE)
     conn.execute("DELETE FROM equities WHERE id=?", (rule_id,))
     conn.commit()
     conn.close()
+    _equities_changed()
 
 def clear_others_equities(l: list) -> None:
     if not isinstance(l, list) or len(l) == 0:
@@ -129,3 +216,216 @@ def clear_others_equities(l: list) -> None:
     logger.debug(f"clear sql = DELETE FROM equities WHERE symbol NOT IN ({ph}) {l}")
     conn.commit()
     conn.close()
+    _equities_changed()
+
+def get_open_update_run(job: str, run_key: str, max_age_h: float) -> Any:
+    # 未完成且不太旧的运行可以继续，更旧的标记为放弃
+    conn = sqlite3.connect(DB_FILE)
+    conn.row_factory = sqlite3.Row
+    conn.execute("UPDATE update_runs SET status='abandoned', finished_at=CURRENT_TIMESTAMP "
+                 "WHERE job=? AND run_key=? AND status='running' AND started_at < datetime('now', ?)",
+                 (job, run_key, f"-{max_age_h} hours"))
+    conn.commit()
+    row = conn.execute("SELECT * FROM update_runs WHERE job=? AND run_key=? AND status='running' "
+                       "ORDER BY id DESC LIMIT 1", (job, run_key)).fetchone()
+    conn.close()
+    return row
+
+def create_update_run(job: str, run_key: str) -> Any:
+    conn = sqlite3.connect(DB_FILE)
+    cur = conn.cursor()
+    cur.execute("INSERT INTO update_runs(job,run_key) VALUES(?,?)", (job, run_key))
+    conn.commit()
+    run_id = cur.lastrowid
+    conn.close()
+    return run_id
+
+def finish_update_run(run_id: int, status: str = "done") -> None:
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("UPDATE update_runs SET status=?, finished_at=CURRENT_TIMESTAMP WHERE id=?", (status, run_id))
+    conn.commit()
+    conn.close()
+
+def get_update_progress(run_id: int) -> dict:
+    conn = sqlite3.connect(DB_FILE)
+    rows = conn.execute("SELECT code, stage FROM update_progress WHERE run_id=?", (run_id,)).fetchall()
+    conn.close()
+    return {code: stage for code, stage in rows}
+
+def set_update_progress(run_id: int, codes: list, stage: str) -> None:
+    conn = sqlite3.connect(DB_FILE)
+    conn.executemany("INSERT OR REPLACE INTO update_progress(run_id,code,stage,updated_at) "
+                     "VALUES(?,?,?,CURRENT_TIMESTAMP)", [(run_id, c, stage) for c in codes])
+    conn.commit()
+    conn.close()
+
+def get_watchlist_snapshot() -> set:
+    conn = sqlite3.connect(DB_FILE)
+    rows = conn.execute("SELECT code FROM watchlist_snapshot").fetchall()
+    conn.close()
+    return {r[0] for r in rows}
+
+def update_watchlist_snapshot(added: list, removed: list) -> None:
+    conn = sqlite3.connect(DB_FILE)
+    conn.executemany("INSERT OR REPLACE INTO watchlist_snapshot(code,synced_at) VALUES(?,CURRENT_TIMESTAMP)",
+                     [(c,) for c in added])
+    conn.executemany("DELETE FROM watchlist_snapshot WHERE code=?", [(c,) for c in removed])
+    conn.commit()
+    conn.close()
+
+def clear_watchlist_snapshot() -> None:
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("DELETE FROM watchlist_snapshot")
+    conn.commit()
+    conn.close()
+
+def get_existing_symbols(symbols: list) -> set:
+    if not symbols:
+        return set()
+    ph = ','.join('?' for _ in symbols)
+    conn = sqlite3.connect(DB_FILE)
+    rows = conn.execute(f"SELECT symbol FROM equities WHERE symbol IN ({ph})", [s.upper() for s in symbols]).fetchall()
+    conn.close()
+    return {r[0] for r in rows}
+
+def add_job_trigger(job: str, kwargs: dict | None = None) -> Any:
+    conn = sqlite3.connect(DB_FILE)
+    cur = conn.cursor()
+    cur.execute("INSERT INTO job_triggers(job,kwargs) VALUES(?,?)", (job, json.dumps(kwargs or {})))
+    conn.commit()
+    trigger_id = cur.lastrowid
+    conn.close()
+    return trigger_id
+
+def take_job_triggers() -> list[dict]:
+    # 取出并标记待执行的任务，同一个任务只会被取出一次
+    conn = sqlite3.connect(DB_FILE, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("BEGIN IMMEDIATE")
+    rows = conn.execute("SELECT * FROM job_triggers WHERE taken_at IS NULL ORDER BY id").fetchall()
+    if rows:
+        ph = ','.join('?' for _ in rows)
+        conn.execute(f"UPDATE job_triggers SET taken_at=CURRENT_TIMESTAMP WHERE id IN ({ph})", [r["id"] for r in rows])
+    conn.execute("COMMIT")
+    conn.close()
+    return [{"id": r["id"], "job": r["job"], "kwargs": json.loads(r["kwargs"] or "{}")} for r in rows]
+
+def set_profile_request(target: str, count: int) -> None:
+    # count<=0 时取消
+    conn = sqlite3.connect(DB_FILE)
+    if count > 0:
+        conn.execute("INSERT OR REPLACE INTO profile_requests(target,remaining,created_at) "
+                     "VALUES(?,?,CURRENT_TIMESTAMP)", (target, count))
+    else:
+        conn.execute("DELETE FROM profile_requests WHERE target=?", (target,))
+    conn.commit()
+    conn.close()
+
+def get_profile_requests() -> dict:
+    conn = sqlite3.connect(DB_FILE)
+    rows = conn.execute("SELECT target, remaining FROM profile_requests").fetchall()
+    conn.close()
+    return {target: remaining for target, remaining in rows}
+
+def take_profile_request(target: str) -> bool:
+    # 多个worker同时请求时只有一个能取到
+    conn = sqlite3.connect(DB_FILE, isolation_level=None)
+    conn.execute("BEGIN IMMEDIATE")
+    taken = conn.execute("UPDATE profile_requests SET remaining=remaining-1 WHERE target=? AND remaining>0",
+                         (target,)).rowcount > 0
+    conn.execute("DELETE FROM profile_requests WHERE target=? AND remaining<=0", (target,))
+    conn.execute("COMMIT")
+    conn.close()
+    return taken
+
+def replace_snapshot(codes: list, rows: list) -> None:
+    # rows: (code, lag, date, field, value)，整体替换这些标的的快照
+    conn = sqlite3.connect(DB_FILE)
+    ph = ','.join('?' for _ in codes)
+    conn.execute(f"DELETE FROM indicator_snapshot WHERE code IN ({ph})", codes)
+    conn.executemany("INSERT INTO indicator_snapshot(code,lag,date,field,value) VALUES(?,?,?,?,?)", rows)
+    conn.commit()
+    conn.close()
+
+def filter_snapshot_codes(field: str, lag: int, op: str, value: float) -> set:
+    # 单个字段的范围过滤，使用 (field, lag, value) 索引；op 由调用方限定为比较运算符
+    conn = sqlite3.connect(DB_FILE)
+    rows = conn.execute(f"SELECT code FROM indicator_snapshot WHERE field=? AND lag=? AND value {op} ?",
+                        (field, lag, value)).fetchall()
+    conn.close()
+    return {r[0] for r in rows}
+
+def load_snapshot(fields: list, max_lag: int, codes: list | None = None) -> list:
+    conn = sqlite3.connect(DB_FILE)
+    ph = ','.join('?' for _ in fields)
+    sql = f"SELECT code, lag, date, field, value FROM indicator_snapshot WHERE field IN ({ph}) AND lag<=?"
+    params = list(fields) + [max_lag]
+    if codes is not None:
+        sql += f" AND code IN ({','.join('?' for _ in codes)})"
+        params += list(codes)
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+    return rows
+
+def replace_finance_items(symbol: str, statement: str, rows: list) -> None:
+    # rows: (report_date, notice_date, item, raw_item, value, text)，整体替换该标的的一张报表
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("DELETE FROM finance_items WHERE symbol=? AND statement=?", (symbol.upper(), statement))
+    conn.executemany("INSERT INTO finance_items(symbol,statement,report_date,notice_date,item,raw_item,value,text) VALUES(?,?,?,?,?,?,?,?)",
+                     [(symbol.upper(), statement, *r) for r in rows])
+    conn.commit()
+    conn.close()
+
+def has_finance_statement(symbol: str, statement: str) -> bool:
+    conn = sqlite3.connect(DB_FILE)
+    row = conn.execute("SELECT 1 FROM finance_items WHERE symbol=? AND statement=? LIMIT 1",
+                       (symbol.upper(), statement)).fetchone()
+    conn.close()
+    return (row is not None)
+
+def get_finance_items(symbol: str, start: str, end: str) -> list:
+    conn = sqlite3.connect(DB_FILE)
+    rows = conn.execute("SELECT statement, report_date, notice_date, raw_item, COALESCE(value, text) FROM finance_items "
+                        "WHERE symbol=? AND report_date BETWEEN ? AND ?", (symbol.upper(), start, end)).fetchall()
+    conn.close()
+    return rows
+
+def get_finance_version(symbol: str) -> Any:
+    conn = sqlite3.connect(DB_FILE)
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("SELECT COUNT(*) AS cnt, MAX(updated_at) AS updated_at FROM finance_items WHERE symbol=?",
+                       (symbol.upper(),)).fetchone()
+    conn.close()
+    return row
+
+def get_finance_item_all(item: str, start: str, end: str) -> list:
+    # 使用 (item, report_date) 索引
+    conn = sqlite3.connect(DB_FILE)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("SELECT symbol, statement, report_date, raw_item, COALESCE(value, text) AS value FROM finance_items "
+                        "WHERE item=? AND report_date BETWEEN ? AND ? ORDER BY report_date, symbol",
+                        (item, start, end)).fetchall()
+    conn.close()
+    return rows
+
+def get_finance_pit(symbol: str, items: list) -> list:
+    conn = sqlite3.connect(DB_FILE)
+    ph = ','.join('?' for _ in items)
+    rows = conn.execute(f"SELECT report_date, notice_date, item, value FROM finance_items "
+                        f"WHERE symbol=? AND item IN ({ph}) AND value IS NOT NULL", [symbol.upper()] + list(items)).fetchall()
+    conn.close()
+    return rows
+
+def save_live_quotes(quotes: dict) -> None:
+    # quotes: {futu代码: 实时数据}
+    conn = sqlite3.connect(DB_FILE)
+    conn.executemany("INSERT OR REPLACE INTO live_quotes(code,data,updated_at) VALUES(?,?,CURRENT_TIMESTAMP)",
+                     [(code, json.dumps(q, ensure_ascii=False, default=str)) for code, q in quotes.items()])
+    conn.commit()
+    conn.close()
+
+def get_live_quote(code: str) -> dict | None:
+    conn = sqlite3.connect(DB_FILE)
+    row = conn.execute("SELECT data FROM live_quotes WHERE code=?", (code,)).fetchone()
+    conn.close()
+    return None if row is None else json.loads(row[0])
@@ -0,0 +1,43 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-17 10:12:35
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-17 10:12:35
+FilePath: /mss_qianshou/app/qianshou/stage_timer.py
+Description: 任务分阶段计时
+
+日线更新、自选股同步等任务按阶段累计调用次数和耗时，例如 daily.fetch、daily.indicators、sync.finance，
+用于压测时分析时间花在哪里。阶段可以嵌套，外层阶段的耗时包含内层。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import time, threading
+from contextlib import contextmanager
+
+
+_lock = threading.Lock()
+_stages: dict[str, list] = {}   # 阶段 -> [次数, 总耗时, 最大耗时]
+
+
+@contextmanager
+def stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        with _lock:
+            s = _stages.setdefault(name, [0, 0.0, 0.0])
+            s[0] += 1
+            s[1] += elapsed
+            s[2] = max(s[2], elapsed)
+
+def stage_report(reset: bool = False) -> dict:
+    """各阶段的次数、总耗时和最大耗时（秒），reset=True 时同时清零"""
+    with _lock:
+        res = {name: {"count": c, "total_s": round(total, 4), "max_s": round(longest, 4)}
+               for name, (c, total, longest) in sorted(_stages.items())}
+        if reset:
+            _stages.clear()
+    return res
@@ -0,0 +1,24 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-22 10:02:11
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-22 10:02:11
+FilePath: /mss_qianshou/tests/conftest.py
+Description: 测试公共配置
+
+配置在导入时读取环境变量，所以在导入 qianshou 之前把数据目录和数据库指向临时目录。
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os, sys, tempfile
+
+_TMP = tempfile.mkdtemp(prefix="qianshou_test_")
+os.environ["DATA_DIR"] = os.path.join(_TMP, "data")
+os.environ["DB_FILE"] = os.path.join(_TMP, "qianshou.db")
+os.environ["LOG_FILE"] = os.path.join(_TMP, "qianshou.log")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from qianshou.config import ensure_dirs
+
+ensure_dirs()
@@ -0,0 +1,78 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-22 10:31:52
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-22 10:31:52
+FilePath: /mss_qianshou/tests/test_bin_tools.py
+Description: 增量写入Qlib BIN
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import os
+import numpy as np
+import pandas as pd
+
+from qianshou.bin_tools import write_qlib_bins, read_qlib_bins, _read_calendar, _read_instruments
+
+
+def _frame(dates: list, base: float) -> pd.DataFrame:
+    n = len(dates)
+    return pd.DataFrame({"close": base + np.arange(n), "volume": np.full(n, 10.0)}, index=dates)
+
+def _snapshot(qlib_dir: str, code: str) -> dict:
+    features = os.path.join(qlib_dir, "features", code.lower())
+    return {f: open(os.path.join(features, f), "rb").read() for f in sorted(os.listdir(features))}
+
+def test_first_write_aligns_to_calendar(tmp_path):
+    qlib_dir = str(tmp_path)
+    a = _frame(["2024-01-02", "2024-01-04", "2024-01-05"], 1.0)
+    b = _frame(["2024-01-03", "2024-01-04"], 100.0)
+    assert write_qlib_bins(qlib_dir, {"HK.00700": a, "US.AAPL": b})
+
+    cal = _read_calendar(qlib_dir)
+    assert cal == ["2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05"]
+    got = read_qlib_bins(qlib_dir, "HK.00700", cal)
+    # 其他标的有而本标的缺失的日期为NaN
+    assert got.index.tolist() == cal
+    assert np.isnan(got.loc["2024-01-03", "close"])
+    assert got.loc[a.index, "close"].tolist() == [1.0, 2.0, 3.0]
+    assert read_qlib_bins(qlib_dir, "US.AAPL", cal)["close"].tolist() == [100.0, 101.0]
+    assert _read_instruments(os.path.join(qlib_dir, "instruments", "all.txt")) == {
+        "HK.00700": ("2024-01-02", "2024-01-05"), "US.AAPL": ("2024-01-03", "2024-01-04")}
+
+def test_appending_days_leaves_other_instruments(tmp_path):
+    qlib_dir = str(tmp_path)
+    a = _frame(["2024-01-02", "2024-01-03"], 1.0)
+    b = _frame(["2024-01-02", "2024-01-03"], 100.0)
+    write_qlib_bins(qlib_dir, {"HK.00700": a, "US.AAPL": b})
+    before = _snapshot(qlib_dir, "US.AAPL")
+
+    a = _frame(["2024-01-02", "2024-01-03", "2024-01-04"], 1.0)
+    assert write_qlib_bins(qlib_dir, {"HK.00700": a})
+    cal = _read_calendar(qlib_dir)
+    assert cal[-1] == "2024-01-04"
+    assert _snapshot(qlib_dir, "US.AAPL") == before
+    assert read_qlib_bins(qlib_dir, "HK.00700", cal)["close"].tolist() == [1.0, 2.0, 3.0]
+    assert read_qlib_bins(qlib_dir, "US.AAPL", cal)["close"].tolist() == [100.0, 101.0]
+    assert _read_instruments(os.path.join(qlib_dir, "instruments", "all.txt"))["US.AAPL"] == ("2024-01-02", "2024-01-03")
+
+def test_inserting_days_needs_rebuild(tmp_path):
+    qlib_dir = str(tmp_path)
+    write_qlib_bins(qlib_dir, {"HK.00700": _frame(["2024-01-03", "2024-01-05"], 1.0)})
+    cal_file = os.path.join(qlib_dir, "calendars", "day.txt")
+    before = open(cal_file).read()
+
+    # 日历中间或之前的新日期会改变其他标的的序号，不写入
+    b = _frame(["2024-01-02", "2024-01-04"], 100.0)
+    assert not write_qlib_bins(qlib_dir, {"US.AAPL": b})
+    assert open(cal_file).read() == before
+    assert not os.path.exists(os.path.join(qlib_dir, "features", "us.aapl"))
+
+    a = read_qlib_bins(qlib_dir, "HK.00700", _read_calendar(qlib_dir))
+    assert write_qlib_bins(qlib_dir, {"HK.00700": a, "US.AAPL": b}, rebuild=True)
+    cal = _read_calendar(qlib_dir)
+    assert cal == ["2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05"]
+    got = read_qlib_bins(qlib_dir, "HK.00700", cal)
+    assert got.dropna()["close"].tolist() == [1.0, 2.0]
+    assert got.dropna().index.tolist() == ["2024-01-03", "2024-01-05"]
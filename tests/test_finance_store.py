@@ -0,0 +1,57 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-22 10:21:30
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-22 10:21:30
+FilePath: /mss_qianshou/tests/test_finance_store.py
+Description: 财报项目按公告日对齐到交易日（PIT）
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import numpy as np
+import pandas as pd
+
+from qianshou import finance_store
+from qianshou.config import PIT_NOTICE_LAG_D
+
+
+ROWS = [
+    # (报告期, 公告日, 项目, 数值)
+    ("2023-12-31", "2024-03-20", "TOTAL_ASSETS", 100.0),
+    # 同一期在另一张报表中的同名项目
+    ("2023-12-31", "2024-03-20", "TOTAL_ASSETS", 100.0),
+    ("2024-06-30", "2024-08-15", "TOTAL_ASSETS", 120.0),
+    # 旧报告期晚公告的更正，不能覆盖已公告的新一期
+    ("2023-12-31", "2024-09-01", "TOTAL_ASSETS", 105.0),
+    # 没有公告日，按报告期后 PIT_NOTICE_LAG_D 天计
+    ("2024-12-31", None, "TOTAL_ASSETS", 130.0),
+]
+
+
+def _pit(monkeypatch, dates: list, rows: list = ROWS) -> pd.DataFrame:
+    monkeypatch.setattr(finance_store, "get_finance_pit", lambda symbol, items: rows)
+    return finance_store.pit_features("00700.HK", pd.DatetimeIndex(dates), ["TOTAL_ASSETS", "PARENT_NETPROFIT"])
+
+def test_values_known_from_notice_date(monkeypatch):
+    lagged = (pd.Timestamp("2024-12-31") + pd.Timedelta(days=PIT_NOTICE_LAG_D))
+    dates = ["2024-03-19", "2024-03-20", "2024-08-14", "2024-08-15", "2024-09-02",
+             str((lagged - pd.Timedelta(days=1)).date()), str(lagged.date())]
+    out = _pit(monkeypatch, dates)
+    assert list(out.columns) == ["fin_total_assets", "fin_parent_netprofit"]
+    values = out["fin_total_assets"].tolist()
+    assert np.isnan(values[0])
+    assert values[1:] == [100.0, 100.0, 120.0, 120.0, 120.0, 130.0]
+    assert out["fin_parent_netprofit"].isna().all()
+
+def test_keeps_order_of_requested_dates(monkeypatch):
+    dates = ["2024-09-02", "2024-03-21", "2024-01-02"]
+    out = _pit(monkeypatch, dates)
+    assert list(out.index) == list(pd.DatetimeIndex(dates))
+    assert out["fin_total_assets"].tolist()[:2] == [120.0, 100.0]
+    assert np.isnan(out["fin_total_assets"].iloc[2])
+
+def test_no_rows_gives_empty_columns(monkeypatch):
+    out = _pit(monkeypatch, ["2024-03-21"], rows=[])
+    assert out.shape == (1, 2)
+    assert out.isna().all().all()
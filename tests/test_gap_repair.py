@@ -0,0 +1,50 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-22 10:26:14
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-22 10:26:14
+FilePath: /mss_qianshou/tests/test_gap_repair.py
+Description: 按交易日历查找缺失的K线
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import pandas as pd
+from datetime import date
+
+from qianshou.gap_repair import find_gaps
+from qianshou.market_calendar import save_market_calendar
+
+
+# 2024年农历新年 2月12、13日休市
+HOLIDAYS = ["2024-02-12", "2024-02-13"]
+DAYS = [d for d in pd.bdate_range("2024-01-01", "2024-03-29").strftime("%Y-%m-%d") if d not in HOLIDAYS]
+save_market_calendar("HK", DAYS)
+
+
+def _stored(missing: list, since: str = "2024-01-01") -> pd.DatetimeIndex:
+    # 日历开始之前的数据不检查
+    before = pd.bdate_range(since, "2023-12-31")
+    return before.append(pd.DatetimeIndex([d for d in DAYS if d not in missing]))
+
+def test_groups_adjacent_trading_days():
+    stored = _stored(["2024-01-10", "2024-01-11", "2024-02-09", "2024-02-14"], since="2023-12-01")
+    assert find_gaps(stored, "HK") == [
+        (date(2024, 1, 10), date(2024, 1, 11), 2),
+        # 中间隔着休市日，仍是同一个区间
+        (date(2024, 2, 9), date(2024, 2, 14), 2),
+    ]
+
+def test_no_gaps_and_start_filter():
+    assert find_gaps(_stored([]), "HK") == []
+    stored = _stored(["2024-01-10", "2024-03-01"])
+    assert find_gaps(stored, "hk", start=date(2024, 2, 1)) == [(date(2024, 3, 1), date(2024, 3, 1), 1)]
+
+def test_only_between_first_and_last_bar():
+    stored = pd.DatetimeIndex(DAYS[10:20])
+    assert find_gaps(stored, "HK") == []
+
+def test_market_without_calendar():
+    stored = _stored(["2024-01-10"])
+    assert find_gaps(stored, "TW") == []
+    assert find_gaps(pd.DatetimeIndex([]), "HK") == []
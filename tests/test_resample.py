@@ -0,0 +1,88 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-22 10:05:37
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-22 10:05:37
+FilePath: /mss_qianshou/tests/test_resample.py
+Description: 周期合成与LTTB降采样
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import numpy as np
+import pandas as pd
+
+from qianshou.resample import resample_period, lttb_indices, downsample_lttb, reshape_quote
+
+
+def _daily(start: str, n: int) -> pd.DataFrame:
+    dates = pd.bdate_range(start, periods=n)
+    x = np.arange(n, dtype="float64")
+    return pd.DataFrame({
+        "date": dates.date,
+        "$OPEN": x + 1,
+        "$HIGH": x + 2,
+        "$LOW": x,
+        "$CLOSE": x + 1.5,
+        "$VOLUME": np.full(n, 100.0),
+        "$MA5": x * 10,
+    })
+
+def test_weekly_ohlcv_aggregation():
+    # 2024-01-01 是周一，两周共10个交易日
+    out = resample_period(_daily("2024-01-01", 10), "W")
+    assert [str(d) for d in out["date"]] == ["2024-01-05", "2024-01-12"]
+    assert out["$OPEN"].tolist() == [1.0, 6.0]
+    assert out["$HIGH"].tolist() == [6.0, 11.0]
+    assert out["$LOW"].tolist() == [0.0, 5.0]
+    assert out["$CLOSE"].tolist() == [5.5, 10.5]
+    assert out["$VOLUME"].tolist() == [500.0, 500.0]
+    # 其他字段取周期内最后一个值
+    assert out["$MA5"].tolist() == [40.0, 90.0]
+
+def test_month_and_quarter_use_last_trading_day():
+    df = _daily("2024-01-01", 130)
+    months = resample_period(df, "m")
+    quarters = resample_period(df, "Q")
+    assert [str(d) for d in months["date"][:3]] == ["2024-01-31", "2024-02-29", "2024-03-29"]
+    assert [str(d) for d in quarters["date"][:2]] == ["2024-03-29", "2024-06-28"]
+    assert quarters["$VOLUME"].iloc[0] == 100.0 * len(pd.bdate_range("2024-01-01", "2024-03-31"))
+
+def test_suspended_period_volume_is_nan():
+    df = _daily("2024-01-01", 10)
+    df.loc[5:, ["$OPEN", "$HIGH", "$LOW", "$CLOSE", "$VOLUME"]] = np.nan
+    out = resample_period(df, "W")
+    assert out["$VOLUME"].iloc[0] == 500.0
+    assert np.isnan(out["$VOLUME"].iloc[1])
+
+def test_lttb_keeps_endpoints_and_spike():
+    x = np.arange(200, dtype="float64")
+    y = np.zeros(200)
+    y[77] = 50.0
+    idx = lttb_indices(x, y, 20)
+    assert len(idx) == 20
+    assert idx[0] == 0 and idx[-1] == 199
+    assert (np.diff(idx) > 0).all()
+    assert 77 in idx
+
+def test_lttb_returns_all_points_when_not_reducing():
+    x = np.arange(10, dtype="float64")
+    assert lttb_indices(x, x, 10).tolist() == list(range(10))
+    assert lttb_indices(x, x, 2).tolist() == list(range(10))
+
+def test_downsample_keeps_all_fields_and_skips_missing_close():
+    df = _daily("2024-01-01", 50)
+    df.loc[10, "$CLOSE"] = np.nan
+    out = downsample_lttb(df, 10)
+    assert len(out) == 10
+    assert list(out.columns) == list(df.columns)
+    assert out["$CLOSE"].notna().all()
+    assert out["date"].iloc[0] == df["date"].iloc[0]
+    assert out["date"].iloc[-1] == df["date"].iloc[-1]
+
+def test_reshape_quote_resamples_before_downsampling():
+    df = _daily("2024-01-01", 100)
+    assert reshape_quote(df, "D") is df
+    out = reshape_quote(df, "W", 5)
+    assert len(out) == 5
+    assert out["date"].iloc[-1] == resample_period(df, "W")["date"].iloc[-1]
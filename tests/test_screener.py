@@ -0,0 +1,50 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-22 10:16:48
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-22 10:16:48
+FilePath: /mss_qianshou/tests/test_screener.py
+Description: 选股条件的解析和SQL下推
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import pytest
+
+from qianshou.screener import _parse, _collect, _pushdown
+
+
+def _conds(expr: str) -> list:
+    return _pushdown(_parse(expr))
+
+def test_top_level_and_is_pushed_down():
+    assert _conds("CLOSE > 10 AND VOL <= 5e6") == [("CLOSE", ">", 10.0), ("VOLUME", "<=", 5e6)]
+
+def test_constant_on_left_is_flipped():
+    assert _conds("10 < C and 3 >= RSI") == [("CLOSE", ">", 10.0), ("RSI", "<=", 3.0)]
+
+def test_chained_compare_becomes_two_conditions():
+    assert _conds("1 < CLOSE < 3") == [("CLOSE", ">", 1.0), ("CLOSE", "<", 3.0)]
+
+def test_only_top_level_field_constant_comparisons():
+    assert _conds("CLOSE > 10 OR VOL > 5") == []
+    assert _conds("NOT CLOSE > 10") == []
+    assert _conds("CLOSE > MA5 AND REF(CLOSE, 1) > 3 AND ABS(CHG) > 2") == []
+    assert _conds("CLOSE != 3") == []
+    assert _conds("CLOSE > 10 AND (VOL > 5 OR OPEN > 1)") == [("CLOSE", ">", 10.0)]
+
+def test_collect_fields_and_lags():
+    assert _collect(_parse("C > REF(C, 2) AND V > MA5")) == {
+        ("CLOSE", 0), ("CLOSE", 2), ("VOLUME", 0), ("MA5", 0)}
+
+@pytest.mark.parametrize("expr", [
+    "__import__('os')",
+    "CLOSE.real > 1",
+    "FOO(CLOSE) > 1",
+    "REF(CLOSE, 999) > 1",
+    "REF(CLOSE, X) > 1",
+    "[CLOSE][0] > 1",
+])
+def test_collect_rejects_unsafe_or_invalid(expr):
+    with pytest.raises((ValueError, SyntaxError)):
+        _collect(_parse(expr))
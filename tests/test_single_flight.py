@@ -0,0 +1,86 @@
+'''
+Author: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+Date: 2025-09-22 10:11:05
+LastEditors: kevincnzhengyang kevin.cn.zhengyang@gmail.com
+LastEditTime: 2025-09-22 10:11:05
+FilePath: /mss_qianshou/tests/test_single_flight.py
+Description: 相同请求合并执行
+
+Copyright (c) 2025 by ${git_name_email}, All Rights Reserved.
+'''
+
+import time, threading
+import pytest
+
+from qianshou.single_flight import SingleFlight
+
+
+def _run_concurrently(n: int, target) -> list:
+    results = [None] * n
+    def worker(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            results[i] = e
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    return results
+
+def test_concurrent_calls_share_one_execution():
+    sf = SingleFlight(ttl=0)
+    calls = []
+    release = threading.Event()
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return "value"
+    def target():
+        return sf.do("key", fn)
+
+    timer = threading.Timer(0.2, release.set)
+    timer.start()
+    results = _run_concurrently(8, target)
+    assert results == ["value"] * 8
+    assert len(calls) == 1
+    assert sf.stats["calls"] == 1 and sf.stats["shared"] == 7
+
+def test_errors_are_shared_but_not_cached():
+    sf = SingleFlight(ttl=60)
+    release = threading.Event()
+    def fn():
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    threading.Timer(0.2, release.set).start()
+    results = _run_concurrently(4, lambda: sf.do("key", fn))
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert sf.do("key", lambda: "ok") == "ok"
+
+def test_results_cached_within_ttl():
+    sf = SingleFlight(ttl=0.2)
+    counter = iter(range(10))
+    assert sf.do("key", lambda: next(counter)) == 0
+    assert sf.do("key", lambda: next(counter)) == 0
+    assert sf.stats["cached"] == 1
+    time.sleep(0.25)
+    assert sf.do("key", lambda: next(counter)) == 1
+
+def test_invalidate_and_max_items():
+    sf = SingleFlight(ttl=60, max_items=2)
+    for k in "abc":
+        sf.do(k, lambda: k)
+    # 超出数量时最早的结果被淘汰
+    assert sf.do("a", lambda: "new") == "new"
+    assert sf.do("c", lambda: "stale") == "c"
+    sf.invalidate()
+    assert sf.do("c", lambda: "fresh") == "fresh"
+
+def test_different_keys_run_separately():
+    sf = SingleFlight(ttl=0)
+    assert sf.do(("quote", 1), lambda: 1) == 1
+    assert sf.do(("quote", 2), lambda: 2) == 2
+    with pytest.raises(ValueError):
+        sf.do("bad", lambda: int("x"))